@@ -2,22 +2,47 @@ import os
 import numpy as np
 import time
 import datetime
-import requests
+from urllib.parse import urlsplit
 import asyncio
 import ccxt.async_support as ccxt
 import pandas as pd
-from scipy.signal import find_peaks
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
 import config
+import metrics
+import connectors
+import shared_cache
+import artifact_cache
+import snapshot
+import health
+import ratelimit
+import walls
+import downsample
+import utils
 from millify import millify
+# matplotlib (and charts.py) are imported by the chart renderers only: the text mode of /ob
+# (get_formatted_ladder) never loads the plotting stack.
+
+
+def override_api_urls(urls, base_url):
+    """
+    Point the API URLs of a ccxt exchange to another host, keeping the paths.
+    :param urls: the exchange.urls['api'] value (string or nested dicts)
+    :param base_url: Example: http://127.0.0.1:8080
+    :return: the new urls
+    """
+    if isinstance(urls, str):
+        return base_url.rstrip('/') + urlsplit(urls).path
+    if isinstance(urls, dict):
+        return {key: override_api_urls(value, base_url) for key, value in urls.items()}
+    return urls
+
 
 class AggregatedOrderBook():
     """
     This class implement Order Book reading for any specific symbol
     based on a list of exchanges supported by CCXT library.
     More info here: https://github.com/ccxt/ccxt/wiki/Exchange-Markets
-    The library will cache the file in the disk for 1-minute.
+    The library caches the order book in memory and in the disk and serves it for 1-minute
+    (config.order_book_max_age, see artifact_cache.py).
     Calling the function get_order_book() multiple times within 1-minute
     window will deliver the same Bid/Ask information.
     The function also generates a chart and saves it to the disk.
@@ -26,9 +51,9 @@ class AggregatedOrderBook():
 
     api_keys = {
         'binance': {},
-        'okex': {}
+        'okx': {}
     }
-    exchanges = ['binance', 'okex', 'bybit']
+    exchanges = ['binance', 'okx', 'bybit']
     order_book = AggregatedOrderBook(exchanges, api_keys, symbol)
     status = await order_book.get_order_book()
     if not status:
@@ -37,14 +62,18 @@ class AggregatedOrderBook():
     await order_book.close()
 
     - api_keys are optional (not required).
+    - Renamed exchanges are resolved to their current ccxt id (okex -> okx, see ratelimit.venue).
+    - backend is 'ccxt' (default) or 'rest' to use the direct REST connectors (faster,
+      supports binance, okx/okex, bybit and coinbase). Defaults to config.order_book_backend.
     - Symbol should be in the accepted format by exchanges. For example: BTCUSDT, ETHUSDT, DOGEUSDT, ADAUSDT
     - You can then access to order_book.order_book_image to get the chart (PNG).
     - You can also access order_book.get_caption() to get the caption to be associated with the generated image.
+    - Or skip the chart and send order_book.get_formatted_ladder() (text only).
     """
 
     symbol = ""
     order_book_image = ""
-    order_book_csv = ""
+    order_book_snapshot = ""
 
     aggregated_bids = pd.DataFrame()
     aggregated_asks = pd.DataFrame()
@@ -54,6 +83,15 @@ class AggregatedOrderBook():
     buy_size = 0
     sell_size = 0
     bid_ask_ratio = 0
+    # Wall detection settings of the last processed order book
+    wallsize = 100000
+    distance = None
+    # Exchanges left out of the order book: {name: reason}
+    missing_exchanges = {}
+    # Timestamp of the order book data (None = use the modification time of the snapshot file)
+    updated_at = None
+    # True when the last get_order_book() fetched the order books from the exchanges
+    refreshed = False
 
     exchange_abbr = {
         'binance': 'binance',
@@ -61,82 +99,292 @@ class AggregatedOrderBook():
         'bybit': 'bybit'
     }
 
-    def __init__(self, exchanges, api_keys, symbol):
+    def __init__(self, exchanges, api_keys, symbol, backend=None):
         self.exchanges = {}
         self.markets = {}
         self.symbol = symbol
-        self.order_book_image = os.path.join(config.data_path, symbol.replace("/","")+".png")
-        self.order_book_csv = os.path.join(config.data_path, symbol.replace("/","")+".csv")
-
-        for exchange in exchanges:
+        self.backend = backend or config.order_book_backend
+        self.order_book_snapshot = os.path.join(config.artifact_cache_path, symbol.replace("/","")+".snapshot")
+
+        if self.backend == 'rest':
+            # The connectors don't need API keys, the depth endpoints are public
+            for name in exchanges:
+                exchange = ratelimit.venue(name)
+                connector = connectors.get_connector(exchange, config.exchange_api_urls.get(
+                    exchange, config.exchange_api_urls.get(name)))
+                if connector is None:
+                    print(f'Exchange {name} is not supported by the REST connectors.')
+                    continue
+                self.exchanges[exchange] = connector
+            return
+
+        # The requests wait for the process-wide rate limit instead of ccxt's throttling, which
+        # only spaces the calls of one instance (see ratelimit.py)
+        for name in exchanges:
+            # Renamed exchanges (okex is okx in ccxt now), like the scanner
+            exchange = name if name in ccxt.exchanges else ratelimit.venue(name)
             # Ensure the exchange is supported by ccxt
             if exchange not in ccxt.exchanges:
-                print(f'Exchange {exchange} is not supported.')
+                print(f'Exchange {name} is not supported.')
                 continue
 
-            if exchange in api_keys:
-                api_key = api_keys[exchange]["api_key"]
-                secret = api_keys[exchange]["secret"]
+            keys = api_keys.get(exchange, api_keys.get(name))
+            if keys is not None:
+                api_key = keys["api_key"]
+                secret = keys["secret"]
                 self.exchanges[exchange] = getattr(ccxt, exchange)({
                     'apiKey': api_key,
                     'secret': secret,
-                    'enableRateLimit': True,
+                    'enableRateLimit': False,
                     "options": {'defaultType': 'spot'}
                 })
             else:
                 self.exchanges[exchange] = getattr(ccxt, exchange)({
-                    'enableRateLimit': True,
+                    'enableRateLimit': False,
                     "options": {'defaultType': 'spot'}
                 })
+            api_url = config.exchange_api_urls.get(exchange, config.exchange_api_urls.get(name))
+            if api_url is not None:
+                # Mirror or local stand-in
+                self.exchanges[exchange].urls['api'] = override_api_urls(self.exchanges[exchange].urls['api'],
+                                                                         api_url)
 
     async def load_markets(self):
         for name, exchange in self.exchanges.items():
             try:
-                self.markets[name] = await exchange.load_markets()
+                await ratelimit.acquire(name, 'markets')
+                with metrics.stage('load_markets', exchange=name):
+                    self.markets[name] = await exchange.load_markets()
             except Exception as e:
                 print(f'Error loading markets from {exchange}: {e}')
 
-    async def get_order_book(self, wallsize=100000):
+    async def fetch_within_budget(self, fetch):
         """
-        Retrieve order book from exchanges.
-        :param wallsize: Use this value to identify walls equal or bigger of this size in USD.
-        :return: The full order book with bids and asks
+        Call fetch(name) for every healthy exchange concurrently and wait at most
+        config.order_book_budget seconds. The exchanges skipped by their circuit breaker, too
+        slow or failing are left out (partial order book) and listed in self.missing_exchanges.
+        A request slower than the usual p95 latency of its exchange is sent again (health.hedged).
+        :param fetch: coroutine function receiving the exchange name. It returns None when
+                      the exchange has no data for the symbol.
+        :return: {name: result} of the exchanges that answered in time, in the configured order
+        """
+        rate_limited = set()
+
+        async def timed(name):
+            start_time = time.monotonic()
+            # The wait for our own rate limit isn't the exchange's latency
+            with ratelimit.track_waits() as waits:
+                try:
+                    result = await health.hedged(fetch, name, waits)
+                except asyncio.CancelledError:
+                    if waits.waiting:
+                        # Over the budget before the request was sent: not the exchange's fault
+                        rate_limited.add(name)
+                        health.get_health(name).skip()
+                    else:
+                        health.get_health(name).record(time.monotonic() - start_time - waits.waited,
+                                                       success=False)
+                    raise
+                except BaseException:
+                    health.get_health(name).record(time.monotonic() - start_time - waits.waited, success=False)
+                    raise
+            health.get_health(name).record(time.monotonic() - start_time - waits.waited, success=True)
+            return result
+
+        tasks = {}
+        for name in self.exchanges:
+            if health.get_health(name).allow_request():
+                tasks[name] = asyncio.create_task(timed(name))
+            else:
+                self.missing_exchanges[name] = 'circuit open'
+                health.MISSING.inc(exchange=name, reason='circuit_open')
+        if len(tasks) > 0:
+            done, pending = await asyncio.wait(tasks.values(), timeout=config.order_book_budget)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        results = {}
+        for name, task in tasks.items():
+            if task.cancelled() and name in rate_limited:
+                print(f'Order book from {name} still waiting for the rate limit after the '
+                      f'{config.order_book_budget} seconds budget')
+                self.missing_exchanges[name] = 'rate limited'
+                health.MISSING.inc(exchange=name, reason='rate_limited')
+            elif task.cancelled():
+                print(f'Order book from {name} over the {config.order_book_budget} seconds budget')
+                self.missing_exchanges[name] = 'timeout'
+                health.MISSING.inc(exchange=name, reason='timeout')
+            elif task.exception() is not None:
+                print(f'Error fetching order book from {name}: {task.exception()}')
+                self.missing_exchanges[name] = 'error'
+                health.MISSING.inc(exchange=name, reason='error')
+            elif task.result() is None:
+                self.missing_exchanges[name] = 'symbol not listed'
+            else:
+                results[name] = task.result()
+        return results
+
+    async def fetch_order_books_ccxt(self):
+        """
+        Retrieve the order book from every exchange through ccxt (see fetch_within_budget).
+        :return: DataFrame with the Price, Size, Side, Exchange and SizeUSD columns
         """
-        order_books = {}
+        async def fetch(name):
+            exchange = self.exchanges[name]
+            if name not in self.markets:
+                await ratelimit.acquire(name, 'markets')
+                with metrics.stage('load_markets', exchange=name):
+                    self.markets[name] = await exchange.load_markets()
+            if self.symbol not in self.markets[name]:
+                print(f'Exchange {name} does not support symbol {self.symbol}.')
+                return None
+            await ratelimit.acquire(name, 'depth')
+            with metrics.stage('fetch_order_book', exchange=name):
+                return await exchange.fetch_order_book(self.symbol)
+
         order_books_df = pd.DataFrame()
-        cached = False
-        if not self.elapsed_more_than_minute():
-            # The saved file is less than 1 minute old (cached version to avoid overload to exchanges)
-            order_books_df = pd.read_csv(self.order_book_csv)
-            cached = True
-        else:
-            if len(self.markets) == 0:
-                #print("Please call load_markets() first to retrieve available symbols.")
-                await self.load_markets()
-
-            for name, exchange in self.exchanges.items():
-                if self.symbol in self.markets[name]:
-                    try:
-                        order_books[name] = await exchange.fetch_order_book(self.symbol)
-                        for side in ['bids', 'asks']:
-                            if order_books[name][side]:
-                                df = pd.DataFrame(order_books[name][side], columns=['Price', 'Size'])
-                                df['Side'] = 'buy' if side == 'bids' else 'sell'
-                                df['Exchange'] = name
-                                df['SizeUSD'] = df['Price'] * df['Size']
-                                order_books_df = pd.concat([order_books_df, df], ignore_index=True)
-                    except Exception as e:
-                        print(f'Error fetching order book from {name}: {e}')
-                else:
-                     print(f'Exchange {name} does not support symbol {self.symbol}.')
+        for name, order_book in (await self.fetch_within_budget(fetch)).items():
+            for side in ['bids', 'asks']:
+                if order_book[side]:
+                    # Some exchanges add fields after the price and size (OKX: the order count)
+                    df = pd.DataFrame([level[:2] for level in order_book[side]], columns=['Price', 'Size'])
+                    df['Side'] = 'buy' if side == 'bids' else 'sell'
+                    df['Exchange'] = name
+                    df['SizeUSD'] = df['Price'] * df['Size']
+                    order_books_df = pd.concat([order_books_df, df], ignore_index=True)
+        return order_books_df
+
+    async def fetch_order_books_rest(self):
+        """
+        Retrieve the order book from every exchange concurrently through the direct REST
+        connectors (see fetch_within_budget). The levels arrive as float64 arrays and the
+        DataFrame is built once.
+        :return: DataFrame with the Price, Size, Side, Exchange and SizeUSD columns
+        """
+        async def fetch(name):
+            with metrics.stage('fetch_order_book', exchange=name):
+                return await self.exchanges[name].fetch_depth(self.symbol)
+
+        levels, sides, venues = [], [], []
+        for name, depth in (await self.fetch_within_budget(fetch)).items():
+            for side, array in (('buy', depth.bids), ('sell', depth.asks)):
+                levels.append(array)
+                sides.append(np.full(len(array), side, dtype=object))
+                venues.append(np.full(len(array), name, dtype=object))
+        if len(levels) == 0:
+            return pd.DataFrame()
+
+        levels = np.concatenate(levels)
+        return pd.DataFrame({'Price': levels[:, 0],
+                             'Size': levels[:, 1],
+                             'Side': np.concatenate(sides),
+                             'Exchange': np.concatenate(venues),
+                             'SizeUSD': levels[:, 0] * levels[:, 1]})
+
+    async def fetch_order_books(self):
+        """
+        :return: the raw order book of every exchange with the configured backend
+        """
+        if self.backend == 'rest':
+            return await self.fetch_order_books_rest()
+        return await self.fetch_order_books_ccxt()
 
+    async def fetch_shared_order_books(self, cache, max_age=None):
+        """
+        Retrieve the raw order book through the shared cache, so only one bot instance
+        fetches it from the exchanges when it expires.
+        :param cache: shared_cache.SharedCache
+        :param max_age: refresh the cached order book ahead of its expiry when it's older than
+                        this (seconds, default config.shared_cache_ttl). Skipped when another
+                        instance is already refreshing it.
+        :return: (DataFrame, True when we got it from the cache)
+        """
+        refreshed = False
+
+        async def refresh():
+            nonlocal refreshed
+            order_books_df = await self.fetch_order_books()
             if len(order_books_df.index) == 0:
-                return False
+                return None
+            refreshed = True
+            return snapshot.dumps(order_books_df, {'updated_at': time.time()})
+
+        key = "order_book:" + self.symbol.replace("/", "")
+        value = await cache.get_or_refresh_async(key, config.shared_cache_ttl, refresh)
+        if value is None:
+            return pd.DataFrame(), False
+        try:
+            order_books_df, metadata = snapshot.loads(value)
+        except snapshot.SnapshotError as e:
+            # Written by an older version (pickle) or corrupted: replace it
+            print(f"Invalid order book in the shared cache: {e}")
+            await cache.delete_async(key)
+            value = await cache.get_or_refresh_async(key, config.shared_cache_ttl, refresh)
+            if value is None:
+                return pd.DataFrame(), False
+            order_books_df, metadata = snapshot.loads(value)
+        self.updated_at = metadata['updated_at']
+        if not refreshed and max_age is not None and time.time() - self.updated_at > max_age:
+            token = await cache.acquire_lock_async(key, config.shared_cache_lock_ttl)
+            if token is not None:
+                try:
+                    value = await refresh()
+                    if value is not None:
+                        await cache.set_async(key, value, config.shared_cache_ttl)
+                        order_books_df, metadata = snapshot.loads(value)
+                        self.updated_at = metadata['updated_at']
+                finally:
+                    await cache.release_lock_async(key, token)
+        return order_books_df, not refreshed
+
+    async def fetch_current_price(self):
+        """
+        :return: the last price of the symbol on Binance (through the async REST connector with
+                 both backends)
+        """
+        with metrics.stage('ticker', exchange='binance'):
+            return await connectors.Binance(config.exchange_api_urls.get('binance')).fetch_price(self.symbol)
 
-        # Get the current price from binance (even if we have cached OB data)
-        response = requests.get('https://api.binance.com/api/v3/ticker/price', params={'symbol': self.symbol.replace("/","")})
-        self.current_price = float(response.json()['price'])
+    async def current_price_within_budget(self, ticker, start_time, order_books_df):
+        """
+        Wait for the ticker until the end of the order book budget.
+        :param ticker: task of fetch_current_price(), started with the order book fetch
+        :param start_time: time.monotonic() when the order book fetch started
+        :param order_books_df: the order book, for its mid price when the ticker is late or failed
+        :return: the current price or None when there isn't any
+        """
+        remaining = max(0.0, config.order_book_budget - (time.monotonic() - start_time))
+        try:
+            return await asyncio.wait_for(ticker, remaining)
+        except Exception as e:
+            price = self.mid_price(order_books_df)
+            print(f"Ticker of {self.symbol} not available ({e!r}), using the mid price {price}")
+            return price
+
+    @staticmethod
+    def mid_price(order_books_df):
+        """
+        :return: the middle of the best bid and the best ask of all the exchanges or None
+        """
+        bids = order_books_df.loc[order_books_df['Side'] == 'buy', 'Price']
+        asks = order_books_df.loc[order_books_df['Side'] == 'sell', 'Price']
+        if len(bids.index) == 0 or len(asks.index) == 0:
+            return None
+        return float((bids.max() + asks.min()) / 2)
 
+    def process_order_book(self, order_books_df, wallsize=100000, distance=None, detect_walls=True):
+        """
+        Split the raw order book into the aggregated bids and asks around the current price
+        (self.current_price must be set), calculate the cumulative sizes and find the walls.
+        :param order_books_df: DataFrame with the Price, Size, Side, Exchange and SizeUSD columns
+        :param wallsize: Use this value to identify walls equal or bigger of this size in USD.
+        :param distance: maximum distance (%) from the current price for the detectors using it
+        :param detect_walls: False to skip the wall detection (no peaks), e.g. for /depth
+        """
+        self.wallsize = wallsize
+        self.distance = distance
+        detector = walls.get_detector(wallsize, distance) if detect_walls else None
         # Sometimes the exchanges have slightly different prices for this reason we're going to
         # remove all asks lower than current price and all bids higher"
         self.aggregated_bids = order_books_df[(order_books_df['Side'] == 'buy') &
@@ -157,7 +405,11 @@ class AggregatedOrderBook():
         self.aggregated_asks['Peak'] = False
 
         # Find peaks (buy walls) based on size value in USD
-        bids_peaks, _ = find_peaks(self.aggregated_bids['SizeUSD'].values, prominence=wallsize)
+        bids_peaks = []
+        if detector is not None:
+            with metrics.stage('find_walls'):
+                bids_peaks = detector.detect(self.aggregated_bids['Price'].values, self.aggregated_bids['SizeUSD'].values,
+                                             self.aggregated_bids['Exchange'].values, self.current_price)
         # Sort the buy peaks by size in descending order
         self.bids_peaks = self.aggregated_bids.iloc[bids_peaks].sort_values('SizeUSD', ascending=False)
         # Get the actual DataFrame index values for peak indices
@@ -166,7 +418,11 @@ class AggregatedOrderBook():
         self.aggregated_bids.loc[bids_peaks_index, 'Peak'] = True
 
         # Find peaks (sell walls) based on size value in USD
-        asks_peaks, _ = find_peaks(self.aggregated_asks['SizeUSD'].values, prominence=wallsize)
+        asks_peaks = []
+        if detector is not None:
+            with metrics.stage('find_walls'):
+                asks_peaks = detector.detect(self.aggregated_asks['Price'].values, self.aggregated_asks['SizeUSD'].values,
+                                             self.aggregated_asks['Exchange'].values, self.current_price)
         # Sort the sell peaks by size in descending order
         self.asks_peaks = self.aggregated_asks.iloc[asks_peaks].sort_values('SizeUSD', ascending=False)
         # Get the actual DataFrame index values for peak indices
@@ -180,14 +436,85 @@ class AggregatedOrderBook():
         # Calculate the Bid-Ask ratio
         self.bid_ask_ratio = self.buy_size / self.sell_size
 
-        # Compose a dataframe to return
-        order_books_df = pd.concat([self.aggregated_asks, self.aggregated_bids], ignore_index=True)
+    async def get_order_book(self, wallsize=100000, distance=None, max_age=None, detect_walls=True):
+        """
+        Retrieve order book from exchanges.
+        :param wallsize: Use this value to identify walls equal or bigger of this size in USD.
+        :param distance: maximum distance (%) from the current price to the walls (see walls.py)
+        :param max_age: maximum age of the cached order book in seconds, default
+                        config.order_book_max_age (or the TTL of the shared cache). The
+                        prewarmer refreshes the popular symbols before they expire (see prewarm.py)
+        :param detect_walls: False when the walls aren't used (no chart, e.g. /depth)
+        :return: The full order book with bids and asks
+        """
+        order_books_df = pd.DataFrame()
+        cached = False
+        self.missing_exchanges = {}
+        # The ticker is fetched at the same time as the order books, within the same budget
+        start_time = time.monotonic()
+        ticker = asyncio.create_task(self.fetch_current_price())
+        try:
+            cache = shared_cache.get_cache()
+            if cache is not None:
+                order_books_df, cached = await self.fetch_shared_order_books(cache, max_age)
+                metrics.cache_lookup('shared_order_book', hit=cached)
+                self.refreshed = not cached
+                if len(order_books_df.index) == 0:
+                    return False
+            else:
+                # Cached version less than 1 minute old, in memory or in the disk (to avoid overload to exchanges)
+                with metrics.stage('read_cache'):
+                    found = artifact_cache.get_cache().get('order_book', self.order_book_snapshot, self.read_snapshot,
+                                                           config.order_book_max_age if max_age is None else max_age)
+                cached = found is not None
+                self.refreshed = not cached
+                if cached:
+                    order_books_df, self.updated_at = found
+                else:
+                    order_books_df = await self.fetch_order_books()
+                    self.updated_at = time.time()
+
+                    if len(order_books_df.index) == 0:
+                        return False
+
+            # The cached order books don't say why an exchange is missing
+            present = set(order_books_df['Exchange'].unique())
+            for name in self.exchanges:
+                if name not in present:
+                    self.missing_exchanges.setdefault(name, 'no data')
+
+            # Get the current price from binance (even if we have cached OB data)
+            self.current_price = await self.current_price_within_budget(ticker, start_time, order_books_df)
+            if self.current_price is None:
+                return False
+
+            self.process_order_book(order_books_df, wallsize, distance, detect_walls)
+
+            # Compose a dataframe to return
+            order_books_df = pd.concat([self.aggregated_asks, self.aggregated_bids], ignore_index=True)
 
-        # Save to file
-        if not cached:
-            order_books_df.to_csv(self.order_book_csv)
+            # Save to memory and file (the shared cache keeps its own copy)
+            if not cached and cache is None:
+                artifact_cache.get_cache().put(self.order_book_snapshot, order_books_df, self.updated_at,
+                                               write=lambda path: snapshot.write(order_books_df, path))
 
-        return True
+            return True
+        finally:
+            # Still running after an early return, or failed and already replaced by the mid price
+            ticker.cancel()
+            if ticker.done() and not ticker.cancelled():
+                ticker.exception()
+
+    def read_snapshot(self, path=None):
+        """
+        :param path: snapshot file (default self.order_book_snapshot)
+        :return: the order book saved by the last refresh or None if the file can't be read
+        """
+        try:
+            return snapshot.read(path or self.order_book_snapshot)
+        except (OSError, snapshot.SnapshotError) as e:
+            print(f"Error reading the order book snapshot: {e}")
+            return None
 
     def custom_formatter(self, x, pos):
         if x >= 1e6:
@@ -200,25 +527,184 @@ class AggregatedOrderBook():
             print("Please call get_order_book() first")
             return False
 
+        if self.order_book_image == "":
+            # The classic renderer always saves a PNG, the template renderer supports other formats
+            if config.chart_mode == 'classic':
+                extension = "png"
+            else:
+                import charts
+                extension = charts.file_extension(config.chart_format)
+            # The cache creates its folder
+            self.order_book_image = os.path.join(artifact_cache.get_cache().path, self.symbol.replace("/","")+"."+extension)
+
+        cache = shared_cache.get_cache()
+        if cache is not None and self.updated_at is not None:
+            await self.load_shared_chart(cache)
+        else:
+            self.load_local_chart()
+
+    def draw_chart(self):
+        """
+        Render the chart with the configured renderer (config.chart_mode).
+        """
+        with metrics.stage('render_chart'):
+            if config.chart_mode == 'template':
+                self.render_chart()
+            else:
+                self.plot_chart()
+
+    def chart_path(self):
+        """
+        :return: the file of the chart of the current wall settings, next to the order book
+                 snapshot (every combination of settings has its own file)
+        """
+        extension = os.path.splitext(self.order_book_image)[1]
+        return f"{os.path.splitext(self.order_book_snapshot)[0]}_{config.wall_detector}_" \
+               f"{self.wallsize:.0f}_{self.distance}{extension}"
+
+    def render_to(self, path):
+        """
+        Render the chart to a temporary file renamed over path, so it's never sent half-written.
+        """
+        extension = os.path.splitext(path)[1]
+        # The renderers pick the format from the extension
+        self.order_book_image = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp{extension}"
+        try:
+            self.draw_chart()
+            os.replace(self.order_book_image, path)
+        finally:
+            self.order_book_image = path
+
+    async def load_shared_chart(self, cache):
+        """
+        Get the chart of this order book snapshot from the shared cache. Only one
+        instance renders it, the others wait (without blocking the event loop) and
+        download the image.
+        :param cache: shared_cache.SharedCache
+        """
+        rendered = False
+        path = self.chart_path()
+
+        async def refresh():
+            nonlocal rendered
+            self.render_to(path)
+            rendered = True
+            return artifact_cache.read_file(path)
+
+        # The key includes the snapshot time: every instance gets the chart of the same data
+        key = f"chart:{os.path.basename(path)}:{int(self.updated_at * 1000)}:" \
+              f"{config.wall_detector}:{self.wallsize:.0f}:{self.distance}"
+        image = await cache.get_or_refresh_async(key, config.shared_cache_ttl, refresh)
+        metrics.cache_lookup('shared_chart', hit=not rendered)
+        if not rendered:
+            self.write_chart(image, path)
+        self.order_book_image = path
+        # Indexed so the disk tier bounds the chart files too
+        artifact_cache.get_cache().put(path, None, self.updated_at)
+
+    def load_local_chart(self):
+        """
+        Reuse the chart rendered from the same order book snapshot with the same wall settings
+        (by a previous /ob or by the prewarmer, see artifact_cache.py), otherwise render it.
+        """
+        data_time = self.data_time()
+        path = self.chart_path()
+        cache = artifact_cache.get_cache()
+        found = None
+        if data_time is not None:
+            found = cache.get('chart', path, artifact_cache.read_file, since=data_time)
+        if found is not None:
+            self.order_book_image = path
+            if not cache.on_disk(path):
+                # Still in memory, but its file was evicted
+                cache.put(path, found[0], found[1], write=lambda path: self.write_chart(found[0], path))
+            return
+        self.render_to(path)
+        cache.put(path, artifact_cache.read_file(path), data_time if data_time is not None else time.time())
+
+    @staticmethod
+    def write_chart(image, path):
+        """
+        Write the chart image atomically.
+        """
+        temporary = f"{os.path.splitext(path)[0]}.{os.getpid()}.tmp{os.path.splitext(path)[1]}"
+        with open(temporary, 'wb') as file:
+            file.write(image)
+        os.replace(temporary, path)
+
+    def chart_annotations(self):
+        """
+        :return: the annotations of the 3 most prominent buy and sell walls
+                 as a list of (text, xy, xytext, arrow color)
+        """
+        annotations = []
+        for index, row in self.bids_peaks.head(3).iterrows():
+            annotations.append((f"${millify(row['SizeUSD'], 1)}  @ {row['Price']} ({row['Exchange']})",
+                                (row['Price'], row['Buy']), (-20, -15), 'yellow'))
+        for index, row in self.asks_peaks.head(3).iterrows():
+            annotations.append((f"${millify(row['SizeUSD'], 1)} @ {row['Price']} ({row['Exchange']})",
+                                (row['Price'], row['Sell']), (10, -15), 'orange'))
+        return annotations
+
+    def chart_lines(self):
+        """
+        :return: (prices, cumulative sizes) of the buy and of the sell curve, downsampled to
+                 config.chart_max_points per side keeping the annotated walls (see downsample.py)
+        """
+        lines = []
+        for orders, peaks, column in ((self.aggregated_bids, self.bids_peaks, 'Buy'),
+                                      (self.aggregated_asks, self.asks_peaks, 'Sell')):
+            prices = orders['Price'].values
+            annotated = orders.index.get_indexer(peaks.head(3).index)
+            positions = downsample.price_binned(prices, config.chart_max_points, annotated)
+            lines.append((prices[positions], orders[column].values[positions]))
+        return lines
+
+    def chart_texts(self):
+        """
+        :return: the current price and buy/sell analysis lines (bottom line first)
+        """
+        return [f'Current Price: {self.current_price}',
+                f'Buy Size: {millify(self.buy_size,1)}',
+                f'Sell Size: {millify(self.sell_size,1)}',
+                f'Bid/Ask Ratio: {self.bid_ask_ratio:.2f}']
+
+    def render_chart(self):
+        """
+        Render the chart with the reusable figure template (see charts.ChartTemplate).
+        """
+        import charts
+        bids, asks = self.chart_lines()
+        charts.get_template().render(f"Aggregated Orderbook {self.symbol}",
+                                     bids,
+                                     asks,
+                                     self.chart_annotations(),
+                                     self.chart_texts(),
+                                     self.order_book_image,
+                                     config.chart_format,
+                                     config.chart_dpi)
+
+    def plot_chart(self):
+        import matplotlib
+        # Select the non-interactive backend explicitly: the bot only renders PNG files and
+        # the default backend detection probes for GUI toolkits (slow and useless on a server)
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import matplotlib.ticker as ticker
+        import charts
         # Start plotting
         plt.figure(figsize=(8, 6))  # Width: 8 inches, Height: 6 inches
         plt.style.use('dark_background')
         plt.title(f"Aggregated Orderbook {self.symbol}")
         # Plot the updated cumulative sums for buy and sell sides
-        plt.plot(self.aggregated_bids['Price'], self.aggregated_bids['Buy'], label='Buy', color='g')
-        plt.plot(self.aggregated_asks['Price'], self.aggregated_asks['Sell'], label='Sell', color='r')
-
-        # Add annotations for the most prominent buy walls
-        for index, row in self.bids_peaks.head(3).iterrows():
-            annotation_text = f"${millify(row['SizeUSD'], 1)}  @ {row['Price']} ({row['Exchange']})"
-            plt.annotate(annotation_text, xy=(row['Price'], row['Buy']), xytext=(-20, -15),
-                         textcoords='offset points', arrowprops=dict(arrowstyle="->", color='yellow'))
+        (bid_prices, bid_sizes), (ask_prices, ask_sizes) = self.chart_lines()
+        plt.plot(bid_prices, bid_sizes, label='Buy', color='g')
+        plt.plot(ask_prices, ask_sizes, label='Sell', color='r')
 
-        # Add annotations for the most prominent sell walls
-        for index, row in self.asks_peaks.head(3).iterrows():
-            annotation_text = f"${millify(row['SizeUSD'], 1)} @ {row['Price']} ({row['Exchange']})"
-            plt.annotate(annotation_text, xy=(row['Price'], row['Sell']), xytext=(10, -15),
-                         textcoords='offset points', arrowprops=dict(arrowstyle="->", color='orange'))
+        # Add annotations for the most prominent buy and sell walls
+        for text, xy, xytext, color in self.chart_annotations():
+            plt.annotate(text, xy=xy, xytext=xytext,
+                         textcoords='offset points', arrowprops=dict(arrowstyle="->", color=color))
 
         plt.xlabel('Price')
         plt.ylabel('Cumulative Size')
@@ -229,29 +715,69 @@ class AggregatedOrderBook():
         plt.legend(loc='lower right')
 
         # Add text to display current price and buy/sell analysis within the price range
-        plt.text(0.03, 0.03, f'Current Price: {self.current_price}', transform=plt.gca().transAxes, ha='left')
-        plt.text(0.03, 0.08, f'Buy Size: {millify(self.buy_size,1)}', transform=plt.gca().transAxes, ha='left')
-        plt.text(0.03, 0.13, f'Sell Size: {millify(self.sell_size,1)}', transform=plt.gca().transAxes, ha='left')
-        plt.text(0.03, 0.18, f'Bid/Ask Ratio: {self.bid_ask_ratio:.2f}', transform=plt.gca().transAxes, ha='left')
+        # (same lines and positions as the template renderer)
+        for y, text in zip(charts.ChartTemplate.text_positions, self.chart_texts()):
+            plt.text(0.03, y, text, transform=plt.gca().transAxes, ha='left')
 
         plt.savefig(self.order_book_image)
+        # Release the figure, pyplot keeps a reference to every open figure
+        plt.close()
+
+    def get_formatted_ladder(self, steps=None):
+        """
+        Text version of the chart: a depth ladder with the USD size and the cumulative size
+        of the asks and bids in equal price bands up to the user's distance, marking the bands
+        with walls, followed by the biggest walls.
+        :param steps: number of bands per side (config.ob_ladder_steps)
+        :return: the message (Markdown)
+        """
+        steps = steps or config.ob_ladder_steps
+        distance = self.distance or config.ob_ladder_distance
+        rows = [['Price', 'Size', 'Cum.', '']]
+        sides = ((self.aggregated_asks, 1), (self.aggregated_bids, -1))
+        for side, (orders, direction) in enumerate(sides):
+            edges = self.current_price * (1 + direction * np.arange(steps + 1) * distance / steps / 100)
+            distances = np.abs(orders['Price'].values - self.current_price)
+            # Band i holds the levels between edges[i] and edges[i + 1]
+            band_edges = np.abs(edges - self.current_price)
+            sizes = np.histogram(distances, band_edges, weights=orders['SizeUSD'].values)[0]
+            walls_found = np.histogram(distances[orders['Peak'].values], band_edges)[0]
+            band_rows = [[f"{edges[i + 1]:g}", millify(sizes[i], 1), millify(cumulative, 1),
+                          '< wall' if walls_found[i] > 0 else '']
+                         for i, cumulative in enumerate(np.cumsum(sizes))]
+            if side == 0:
+                # The asks are listed from the farthest to the current price
+                rows.extend(band_rows[::-1])
+                rows.append([f"{self.current_price:g}", '', '', '< price'])
+            else:
+                rows.extend(band_rows)
+
+        message = f"*{self.symbol}* within ±{distance:g}%\n" + utils.format_telegram_message(rows)
+        rows = [['Wall', 'Price', 'Size', 'Exchange']]
+        for name, peaks in (('Ask', self.asks_peaks), ('Bid', self.bids_peaks)):
+            for index, row in peaks.head(3).iterrows():
+                rows.append([name, f"{row['Price']:g}", millify(row['SizeUSD'], 1), row['Exchange']])
+        if len(rows) > 1:
+            message += "\n" + utils.format_telegram_message(rows)
+        message += f"\nBuy {millify(self.buy_size, 1)} / Sell {millify(self.sell_size, 1)}, " \
+                   f"Bid/Ask Ratio: {self.bid_ask_ratio:.2f}"
+        return message
 
     async def close(self):
-        await asyncio.gather(*[exchange.close() for exchange in self.exchanges.values()])
+        # ccxt sleeps timeout_on_exit (250 ms) in close() even when the client never opened a
+        # session, as with cached order books: only close the clients that made requests
+        await asyncio.gather(*[exchange.close() for exchange in self.exchanges.values()
+                               if getattr(exchange, 'session', True) is not None])
 
-    def elapsed_more_than_minute(self):
+    def data_time(self):
         """
-        Check the last time the file was retrieved from the server to avoid multiple
-        web scraps in a short period of time. We're going to cache the information
-        for one minute and retrieve it again after that time.
-        :return: True if more than one minute has passed. Otherwise, False.
+        :return: timestamp of the order book data or None if there isn't any
         """
-        if not os.path.isfile(self.order_book_csv):
-            # file does not exists, return True
-            return True
-        modification_time = os.path.getmtime(self.order_book_csv)
-        current_time = time.time()
-        return current_time - modification_time > 60  # more than 60 seconds
+        if self.updated_at is not None:
+            return self.updated_at
+        if os.path.isfile(self.order_book_snapshot):
+            return os.path.getmtime(self.order_book_snapshot)
+        return None
 
     def get_caption(self):
         """
@@ -261,15 +787,20 @@ class AggregatedOrderBook():
         in a user-friendly format and the exchanges we're pulling the data.
         :return: Last updated YYYY-mm-dd HH:mm ~ 5 seconds ago
         """
-        if not os.path.isfile(self.order_book_csv):
+        modification_time = self.data_time()
+        if modification_time is None:
             return ""
-        modification_time = os.path.getmtime(self.order_book_csv)
         dt = datetime.datetime.utcfromtimestamp(modification_time)
         formatted = dt.strftime("%Y-%m-%d %H:%M")
         time_difference = datetime.datetime.utcnow() - dt
         seconds_difference = time_difference.total_seconds()
         time_ago = f"{int(seconds_difference)} second{'s' if int(seconds_difference) != 1 else ''} ago"
-        message = f"{self.symbol} from {', '.join(self.exchanges)}.\n"\
-                  f"Updated on {formatted} ({time_ago})"
+        available = [name for name in self.exchanges if name not in self.missing_exchanges]
+        message = f"{self.symbol} from {', '.join(available)}.\n"
+        if len(self.missing_exchanges) > 0:
+            # Partial order book
+            missing = ', '.join(f"{name} ({reason})" for name, reason in self.missing_exchanges.items())
+            message += f"Missing: {missing}.\n"
+        message += f"Updated on {formatted} ({time_ago})"
         return message
 
@@ -1,5 +1,6 @@
 import sqlite3
 from sqlite3 import Error
+import tracing
 
 class UserDatabase:
     def __init__(self, db_file):
@@ -20,13 +21,19 @@ class UserDatabase:
         c.execute('''
             CREATE TABLE IF NOT EXISTS users
             (id INTEGER PRIMARY KEY, username TEXT, first_name TEXT, language_code TEXT, 
-            wallsize INTEGER, distance REAL)
+            wallsize INTEGER, distance REAL, ob_mode TEXT DEFAULT 'chart')
         ''')
+        # Databases created before the /ob text mode
+        columns = [column['name'] for column in c.execute('PRAGMA table_info(users)')]
+        if 'ob_mode' not in columns:
+            c.execute("ALTER TABLE users ADD COLUMN ob_mode TEXT DEFAULT 'chart'")
+            self.conn.commit()
 
     def insert_user(self, user):
         c = self.conn.cursor()
         c.execute('''
-            INSERT INTO users VALUES(?,?,?,?,?,?)
+            INSERT INTO users (id, username, first_name, language_code, wallsize, distance)
+            VALUES(?,?,?,?,?,?)
         ''', (user.id,
               user.username,
               user.first_name,
@@ -36,9 +43,10 @@ class UserDatabase:
         self.conn.commit()
 
     def get_user(self, id):
-        c = self.conn.cursor()
-        c.execute('SELECT * FROM users WHERE id=?', (id,))
-        return c.fetchone()
+        with tracing.span('db.get_user'):
+            c = self.conn.cursor()
+            c.execute('SELECT * FROM users WHERE id=?', (id,))
+            return c.fetchone()
 
     def update_wallsize(self, user, wallsize):
         c = self.conn.cursor()
@@ -50,4 +58,7 @@ class UserDatabase:
         c.execute('UPDATE users SET distance = ? WHERE id = ?', (distance, user.id))
         self.conn.commit()
 
-
+    def update_ob_mode(self, user, ob_mode):
+        c = self.conn.cursor()
+        c.execute('UPDATE users SET ob_mode = ? WHERE id = ?', (ob_mode, user.id))
+        self.conn.commit()
@@ -0,0 +1,374 @@
+"""
+Local cache of the per-symbol artifacts of /ob: the aggregated order books and the charts.
+Every /ob of a new symbol (or of a typo) leaves files behind, so they live in their own
+folder (config.artifact_cache_path) and the cache keeps it bounded.
+
+Two tiers, both LRU and bounded by bytes:
+- memory: the values themselves (order book DataFrames, chart images), up to
+  artifact_memory_bytes. A hit skips the file read and the snapshot decoding.
+- disk: the files of the folder, up to artifact_disk_bytes. The modification time of a file
+  is the time of its data. Several instances can share the folder, so the index of the files
+  (size, data time, last use) is rebuilt from the directory listing every
+  artifact_scan_interval seconds, and a lookup checks the file itself (os.stat) before
+  trusting the index: a file written or deleted by another instance is seen at once.
+
+Every entry has the time of its data. A tier drops the entries whose data is older than its
+TTL or not used for that long (artifact_memory_ttl, artifact_disk_ttl: the disk tier keeps the
+files much longer than the memory tier, across restarts) and evicts the least recently used
+entries when it goes over its size (the files are deleted). How old the data served can be is
+up to the caller (max_age, e.g. config.order_book_max_age for the order books).
+The keys are the paths of the files. The shared cache (shared_cache.py) replaces the order
+book tiers when several instances run; its charts are still written to the folder.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+import config
+import metrics
+
+EVICTIONS = metrics.registry.register(metrics.Counter(
+    'obbot_artifact_cache_evictions_total',
+    'Entries removed from the artifact cache by tier and reason (size/expired).',
+    ['tier', 'reason']))
+
+BYTES = metrics.registry.register(metrics.Gauge(
+    'obbot_artifact_cache_bytes',
+    'Size of the entries of the artifact cache by tier.',
+    ['tier']))
+
+ENTRIES = metrics.registry.register(metrics.Gauge(
+    'obbot_artifact_cache_entries',
+    'Entries of the artifact cache by tier.',
+    ['tier']))
+
+# metrics.cache_lookup names of the memory and disk tiers by kind of artifact
+LOOKUPS = {
+    'order_book': ('order_book_memory', 'order_book_snapshot'),
+    'chart': ('chart_memory', 'chart'),
+}
+
+
+class _Entry():
+    __slots__ = ('value', 'size', 'data_time', 'used')
+
+    def __init__(self, value, size, data_time, used):
+        self.value = value
+        self.size = size
+        self.data_time = data_time
+        self.used = used
+
+
+class Tier():
+    """
+    LRU of entries bounded by bytes, with a TTL. Not thread-safe (ArtifactCache locks it).
+    """
+
+    def __init__(self, name, max_bytes, ttl):
+        """
+        :param name: tier name for the metrics (memory, disk)
+        :param max_bytes: maximum size of the entries
+        :param ttl: maximum age of the data served, and of the entries not used (seconds)
+        """
+        self.name = name
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = {'size': 0, 'expired': 0}
+
+    def lookup(self, key, now, max_age=None, since=None):
+        """
+        :param max_age: maximum age of the data (capped to the TTL of the tier)
+        :param since: oldest data time accepted
+        :return: the entry or None (miss)
+        """
+        entry = self.entries.get(key)
+        if entry is not None:
+            age = now - entry.data_time
+            if age > self.ttl:
+                self.evict(key, 'expired')
+                entry = None
+            elif (max_age is not None and age > max_age) or (since is not None and entry.data_time < since):
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touch(key, now)
+        return entry
+
+    def touch(self, key, now):
+        entry = self.entries.get(key)
+        if entry is not None:
+            entry.used = now
+            self.entries.move_to_end(key)
+
+    def add(self, key, value, size, data_time, now):
+        """
+        :return: the evicted entries as (key, entry, reason), the new one included when it
+                 doesn't fit in the tier
+        """
+        self.remove(key)
+        self.entries[key] = _Entry(value, size, data_time, now)
+        self.size += size
+        return self.sweep(now)
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry.size
+        return entry
+
+    def evict(self, key, reason):
+        entry = self.remove(key)
+        if entry is not None:
+            self.evictions[reason] += 1
+            EVICTIONS.inc(tier=self.name, reason=reason)
+        return entry
+
+    def sweep(self, now):
+        """
+        Drop the entries not used within the TTL, then the least recently used ones while
+        the tier is over its size.
+        :return: the evicted entries as (key, entry, reason)
+        """
+        evicted = []
+        for key, entry in list(self.entries.items()):
+            # In order of use: the first entry used within the TTL ends the expired ones
+            if now - entry.used <= self.ttl:
+                break
+            evicted.append((key, self.evict(key, 'expired'), 'expired'))
+        while self.size > self.max_bytes and self.entries:
+            key = next(iter(self.entries))
+            evicted.append((key, self.evict(key, 'size'), 'size'))
+        BYTES.set(self.size, tier=self.name)
+        ENTRIES.set(len(self.entries), tier=self.name)
+        return evicted
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries': len(self.entries),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': dict(self.evictions)}
+
+
+def value_size(value):
+    """
+    :return: bytes used by a cached value (DataFrame, bytes)
+    """
+    if hasattr(value, 'columns'):
+        # The buffers of the columns: the text columns of the order books point to a few
+        # shared strings (sides, exchange names), counting them (deep=True) is slow and wrong
+        return int(sum(value[column].array.nbytes for column in value.columns) + value.index.nbytes)
+    return len(value)
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+class ArtifactCache():
+    """
+    Memory and disk tiers of the order books and charts. It can be used from several threads.
+    How to use this class:
+
+    cache = artifact_cache.get_cache()
+    found = cache.get('order_book', path, snapshot.read, max_age=config.order_book_max_age)
+    if found is None:
+        order_books_df = fetch()
+        cache.put(path, order_books_df, time.time(), write=lambda path: snapshot.write(order_books_df, path))
+    else:
+        order_books_df, data_time = found
+    cache.stats()
+    """
+
+    def __init__(self, path=None, memory_bytes=None, memory_ttl=None, disk_bytes=None, disk_ttl=None,
+                 scan_interval=None):
+        """
+        :param path: folder of the files (config.artifact_cache_path)
+        :param memory_bytes: size of the memory tier (config.artifact_memory_bytes)
+        :param memory_ttl: TTL of the memory tier in seconds (config.artifact_memory_ttl)
+        :param disk_bytes: size of the disk tier (config.artifact_disk_bytes)
+        :param disk_ttl: TTL of the disk tier in seconds (config.artifact_disk_ttl)
+        :param scan_interval: seconds between the rebuilds of the disk index from the folder
+                              (config.artifact_scan_interval)
+        """
+        self.path = path or config.artifact_cache_path
+        self.memory = Tier('memory',
+                           config.artifact_memory_bytes if memory_bytes is None else memory_bytes,
+                           config.artifact_memory_ttl if memory_ttl is None else memory_ttl)
+        self.disk = Tier('disk',
+                         config.artifact_disk_bytes if disk_bytes is None else disk_bytes,
+                         config.artifact_disk_ttl if disk_ttl is None else disk_ttl)
+        self.scan_interval = config.artifact_scan_interval if scan_interval is None else scan_interval
+        self.scanned_at = 0.0
+        self.lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+        self.scan()
+
+    def scan(self):
+        """
+        Rebuild the disk index from the files of the folder (left by a previous run or written
+        by other instances), the modification time being the time of their data. The files
+        already indexed keep their last use, the others were last used when written.
+        """
+        files = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                # The renderers and snapshot.write() write temporary files first
+                if entry.is_file() and '.tmp' not in entry.name:
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        # Deleted by another instance
+                        continue
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+        now = time.time()
+        with self.lock:
+            previous = self.disk.entries
+            indexed = []
+            for path, size, mtime in files:
+                entry = previous.get(path)
+                used = max(mtime, entry.used) if entry is not None else mtime
+                indexed.append((used, path, size, mtime))
+            # In order of use, like the LRU
+            self.disk.entries = OrderedDict((path, _Entry(None, size, mtime, used))
+                                            for used, path, size, mtime in sorted(indexed))
+            self.disk.size = sum(entry.size for entry in self.disk.entries.values())
+            evicted = self.disk.sweep(now)
+            self.scanned_at = now
+        self.delete_files(evicted)
+
+    def check_file(self, path, now):
+        """
+        Update the index entry of a file from the file itself: another instance may have
+        written a newer version, created or deleted it.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        with self.lock:
+            entry = self.disk.entries.get(path)
+            if stat is None:
+                if entry is not None:
+                    self.disk.remove(path)
+            elif entry is None or entry.data_time != stat.st_mtime or entry.size != stat.st_size:
+                used = entry.used if entry is not None else stat.st_mtime
+                self.disk.remove(path)
+                self.disk.entries[path] = _Entry(None, stat.st_size, stat.st_mtime, used)
+                self.disk.size += stat.st_size
+
+    @staticmethod
+    def delete_files(evicted):
+        for path, _, _ in evicted:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def get(self, kind, path, load, max_age=None, since=None):
+        """
+        :param kind: 'order_book' or 'chart' (metrics)
+        :param path: file of the artifact
+        :param load: function reading the file (path) and returning the value or None
+        :param max_age: maximum age of the data in seconds (capped to the TTL of each tier)
+        :param since: oldest data time accepted (e.g. a chart must be newer than its order book)
+        :return: (value, data time) or None
+        """
+        memory_lookup, disk_lookup = LOOKUPS[kind]
+        now = time.time()
+        with self.lock:
+            entry = self.memory.lookup(path, now, max_age, since)
+            if entry is not None:
+                # The file is as recently used as the value
+                self.disk.touch(path, now)
+        metrics.cache_lookup(memory_lookup, hit=entry is not None)
+        if entry is not None:
+            return entry.value, entry.data_time
+
+        if now - self.scanned_at > self.scan_interval:
+            self.scan()
+        self.check_file(path, now)
+        with self.lock:
+            indexed = path in self.disk.entries
+            entry = self.disk.lookup(path, now, max_age, since)
+            expired = indexed and path not in self.disk.entries
+        if expired:
+            self.delete_files([(path, None, 'expired')])
+        value = load(path) if entry is not None else None
+        metrics.cache_lookup(disk_lookup, hit=value is not None)
+        if value is None:
+            if entry is not None:
+                # Deleted or unreadable
+                with self.lock:
+                    self.disk.remove(path)
+            return None
+        with self.lock:
+            self.memory.add(path, value, value_size(value), entry.data_time, now)
+        return value, entry.data_time
+
+    def put(self, path, value, data_time, write=None):
+        """
+        Store an artifact in both tiers.
+        :param path: file of the artifact
+        :param value: the value kept in memory (None = only index the file)
+        :param data_time: timestamp of the data of the artifact
+        :param write: function writing the file (path) atomically, None when it's already written
+        """
+        if write is not None:
+            write(path)
+        try:
+            # The modification time is the time of the data, for the other instances and the
+            # next runs (see scan)
+            os.utime(path, (data_time, data_time))
+            size = os.path.getsize(path)
+        except OSError:
+            size = None
+        now = time.time()
+        evicted = []
+        with self.lock:
+            if size is not None:
+                evicted = self.disk.add(path, None, size, data_time, now)
+            if value is not None:
+                self.memory.add(path, value, value_size(value), data_time, now)
+        self.delete_files(evicted)
+
+    def on_disk(self, path):
+        """
+        :return: True when the file of the artifact is in the disk tier
+        """
+        with self.lock:
+            return path in self.disk.entries
+
+    def stats(self):
+        """
+        :return: {tier: entries, bytes, hits, misses, hit rate and evictions}
+        """
+        with self.lock:
+            return {'memory': self.memory.stats(), 'disk': self.disk.stats()}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    :return: the artifact cache of the process (created on first use)
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArtifactCache()
+        return _cache
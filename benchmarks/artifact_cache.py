@@ -0,0 +1,159 @@
+"""
+Artifact cache benchmark.
+Replays /ob lookups of the order books (artifact_cache.py) with synthetic books: most
+requests go to a few popular symbols (Zipf distribution), --typos of them to symbols asked
+only once. Every miss "fetches" the book and stores it like get_order_book() does.
+Reports per tier the hit rate, the evictions and the size, and the lookup time of a memory
+hit, of a disk hit and of the previous cache (stat + snapshot read of the file). Then the
+cache is created again on the same folder (a restart) and the TTL of the tiers is checked.
+Finally two instances share a folder.
+
+Checks that:
+- neither tier goes over its size
+- after a restart the files left are indexed and served from the disk tier
+- the entries older than the TTL are not served, and their files are deleted
+- an instance serves the files written (or rewritten with newer data) by another one
+  sharing the folder, and its index counts them after a rescan
+Exit code is 1 when a check fails.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.artifact_cache --requests 5000 --symbols 50 --typos 0.2
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import numpy as np
+import snapshot
+import artifact_cache
+from benchmarks.synthetic import make_order_book
+
+
+def folder_size(path):
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def lookup_legacy(path, max_age=60):
+    """
+    The previous cache: modification time of the snapshot file, then read it.
+    """
+    if os.path.isfile(path) and time.time() - os.path.getmtime(path) <= max_age:
+        return snapshot.read(path)
+    return None
+
+
+def median_ms(timings):
+    return statistics.median(timings) * 1000 if timings else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Artifact cache benchmark")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--symbols", type=int, default=50, help="popular symbols")
+    parser.add_argument("--typos", type=float, default=0.2, help="share of requests for symbols asked once")
+    parser.add_argument("--levels", type=int, default=500, help="levels per side and exchange of the books")
+    parser.add_argument("--memory-mb", type=float, default=2)
+    parser.add_argument("--disk-mb", type=float, default=6)
+    parser.add_argument("--ttl", type=float, default=2.0, help="TTL of both tiers for the expiry check (seconds)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    book = make_order_book(args.levels)
+    memory_bytes = int(args.memory_mb * 1024 * 1024)
+    disk_bytes = int(args.disk_mb * 1024 * 1024)
+    failed = False
+
+    with tempfile.TemporaryDirectory() as path:
+        cache = artifact_cache.ArtifactCache(path, memory_bytes, 3600, disk_bytes, 3600)
+        timings = {'memory': [], 'disk': [], 'legacy': []}
+        written = 0
+        over_size = False
+        for request in range(args.requests):
+            if rng.random() < args.typos:
+                symbol = f"TYPO{request}USDT"
+            else:
+                symbol = f"SYM{min(rng.zipf(1.3), args.symbols)}USDT"
+            file = os.path.join(path, symbol + ".snapshot")
+            memory_hits = cache.memory.hits
+            start = time.perf_counter()
+            found = cache.get('order_book', file, snapshot.read)
+            elapsed = time.perf_counter() - start
+            if found is not None:
+                timings['memory' if cache.memory.hits > memory_hits else 'disk'].append(elapsed)
+                if cache.on_disk(file):
+                    start = time.perf_counter()
+                    lookup_legacy(file)
+                    timings['legacy'].append(time.perf_counter() - start)
+            else:
+                cache.put(file, book, time.time(), write=lambda file: snapshot.write(book, file))
+                written += os.path.getsize(file) if os.path.isfile(file) else 0
+            over_size = over_size or cache.memory.size > memory_bytes or cache.disk.size > disk_bytes
+
+        stats = cache.stats()
+        print(f"{args.requests} requests, {args.symbols} popular symbols, {args.typos:.0%} typos, "
+              f"book of {len(book.index)} levels ({artifact_cache.value_size(book) / 1024:.0f} KB in memory)")
+        print(f"{'tier':<8}{'hit rate':>10}{'hits':>8}{'misses':>8}{'evicted size':>14}"
+              f"{'evicted TTL':>13}{'entries':>9}{'MB':>8}{'max MB':>8}")
+        for tier, values in stats.items():
+            print(f"{tier:<8}{values['hit_rate']:>10.1%}{values['hits']:>8}{values['misses']:>8}"
+                  f"{values['evictions']['size']:>14}{values['evictions']['expired']:>13}{values['entries']:>9}"
+                  f"{values['bytes'] / 1024 / 1024:>8.2f}{values['max_bytes'] / 1024 / 1024:>8.2f}")
+        print(f"lookup median: memory hit {median_ms(timings['memory']):.3f} ms, disk hit "
+              f"{median_ms(timings['disk']):.3f} ms, previous cache (stat + read) {median_ms(timings['legacy']):.3f} ms")
+        on_disk = folder_size(path)
+        status = "OK" if not over_size and on_disk <= disk_bytes else "FAIL"
+        failed = failed or status == "FAIL"
+        print(f"files: {on_disk / 1024 / 1024:.2f} MB left of {written / 1024 / 1024:.2f} MB written, "
+              f"tiers within their size  {status}")
+
+        # Restart: the files left are indexed and served by the disk tier (the files written more
+        # than the TTL ago are deleted by the scan)
+        left = len(os.listdir(path))
+        cache = artifact_cache.ArtifactCache(path, memory_bytes, args.ttl, disk_bytes, args.ttl)
+        files = list(cache.disk.entries)
+        served = sum(cache.get('order_book', file, snapshot.read) is not None for file in files)
+        status = "OK" if files and served == len(files) and cache.disk.hits == len(files) else "FAIL"
+        failed = failed or status == "FAIL"
+        print(f"restart: {len(files)} of {left} files indexed ({left - len(files)} expired), "
+              f"{served} served from the disk tier  {status}")
+
+        # TTL: nothing older is served, the files are deleted
+        time.sleep(args.ttl + 0.1)
+        served = sum(cache.get('order_book', file, snapshot.read) is not None for file in files)
+        left = sum(os.path.isfile(file) for file in files)
+        status = "OK" if served == 0 and left == 0 else "FAIL"
+        failed = failed or status == "FAIL"
+        print(f"after the TTL ({args.ttl:g} s): {served} served, {left} files left  {status}")
+
+    # Two instances sharing the folder: the index follows the files written by the other one
+    with tempfile.TemporaryDirectory() as path:
+        first = artifact_cache.ArtifactCache(path, memory_bytes, 3600, disk_bytes, 3600, scan_interval=0.5)
+        second = artifact_cache.ArtifactCache(path, memory_bytes, 3600, disk_bytes, 3600, scan_interval=0.5)
+        file = os.path.join(path, "SHAREDUSDT.snapshot")
+        written_at = time.time() - 30
+        first.put(file, book, written_at, write=lambda file: snapshot.write(book, file))
+        found = second.get('order_book', file, snapshot.read)
+        seen = found is not None and found[1] == written_at
+        # Newer data written by the second instance: the first one has the old one in memory
+        second.put(file, book, written_at + 20, write=lambda file: snapshot.write(book, file))
+        found = first.get('order_book', file, snapshot.read, since=written_at + 20)
+        newer = found is not None and found[1] == written_at + 20
+        # Files written by the other instance only are counted after a rescan
+        for index in range(5):
+            other = os.path.join(path, f"OTHER{index}USDT.snapshot")
+            second.put(other, None, time.time(), write=lambda file: snapshot.write(book, file))
+        time.sleep(0.6)
+        first.get('order_book', os.path.join(path, "MISSINGUSDT.snapshot"), snapshot.read)
+        counted = first.disk.size == folder_size(path)
+        status = "OK" if seen and newer and counted else "FAIL"
+        failed = failed or status == "FAIL"
+        print(f"shared folder: file of the other instance served {seen}, newer data served {newer}, "
+              f"index size {first.disk.size / 1024:.0f} KB for {folder_size(path) / 1024:.0f} KB of files  {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
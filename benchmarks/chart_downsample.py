@@ -0,0 +1,120 @@
+"""
+Chart downsampling benchmark.
+Renders the chart of synthetic books of increasing depth (the levels get denser over the
+same 30% price range) with every level plotted and with the curves downsampled to
+chart_max_points per side (downsample.py), for both renderers. Reports the render time,
+the time of the downsampling itself, the file size and the share of pixels that differ
+between the two PNGs. Checks that the downsampled curves stay within the point budget,
+go exactly through the annotated walls and step by the size of each wall at its price.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.chart_downsample --levels 1000 6000 20000 50000 --max-points 1000
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+import numpy as np
+from PIL import Image
+import config
+from benchmarks.synthetic import make_aggregated_order_book, EXCHANGES
+
+# (label, renderer, format)
+CASES = [
+    ('classic png', 'classic', 'png'),
+    ('template png8', 'template', 'png8'),
+]
+
+
+def render(order_book, renderer, image_format, max_points, path, runs):
+    """
+    :return: median render time
+    """
+    config.chart_mode = renderer
+    config.chart_format = image_format
+    config.chart_max_points = max_points
+    order_book.order_book_image = path
+    timings = []
+    # The first render builds the template (one-off cost)
+    for _ in range(runs + 1):
+        start = time.perf_counter()
+        order_book.draw_chart()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings[1:])
+
+
+def pixel_difference(first, second):
+    """
+    :return: share of the pixels that differ between two images
+    """
+    first = np.asarray(Image.open(first).convert('RGB'), dtype=np.int16)
+    second = np.asarray(Image.open(second).convert('RGB'), dtype=np.int16)
+    return np.mean(np.abs(first - second).max(axis=2) > 16)
+
+
+def check_lines(order_book, max_points):
+    """
+    :return: True when both curves fit the budget and contain the annotated points, and
+             the plotted curve steps by the size of every annotated wall between the wall
+             and the next plotted point (the bids jump towards the current price, the asks
+             away from it: their cumulative size is summed from the highest price down)
+    """
+    config.chart_max_points = max_points
+    for (prices, sizes), peaks, column in zip(order_book.chart_lines(),
+                                              (order_book.bids_peaks, order_book.asks_peaks), ('Buy', 'Sell')):
+        # The annotated walls (and the levels around each one) can go over the budget
+        if len(prices) > max_points + 3 * len(peaks.head(3)):
+            return False
+        points = list(zip(prices, sizes))
+        for _, row in peaks.head(3).iterrows():
+            if (row['Price'], row[column]) not in points:
+                return False
+            position = points.index((row['Price'], row[column]))
+            # Both sides are sorted by descending price: the bid before the wall is the next
+            # higher price, the ask after it the next lower price
+            neighbour = position - 1 if column == 'Buy' else position + 1
+            if not 0 <= neighbour < len(points) or \
+                    not np.isclose(row[column] - points[neighbour][1], row['SizeUSD']):
+                return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chart downsampling benchmark")
+    parser.add_argument("--levels", type=int, nargs='+', default=[1000, 6000, 20000, 50000],
+                        help="levels per side and exchange")
+    parser.add_argument("--max-points", type=int, default=1000, help="points per side after downsampling")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as data_path:
+        print(f"{'levels/side':<13}{'case':<16}{'full ms':>9}{'sampled ms':>12}{'speedup':>9}"
+              f"{'full KB':>9}{'sampled KB':>12}{'pixels diff':>13}")
+        for levels in args.levels:
+            order_book = make_aggregated_order_book(levels, data_path=data_path, step=0.3 / levels)
+            side_levels = levels * len(EXCHANGES)
+            config.chart_max_points = args.max_points
+            start = time.perf_counter()
+            order_book.chart_lines()
+            downsample_time = time.perf_counter() - start
+            for label, renderer, image_format in CASES:
+                full_path = os.path.join(data_path, f"full_{renderer}.png")
+                sampled_path = os.path.join(data_path, f"sampled_{renderer}.png")
+                full_time = render(order_book, renderer, image_format, None, full_path, args.runs)
+                sampled_time = render(order_book, renderer, image_format, args.max_points, sampled_path, args.runs)
+                print(f"{side_levels:<13}{label:<16}{full_time * 1000:>9.1f}{sampled_time * 1000:>12.1f}"
+                      f"{full_time / sampled_time:>8.1f}x{os.path.getsize(full_path) / 1024:>9.1f}"
+                      f"{os.path.getsize(sampled_path) / 1024:>12.1f}"
+                      f"{pixel_difference(full_path, sampled_path):>13.2%}")
+            status = "OK" if check_lines(order_book, args.max_points) else "FAIL"
+            failed = failed or status == "FAIL"
+            print(f"{'':<13}downsampling {downsample_time * 1000:.1f} ms, budget, annotated walls and their steps kept  {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Chart rendering benchmark.
+Compares the classic renderer (new pyplot figure per chart) with the reusable figure
+template (charts.ChartTemplate) and its output formats: render time and file size.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.chart_render --runs 10 --levels 1000
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import statistics
+import charts
+from benchmarks.synthetic import make_aggregated_order_book
+
+# (label, renderer, format, dpi)
+CASES = [
+    ('classic png', 'classic', 'png', 100),
+    ('template png', 'template', 'png', 100),
+    ('template png8', 'template', 'png8', 100),
+    ('template webp', 'template', 'webp', 100),
+    ('template png8 72dpi', 'template', 'png8', 72),
+]
+
+
+def render(order_book, renderer, image_format, dpi):
+    if renderer == 'classic':
+        order_book.plot_chart()
+        return
+    charts.get_template().render(f"Aggregated Orderbook {order_book.symbol}",
+                                 (order_book.aggregated_bids['Price'].values, order_book.aggregated_bids['Buy'].values),
+                                 (order_book.aggregated_asks['Price'].values, order_book.aggregated_asks['Sell'].values),
+                                 order_book.chart_annotations(),
+                                 order_book.chart_texts(),
+                                 order_book.order_book_image,
+                                 image_format,
+                                 dpi)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chart rendering benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--levels", type=int, default=1000, help="levels per side and exchange")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_path:
+        order_book = make_aggregated_order_book(args.levels, data_path=data_path)
+        print(f"{'case':<22}{'median ms':>12}{'size KB':>10}")
+        for label, renderer, image_format, dpi in CASES:
+            order_book.order_book_image = os.path.join(data_path, f"chart.{charts.file_extension(image_format)}")
+            # The first render builds the template (one-off cost)
+            render(order_book, renderer, image_format, dpi)
+            timings = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                render(order_book, renderer, image_format, dpi)
+                timings.append(time.perf_counter() - start)
+            size = os.path.getsize(order_book.order_book_image)
+            print(f"{label:<22}{statistics.median(timings) * 1000:>12.1f}{size / 1024:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
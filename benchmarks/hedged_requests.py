@@ -0,0 +1,127 @@
+"""
+Hedged requests benchmark.
+Simulates order book requests to one exchange (health.hedged) whose latency is usually
+short (--latency) but --tail of the requests take --tail-latency seconds. No network: the
+requests sleep for their latency. Runs the same requests without and with hedging and
+reports the p50/p95/p99 latency and the share of requests sent twice. Then an exchange
+waiting for our rate limit: checks that the requests aren't hedged while they wait.
+
+Checks that:
+- hedging brings the p99 latency down
+- at most --max-extra of the requests are sent twice
+- no request is hedged while it waits for the rate limit
+Exit code is 1 when a check fails.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.hedged_requests --requests 400 --latency 0.02 --tail 0.05 --tail-latency 0.5
+"""
+
+import sys
+import time
+import random
+import asyncio
+import argparse
+import config
+import health
+import ratelimit
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def simulate(args, name, hedge):
+    """
+    :return: (latencies, requests sent)
+    """
+    config.hedge_enabled = hedge
+    rng = random.Random(args.seed)
+    sent = 0
+
+    async def fetch(name):
+        nonlocal sent
+        sent += 1
+        latency = args.tail_latency if rng.random() < args.tail else args.latency * rng.uniform(0.8, 1.2)
+        await asyncio.sleep(latency)
+        return latency
+
+    latencies = []
+    for _ in range(args.requests):
+        start = time.monotonic()
+        with ratelimit.track_waits() as waits:
+            await health.hedged(fetch, name, waits)
+        latency = time.monotonic() - start
+        health.get_health(name).record(latency, success=True)
+        latencies.append(latency)
+    return latencies, sent
+
+
+async def rate_limited(args):
+    """
+    Requests waiting longer than the hedge delay for a busy rate limit.
+    :return: calls of fetch, requests made
+    """
+    config.hedge_enabled = True
+    limiter = ratelimit.RateLimiter('hedge_test', 1, 1, headroom=1 / (args.tail_latency * 2), burst=1.0)
+    exchange_health = health.get_health('hedge_test')
+    for _ in range(config.hedge_min_requests):
+        exchange_health.record(args.latency, success=True)
+    sent = 0
+
+    async def fetch(name):
+        nonlocal sent
+        sent += 1
+        await limiter.acquire(1)
+        # Answers within the hedge delay once sent
+        await asyncio.sleep(args.latency / 2)
+        return True
+
+    requests = 5
+    for _ in range(requests):
+        with ratelimit.track_waits() as waits:
+            await health.hedged(fetch, 'hedge_test', waits)
+    return sent, requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hedged requests benchmark")
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.02, help="usual latency of the exchange (seconds)")
+    parser.add_argument("--tail", type=float, default=0.05, help="share of slow requests")
+    parser.add_argument("--tail-latency", type=float, default=0.5, help="latency of the slow requests (seconds)")
+    parser.add_argument("--max-extra", type=float, default=0.15, help="maximum share of requests sent twice")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # A floor below the usual latency of the simulated exchange
+    config.hedge_min_delay = args.latency
+    failed = False
+    results = {}
+    print(f"{args.requests} requests, {args.latency * 1000:.0f} ms usually, {args.tail:.0%} at "
+          f"{args.tail_latency * 1000:.0f} ms")
+    print(f"{'mode':<12}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'sent twice':>12}")
+    for mode, hedge in (('no hedging', False), ('hedged', True)):
+        latencies, sent = asyncio.run(simulate(args, mode, hedge))
+        extra = (sent - args.requests) / args.requests
+        results[mode] = (percentile(latencies, 99), extra)
+        print(f"{mode:<12}{percentile(latencies, 50) * 1000:>9.1f}{percentile(latencies, 95) * 1000:>9.1f}"
+              f"{percentile(latencies, 99) * 1000:>9.1f}{max(latencies) * 1000:>9.1f}{extra:>12.1%}")
+    print(f"hedge delay after the run: {health.get_health('hedged').hedge_delay() * 1000:.1f} ms")
+
+    status = "OK" if results['hedged'][0] < results['no hedging'][0] else "FAIL"
+    failed = failed or status == "FAIL"
+    print(f"p99 latency {results['no hedging'][0] * 1000:.1f} -> {results['hedged'][0] * 1000:.1f} ms  {status}")
+    status = "OK" if results['hedged'][1] <= args.max_extra else "FAIL"
+    failed = failed or status == "FAIL"
+    print(f"{results['hedged'][1]:.1%} of the requests sent twice (max {args.max_extra:.0%})  {status}")
+
+    sent, requests = asyncio.run(rate_limited(args))
+    status = "OK" if sent == requests else "FAIL"
+    failed = failed or status == "FAIL"
+    print(f"waiting for the rate limit: {sent} calls for {requests} requests  {status}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+End-to-end load test.
+Drives the real command handlers of main.py (/tc, /ob, /wallsize and /distance) with
+synthetic updates from many users. Local stand-ins replace the Telegram Bot API, the
+exchanges (ccxt or the REST connectors, and the Binance ticker) and trendcore.ru. They run
+in a separate process so they don't compete with the bot for the event loop.
+Reports the throughput, the p50/p95/p99 latency per command and the peak RSS of the bot.
+
+The bot uses a temporary data folder (user database, snapshots and charts), so the
+caches start cold and the order book and TrendCore caches behave like in production
+(refreshed at most once per minute).
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.load_test --updates 2000 --concurrency 50 --users 500
+    python -m benchmarks.load_test --backend rest --exchange-latency 0.05
+"""
+
+import os
+import sys
+import time
+import random
+import signal
+import asyncio
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+# Command mix: (command text, weight)
+COMMANDS = [
+    ('/tc', 40),
+    ('/ob BTC', 15),
+    ('/ob ETH', 10),
+    ('/wallsize 250k', 10),
+    ('/distance 3', 10),
+    ('/data', 5),
+    ('/ob SOL', 10),
+]
+
+COINS = ['BTC', 'ETH', 'SOL']
+
+
+def run_stubs(args, queue):
+    from benchmarks.stubs import FakeTelegramServer, FakeExchangeServer, FakeTrendCoreServer
+
+    async def serve():
+        telegram_server = await FakeTelegramServer(latency=args.telegram_latency).start()
+        exchange_server = await FakeExchangeServer(COINS, levels=args.levels, latency=args.exchange_latency).start()
+        trendcore_server = await FakeTrendCoreServer(rows=args.trendcore_rows, latency=args.trendcore_latency).start()
+        queue.put((telegram_server.base_url, telegram_server.base_file_url, exchange_server.url,
+                   trendcore_server.url))
+
+        stop_event = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+        await stop_event.wait()
+        queue.put((dict(telegram_server.calls), sum(exchange_server.calls.values()), trendcore_server.requests))
+        for server in (telegram_server, exchange_server, trendcore_server):
+            await server.stop()
+
+    asyncio.run(serve())
+
+
+def configure(args, data_path, exchange_url, trendcore_url):
+    """
+    Point the bot to the stand-ins and to a temporary data folder (before importing main).
+    """
+    import config
+    config.data_path = data_path
+    config.user_data = os.path.join(data_path, 'users_data.db')
+    config.trendcore_snapshot = os.path.join(data_path, 'trendcore.snapshot')
+    config.artifact_cache_path = os.path.join(data_path, 'artifacts')
+    config.trendcore_url = trendcore_url
+    config.exchange_api_urls = {name: exchange_url for name in ('binance', 'bybit', 'okx', 'okex')}
+    config.order_book_backend = args.backend
+    config.shared_cache = None
+    config.tracing_enabled = False
+    config.recorder_enabled = False
+
+
+def percentile(values, pct):
+    """
+    Nearest-rank percentile.
+    """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+async def drive(args, telegram_urls):
+    from telegram import Update
+    from telegram.ext import ApplicationBuilder, CommandHandler
+    from benchmarks.stubs import FakeTelegramServer, make_update
+    import main
+
+    base_url, base_file_url = telegram_urls
+    application = ApplicationBuilder().token(FakeTelegramServer.token) \
+        .base_url(base_url).base_file_url(base_file_url).updater(None).build()
+    # The same handlers as main.build_application()
+    application.add_handler(CommandHandler("tc", main.data))
+    application.add_handler(CommandHandler("data", main.data))
+    application.add_handler(CommandHandler("ob", main.orderbook))
+    application.add_handler(CommandHandler("wallsize", main.wallsize))
+    application.add_handler(CommandHandler("distance", main.distance))
+
+    rng = random.Random(args.seed)
+    texts = [text for text, _ in COMMANDS]
+    weights = [weight for _, weight in COMMANDS]
+    updates = [(rng.choices(texts, weights)[0], 1000 + rng.randrange(args.users)) for _ in range(args.updates)]
+    latencies = {}
+
+    async def process(update_id, text, user_id):
+        update = Update.de_json(make_update(update_id, user_id, text), application.bot)
+        start = time.perf_counter()
+        await application.process_update(update)
+        return text.split()[0], time.perf_counter() - start
+
+    async with application:
+        if args.warmup:
+            # Import the heavy modules and fill the caches once, like a bot that has been running
+            for index, text in enumerate(texts):
+                await process(index + 1, text, 999)
+
+        queue = asyncio.Queue()
+        for index, (text, user_id) in enumerate(updates):
+            queue.put_nowait((len(texts) + index + 1, text, user_id))
+
+        async def worker():
+            while not queue.empty():
+                update_id, text, user_id = queue.get_nowait()
+                command, latency = await process(update_id, text, user_id)
+                latencies.setdefault(command, []).append(latency)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - start
+
+        if 'connectors' in sys.modules:
+            await sys.modules['connectors'].close_sessions()
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the command handlers")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50, help="updates processed at the same time")
+    parser.add_argument("--users", type=int, default=500, help="distinct users sending the updates")
+    parser.add_argument("--backend", choices=['ccxt', 'rest'], default='ccxt', help="order book backend")
+    parser.add_argument("--levels", type=int, default=1000, help="levels per side of the fake order books")
+    parser.add_argument("--trendcore-rows", type=int, default=300)
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds per Telegram API call")
+    parser.add_argument("--exchange-latency", type=float, default=0.0, help="seconds per exchange API call")
+    parser.add_argument("--trendcore-latency", type=float, default=0.0, help="seconds per TrendCore request")
+    parser.add_argument("--no-warmup", dest='warmup', action='store_false',
+                        help="measure the cold start too (imports and empty caches)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    queue = multiprocessing.Queue()
+    stubs = multiprocessing.Process(target=run_stubs, args=(args, queue))
+    stubs.start()
+    base_url, base_file_url, exchange_url, trendcore_url = queue.get(timeout=60)
+
+    try:
+        with tempfile.TemporaryDirectory() as data_path:
+            configure(args, data_path, exchange_url, trendcore_url)
+            latencies, elapsed = asyncio.run(drive(args, (base_url, base_file_url)))
+    finally:
+        stubs.terminate()
+    telegram_calls, exchange_calls, trendcore_requests = queue.get(timeout=60)
+    stubs.join()
+
+    # ru_maxrss is in KB on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    total = sum(len(values) for values in latencies.values())
+    print(f"updates: {total}  concurrency: {args.concurrency}  users: {args.users}  backend: {args.backend}")
+    print(f"{'command':<12}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for command, values in sorted(latencies.items()):
+        print(f"{command:<12}{len(values):>7}{percentile(values, 50) * 1000:>10.1f}"
+              f"{percentile(values, 95) * 1000:>10.1f}{percentile(values, 99) * 1000:>10.1f}"
+              f"{max(values) * 1000:>10.1f}")
+    print(f"throughput: {total / elapsed:.1f} updates/s ({elapsed:.1f} s)")
+    print(f"peak RSS:   {peak_rss:.0f} MB")
+    print(f"stand-ins:  telegram {telegram_calls}, exchange requests {exchange_calls}, "
+          f"trendcore requests {trendcore_requests}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Market scanner benchmark.
+Runs full scans (scanner.py) of many USDT pairs against a local stand-in of the exchanges
+(24h tickers, markets and order books) with a network latency per request, and reports the
+scan duration, the symbols per second and the walls found for several concurrency levels.
+Checks that the result can be formatted like the TrendCore table and that a scan with a
+budget shorter than needed stops on time (the unfinished symbols are left out).
+The process-wide rate limit caps the requests per exchange (ratelimit.py, Binance depth
+has a high weight): --no-rate-limit disables it to measure the scanner itself.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.market_scan --symbols 200 --latency 0.05 --concurrency 1 10 50
+    python -m benchmarks.market_scan --no-rate-limit
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import config
+from benchmarks.stubs import FakeExchangeServer
+
+
+def make_scanner(args, concurrency, budget):
+    import scanner
+    return scanner.MarketScanner(args.exchanges, top_n=args.symbols, concurrency=concurrency,
+                                 budget=budget, processes=args.processes)
+
+
+async def run(args, data_path):
+    import trendcore
+    import scanner
+    coins = [f"C{index}" for index in range(args.symbols)]
+    server = await FakeExchangeServer(coins, levels=args.levels, latency=args.latency).start()
+    config.exchange_api_urls = {name: server.url for name in ('binance', 'bybit', 'okx', 'okex')}
+    config.scanner_snapshot = os.path.join(data_path, 'scanner.snapshot')
+    config.rate_limit_enabled = args.rate_limit
+    failed = False
+    try:
+        print(f"{args.symbols} symbols on {', '.join(args.exchanges)}, {args.levels} levels per side, "
+              f"{args.latency * 1000:.0f} ms per request, rate limit {'on' if args.rate_limit else 'off'}")
+        print(f"{'concurrency':<13}{'scan s':>8}{'symbols/s':>11}{'walls':>7}")
+        for concurrency in args.concurrency:
+            market_scanner = make_scanner(args, concurrency, 600)
+            try:
+                # Markets and process pool ready, like a scanner that has been running
+                await market_scanner.load_markets()
+                start = time.perf_counter()
+                df = await market_scanner.scan()
+                elapsed = time.perf_counter() - start
+            finally:
+                await market_scanner.close()
+            print(f"{concurrency:<13}{elapsed:>8.2f}{args.symbols / elapsed:>11.1f}{len(df.index):>7}")
+
+        last_scan = scanner.read_walls()
+        message = trendcore.TrendCore(last_scan[1], last_scan[0]).get_formatted_data(args.wallsize, args.distance)
+        status = "OK" if len(df.index) > 0 and "There are no coins" not in message else "FAIL"
+        failed = failed or status == "FAIL"
+        print(f"TrendCore format of the scan: {len(message.splitlines())} lines  {status}")
+
+        # Budget check: half of the time needed by the last scan
+        budget = elapsed / 2
+        market_scanner = make_scanner(args, max(args.concurrency), budget)
+        try:
+            await market_scanner.load_markets()
+            timeouts_before = scanner.SYMBOLS.get(result='timeout')
+            start = time.perf_counter()
+            await market_scanner.scan()
+            elapsed = time.perf_counter() - start
+        finally:
+            await market_scanner.close()
+        timeouts = scanner.SYMBOLS.get(result='timeout') - timeouts_before
+        status = "OK" if elapsed < budget + 0.5 and timeouts > 0 else "FAIL"
+        failed = failed or status == "FAIL"
+        print(f"budget {budget:.2f} s: scan took {elapsed:.2f} s, {timeouts} symbols left out  {status}")
+    finally:
+        await server.stop()
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Market scanner benchmark")
+    parser.add_argument("--symbols", type=int, default=200)
+    parser.add_argument("--exchanges", nargs='+', default=['binance', 'bybit'])
+    parser.add_argument("--levels", type=int, default=100, help="levels per side of the fake order books")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per exchange request")
+    parser.add_argument("--concurrency", type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--no-rate-limit", dest='rate_limit', action='store_false',
+                        help="disable the process-wide rate limit (ratelimit.py)")
+    parser.add_argument("--wallsize", type=float, default=100_000)
+    parser.add_argument("--distance", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_path:
+        failed = asyncio.run(run(args, data_path))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
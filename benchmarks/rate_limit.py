@@ -0,0 +1,119 @@
+"""
+Rate limit scheduler benchmark.
+Simulates the requests of the bot against one exchange with a scaled-down limit
+(--limit weight every --window seconds, Binance weights): users asking for /ob (1000-level
+depth + ticker), the prewarmer (same requests, BACKGROUND priority) and the market
+scanner (100-level depth, BULK priority) sending as fast as it can. No network: the
+requests are recorded when the rate limit lets them through.
+
+Compares:
+- per client: a new limiter for every request, like the ccxt clients created by /ob
+- shared, FIFO: the process-wide limiter without priorities
+- shared, priorities: the process-wide limiter (ratelimit.py)
+and reports the busiest window of the exchange (must stay under the limit), the
+utilization of the limit and the wait per kind of request. Exit code is 1 when the
+shared limiter goes over the limit.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.rate_limit --limit 600 --window 6 --duration 15
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+import config
+import ratelimit
+
+OB_WEIGHT = ratelimit.weight('binance', 'depth', 1000) + ratelimit.weight('binance', 'ticker')
+SCAN_WEIGHT = ratelimit.weight('binance', 'depth', 100)
+
+
+def busiest_window(grants, window):
+    """
+    :param grants: sorted list of (time, weight)
+    :return: the highest weight sent within any window of the exchange
+    """
+    busiest = total = start = 0
+    for end in range(len(grants)):
+        total += grants[end][1]
+        while grants[end][0] - grants[start][0] >= window:
+            total -= grants[start][1]
+            start += 1
+        busiest = max(busiest, total)
+    return busiest
+
+
+async def simulate(args, mode):
+    """
+    :param mode: 'per client', 'shared, FIFO' or 'shared, priorities'
+    :return: (grants, {kind: list of waits})
+    """
+    shared = ratelimit.RateLimiter('binance', args.limit, args.window)
+    grants = []
+    waits = {'user /ob': [], 'prewarm': [], 'scanner': []}
+    deadline = time.monotonic() + args.duration
+
+    async def request(kind, weight, priority):
+        limiter = ratelimit.RateLimiter('binance', args.limit, args.window) if mode == 'per client' else shared
+        start = time.monotonic()
+        await limiter.acquire(weight, priority if mode == 'shared, priorities' else ratelimit.INTERACTIVE)
+        grants.append((time.monotonic(), weight))
+        waits[kind].append(time.monotonic() - start)
+
+    async def user():
+        while time.monotonic() < deadline:
+            await request('user /ob', OB_WEIGHT, ratelimit.INTERACTIVE)
+            await asyncio.sleep(args.think_time)
+
+    async def prewarmer():
+        while time.monotonic() < deadline:
+            await request('prewarm', OB_WEIGHT, ratelimit.BACKGROUND)
+            await asyncio.sleep(args.think_time)
+
+    async def scanner():
+        while time.monotonic() < deadline:
+            await request('scanner', SCAN_WEIGHT, ratelimit.BULK)
+            # The response time of the exchange
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*[user() for _ in range(args.users)],
+                         prewarmer(),
+                         *[scanner() for _ in range(args.scanner_concurrency)])
+    return sorted(grants), waits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rate limit scheduler benchmark")
+    parser.add_argument("--limit", type=int, default=600, help="weight allowed by the exchange every window")
+    parser.add_argument("--window", type=float, default=6.0, help="seconds")
+    parser.add_argument("--duration", type=float, default=15.0, help="seconds of simulated traffic")
+    parser.add_argument("--users", type=int, default=2, help="users sending /ob")
+    parser.add_argument("--think-time", type=float, default=2.0, help="seconds between the /ob of a user")
+    parser.add_argument("--scanner-concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"limit {args.limit} every {args.window:g} s (headroom {config.rate_limit_headroom:.0%}, "
+          f"burst {config.rate_limit_burst:.0%}), /ob weight {OB_WEIGHT}, scanner weight {SCAN_WEIGHT}")
+    print(f"{'limiter':<22}{'busiest window':>16}{'utilization':>13}"
+          f"{'/ob p50/p95 ms':>17}{'prewarm p50 ms':>16}{'scanner p50 ms':>16}")
+    failed = False
+    for mode in ('per client', 'shared, FIFO', 'shared, priorities'):
+        grants, waits = asyncio.run(simulate(args, mode))
+        busiest = busiest_window(grants, args.window)
+        utilization = sum(weight for _, weight in grants) / (args.duration / args.window * args.limit)
+        status = "OK" if busiest <= args.limit else "OVER"
+        if mode != 'per client':
+            failed = failed or status == "OVER"
+        users = sorted(waits['user /ob'])
+        p95 = users[min(len(users) - 1, int(len(users) * 0.95))]
+        print(f"{mode:<22}{busiest:>10} {status:<5}{utilization:>13.0%}"
+              f"{statistics.median(users) * 1000:>10.0f}/{p95 * 1000:<6.0f}"
+              f"{statistics.median(waits['prewarm']) * 1000:>16.0f}"
+              f"{statistics.median(waits['scanner']) * 1000:>16.0f}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
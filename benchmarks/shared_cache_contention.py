@@ -0,0 +1,149 @@
+"""
+Shared cache contention check.
+Starts several processes that ask for the same key at the same time. Only one of
+them must run the (slow) refresh, the others must wait and get its value.
+Runs against the SQLite backend and a local Redis-protocol stand-in.
+
+Then checks that the event loop keeps running while get_or_refresh_async() waits for the
+backend: the SQLite database locked by another connection, and a slow Redis stand-in.
+Reports the longest gap of a ticker running every 10 ms on the loop.
+Exit code is 1 when a check fails.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.shared_cache_contention --processes 8 --block 0.5
+"""
+
+import os
+import sys
+import time
+import sqlite3
+import asyncio
+import argparse
+import threading
+import tempfile
+import multiprocessing
+import shared_cache
+from benchmarks.stubs import FakeRedisServer
+
+
+def worker(url, counter_path, start_at, results):
+    if url.startswith('redis://'):
+        cache = shared_cache.RedisCache(url)
+    else:
+        cache = shared_cache.SQLiteCache(url)
+
+    def refresh():
+        # Count the refreshes: O_APPEND writes of a single byte are atomic
+        with open(counter_path, 'ab') as counter:
+            counter.write(b'1')
+        time.sleep(0.5)
+        return f"value from {os.getpid()}".encode()
+
+    time.sleep(max(0.0, start_at - time.time()))
+    start = time.perf_counter()
+    value = cache.get_or_refresh('contention', ttl=60, refresh=refresh)
+    results.put((value, time.perf_counter() - start))
+
+
+def run(url, processes):
+    with tempfile.NamedTemporaryFile(delete=False) as counter:
+        counter_path = counter.name
+    results = multiprocessing.Queue()
+    start_at = time.time() + 1.0
+    workers = [multiprocessing.Process(target=worker, args=(url, counter_path, start_at, results))
+               for _ in range(processes)]
+    for process in workers:
+        process.start()
+    values = [results.get(timeout=60) for _ in workers]
+    for process in workers:
+        process.join()
+    refreshes = os.path.getsize(counter_path)
+    os.remove(counter_path)
+    distinct = len(set(value for value, _ in values))
+    slowest = max(elapsed for _, elapsed in values)
+    return refreshes, distinct, slowest
+
+
+async def loop_lag(cache, key):
+    """
+    :return: (value, longest gap between the ticks of a 10 ms ticker in seconds)
+    """
+    longest = 0.0
+    running = True
+
+    async def ticker():
+        nonlocal longest
+        last = time.monotonic()
+        while running:
+            await asyncio.sleep(0.01)
+            now = time.monotonic()
+            longest = max(longest, now - last)
+            last = now
+
+    async def refresh():
+        return b'value'
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    try:
+        value = await cache.get_or_refresh_async(key, 60, refresh)
+    finally:
+        running = False
+        await task
+    return value, longest
+
+
+def hold_sqlite_lock(path, seconds, locked):
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute('BEGIN IMMEDIATE')
+    locked.set()
+    time.sleep(seconds)
+    connection.execute('COMMIT')
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared cache contention check")
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--block", type=float, default=0.5,
+                        help="seconds the backend blocks in the event loop check")
+    args = parser.parse_args()
+
+    server = FakeRedisServer().start()
+    failed = False
+    with tempfile.TemporaryDirectory() as data_path:
+        backends = [('sqlite', os.path.join(data_path, 'shared_cache.db')),
+                    ('redis stand-in', f"redis://127.0.0.1:{server.port}/0")]
+        for name, url in backends:
+            refreshes, distinct, slowest = run(url, args.processes)
+            status = "OK" if refreshes == 1 and distinct == 1 else "FAIL"
+            failed = failed or status == "FAIL"
+            print(f"{name:<16} processes: {args.processes}  refreshes: {refreshes}  "
+                  f"distinct values: {distinct}  slowest: {slowest * 1000:.0f} ms  {status}")
+
+        # The event loop while the backend blocks: SQLite locked by another connection for
+        # --block seconds, a Redis stand-in taking --block / 4 seconds per command
+        path = os.path.join(data_path, 'shared_cache.db')
+        locked = threading.Event()
+        holder = threading.Thread(target=hold_sqlite_lock, args=(path, args.block, locked))
+        holder.start()
+        locked.wait()
+        slow_server = FakeRedisServer(latency=args.block / 4).start()
+        checks = [('sqlite locked', shared_cache.SQLiteCache(path)),
+                  ('redis slow', shared_cache.RedisCache(f"redis://127.0.0.1:{slow_server.port}/0"))]
+        for name, cache in checks:
+            start = time.perf_counter()
+            value, lag = asyncio.run(loop_lag(cache, 'loop_lag'))
+            elapsed = time.perf_counter() - start
+            status = "OK" if value == b'value' and lag < args.block / 4 else "FAIL"
+            failed = failed or status == "FAIL"
+            print(f"{name:<16} get_or_refresh_async: {elapsed * 1000:.0f} ms  "
+                  f"longest event loop gap: {lag * 1000:.0f} ms  {status}")
+        holder.join()
+        slow_server.shutdown()
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
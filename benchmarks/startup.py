@@ -0,0 +1,67 @@
+"""
+Startup-time benchmark.
+Measures how long it takes to import main.py (what the bot needs before it can answer
+/start and /help) and compares it with importing the heavy modules eagerly, which is
+what main.py used to do at module load.
+Exit code is 1 when the fast import is not below --max-ratio of the eager import, so
+it can be used as a guard in CI.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.startup --runs 5 --max-ratio 0.5
+"""
+
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAST_IMPORT = "import main"
+EAGER_IMPORT = "import main, trendcore, AggregatedOrderBook"
+
+
+def measure(statement, runs):
+    """
+    Run the import statement in a fresh interpreter and measure the wall time.
+    :param statement: python code to execute
+    :param runs: number of repetitions
+    :return: list of timings in seconds
+    """
+    code = ("import time\n"
+            "start = time.perf_counter()\n"
+            f"{statement}\n"
+            "print(time.perf_counter() - start)\n")
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bot startup-time benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ratio", type=float, default=0.5,
+                        help="maximum allowed fast/eager import time ratio")
+    args = parser.parse_args()
+
+    # First run warms up the OS file cache and the .pyc files
+    measure(EAGER_IMPORT, 1)
+    fast = statistics.median(measure(FAST_IMPORT, args.runs))
+    eager = statistics.median(measure(EAGER_IMPORT, args.runs))
+    ratio = fast / eager
+
+    print(f"import main (lazy):        {fast * 1000:8.1f} ms")
+    print(f"import main + heavy (old): {eager * 1000:8.1f} ms")
+    print(f"ratio:                     {ratio:8.2f} (max {args.max_ratio:.2f})")
+    if ratio > args.max_ratio:
+        print("FAIL: startup imports are too slow")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,464 @@
+"""
+Local stand-ins for the external services used by the bot, for the benchmarks and load tests.
+"""
+
+import time
+import random
+import hashlib
+import asyncio
+import itertools
+from datetime import datetime, timedelta
+import threading
+import socketserver
+from aiohttp import web
+import shared_cache
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            # Inline command (redis-cli style)
+            return line.strip().split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def reply(self, value):
+        if value is None:
+            self.wfile.write(b'$-1\r\n')
+        elif isinstance(value, int):
+            self.wfile.write(b':%d\r\n' % value)
+        elif isinstance(value, str):
+            self.wfile.write(b'+%s\r\n' % value.encode())
+        elif isinstance(value, Exception):
+            self.wfile.write(b'-ERR %s\r\n' % str(value).encode())
+        else:
+            self.wfile.write(b'$%d\r\n%s\r\n' % (len(value), value))
+
+    def handle(self):
+        while True:
+            args = self.read_command()
+            if not args:
+                return
+            try:
+                self.reply(self.server.execute(args))
+            except Exception as e:
+                self.reply(e)
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    """
+    In-memory server speaking the Redis protocol, with the commands used by
+    shared_cache.RedisCache (PING, AUTH, SELECT, GET, SET [PX|EX] [NX], DEL and
+    the unlock script through EVAL).
+    How to use this class:
+
+    server = FakeRedisServer()
+    server.start()
+    cache = shared_cache.RedisCache(f"redis://127.0.0.1:{server.port}/0")
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        """
+        :param latency: seconds added to every command (simulates a slow server)
+        """
+        super().__init__((host, port), FakeRedisHandler)
+        self.data = {}
+        self.lock = threading.Lock()
+        self.latency = latency
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def _get(self, key):
+        value, expires = self.data.get(key, (None, None))
+        if expires is not None and expires <= time.monotonic():
+            del self.data[key]
+            return None
+        return value
+
+    def execute(self, args):
+        command = args[0].upper()
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if command in (b'PING', b'AUTH', b'SELECT'):
+                return 'PONG' if command == b'PING' else 'OK'
+            if command == b'GET':
+                return self._get(args[1])
+            if command == b'SET':
+                key, value, options = args[1], args[2], [arg.upper() for arg in args[3:]]
+                expires = None
+                if b'PX' in options:
+                    expires = time.monotonic() + int(options[options.index(b'PX') + 1]) / 1000
+                elif b'EX' in options:
+                    expires = time.monotonic() + int(options[options.index(b'EX') + 1])
+                if b'NX' in options and self._get(key) is not None:
+                    return None
+                self.data[key] = (value, expires)
+                return 'OK'
+            if command == b'DEL':
+                return sum(1 for key in args[1:] if self.data.pop(key, None) is not None)
+            if command == b'EVAL' and args[1].decode() == shared_cache.UNLOCK_SCRIPT:
+                key, token = args[3], args[4]
+                if self._get(key) == token:
+                    del self.data[key]
+                    return 1
+                return 0
+        raise ValueError(f"unsupported command {command.decode()}")
+
+
+def make_update(update_id, user_id, text):
+    """
+    Synthetic Telegram update with a private message (as JSON dict).
+    :param text: message text. Example: /ob BTC
+    """
+    message = {'message_id': update_id,
+               'date': int(time.time()),
+               'chat': {'id': user_id, 'type': 'private', 'first_name': 'Load'},
+               'from': {'id': user_id, 'is_bot': False, 'first_name': 'Load',
+                        'username': f'load{user_id}', 'language_code': 'en'},
+               'text': text}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+class FakeTelegramServer():
+    """
+    Local stand-in for the Telegram Bot API (getMe, sendMessage, sendPhoto,
+    sendChatAction, setWebhook...). It answers every call right away and
+    counts the calls by method.
+    How to use this class:
+
+    telegram_server = FakeTelegramServer()
+    await telegram_server.start()
+    application = ApplicationBuilder().token(FakeTelegramServer.token) \
+        .base_url(telegram_server.base_url).base_file_url(telegram_server.base_file_url).build()
+    """
+
+    token = '123456:STUB'
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0):
+        """
+        :param latency: seconds added to every answer (simulates the network)
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = {}
+        self.message_ids = itertools.count(1)
+        self.runner = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    @property
+    def base_file_url(self):
+        return f"http://{self.host}:{self.port}/file/bot"
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            # sendPhoto is multipart, the rest are urlencoded forms
+            params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({'ok': True, 'result': self.result(method, params)})
+
+    def result(self, method, params):
+        if method == 'getMe':
+            return {'id': 123456, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot',
+                    'can_join_groups': True, 'can_read_all_group_messages': False,
+                    'supports_inline_queries': False}
+        if method in ('sendMessage', 'sendPhoto'):
+            chat_id = params.get('chat_id', 0)
+            message = {'message_id': next(self.message_ids),
+                       'date': int(time.time()),
+                       'chat': {'id': int(chat_id), 'type': 'private'}}
+            if method == 'sendMessage':
+                message['text'] = str(params.get('text', ''))
+            else:
+                message['photo'] = [{'file_id': 'stub', 'file_unique_id': 'stub', 'width': 800, 'height': 600}]
+            return message
+        return True
+
+    async def start(self):
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+TRENDCORE_HEADERS = ['<img src="/img/time.png" title="Обновлено, секунд назад">', 'Монета', 'Долларов в уровне',
+                     '<img src="/img/clock.png" title="Оценка времени, которое понадобится для '
+                     'разъедания плотности, в минутах">', 'Цена', 'Монет в уровне', 'До уровня, %']
+
+
+def make_trendcore_rows(count=100, seed=0):
+    """
+    Synthetic TrendCore walls (one dict per row) to build a fake page.
+    :param count: number of rows
+    :param seed: random seed, the same seed always returns the same rows
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow() + timedelta(hours=3)  # the website shows Moscow time
+    rows = []
+    for index in range(count):
+        coin = f"C{index % max(1, count // 3)}"
+        amount = rng.choice([rng.randint(100, 999), rng.randint(1, 20)])
+        unit = 'K' if amount >= 100 else 'M'
+        created = now - timedelta(minutes=rng.randint(0, 3000))
+        rows.append({'coin': coin,
+                     'updated': str(rng.randint(1, 60)),
+                     'created': created.strftime('%Y-%m-%d %H:%M:%S') if rng.random() > 0.02 else None,
+                     'usd': f"{amount}{unit} ({rng.randint(1, 100)}% left)",
+                     'corrode': str(rng.randint(1, 500)),
+                     'price': f"{rng.uniform(0.01, 50000):.4f}",
+                     'coins': f"{rng.uniform(1, 1000000):.2f}",
+                     'distance': f"{rng.uniform(-10, 10):.2f}%"})
+    return rows
+
+
+def make_trendcore_page(rows):
+    """
+    HTML page with the same structure as the TrendCore wall table.
+    :param rows: rows from make_trendcore_rows()
+    """
+    html = ['<html><body><table><thead><tr>']
+    html.extend(f'<td>{header}</td>' for header in TRENDCORE_HEADERS)
+    html.append('</tr></thead><tbody>')
+    for row in rows:
+        created = '<img src="/img/new.png">' if row['created'] is None else \
+            f'<img src="/img/new.png" title="{row["created"]} (1.5 ч. назад)">'
+        html.append(f'<tr><td>{row["updated"]}</td>'
+                    f'<td><img src="/img/bar.png">{created}<a href="/ru/coin/{row["coin"]}">{row["coin"]}</a></td>'
+                    f'<td>{row["usd"]}</td><td>{row["corrode"]}</td><td>{row["price"]}</td>'
+                    f'<td>{row["coins"]}</td><td>{row["distance"]}</td></tr>')
+    html.append('</tbody></table></body></html>')
+    return ''.join(html)
+
+
+class FakeTrendCoreServer():
+    """
+    Local stand-in for the TrendCore wall table (config.trendcore_url).
+    How to use this class:
+
+    server = await FakeTrendCoreServer(rows=300).start()
+    config.trendcore_url = server.url
+    server.page = make_trendcore_page(...)  # the next requests get the new table
+
+    The page is gzip-compressed when the client accepts it and, with validators enabled,
+    carries an ETag and a Last-Modified date: conditional requests for the same page get a
+    304 Not Modified.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, rows=300, latency=0.0, seed=0, validators=True):
+        """
+        :param rows: number of walls in the table
+        :param latency: seconds added to every answer (simulates the network)
+        :param validators: send ETag/Last-Modified and answer the conditional requests
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.validators = validators
+        self.page = make_trendcore_page(make_trendcore_rows(rows, seed))
+        self.last_modified = datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')
+        self.requests = 0
+        self.not_modified = 0
+        self.runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/indexsee.php"
+
+    async def handle(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not self.validators:
+            response = web.Response(text=self.page, content_type='text/html')
+            response.enable_compression()
+            return response
+        etag = '"' + hashlib.md5(self.page.encode()).hexdigest() + '"'
+        if request.headers.get('If-None-Match') == etag:
+            self.not_modified += 1
+            return web.Response(status=304, headers={'ETag': etag})
+        response = web.Response(text=self.page, content_type='text/html',
+                                headers={'ETag': etag, 'Last-Modified': self.last_modified})
+        response.enable_compression()
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/indexsee.php', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+class FakeExchangeServer():
+    """
+    Local stand-in for the public market data endpoints used by the bot, on one port:
+    - Binance: exchangeInfo (spot, USDⓈ-M and COIN-M), depth, ticker price and 24h tickers
+    - Bybit v5: instruments-info and orderbook
+    - OKX v5: instruments and books
+    The paths don't collide, so every exchange can point to the same base URL
+    (see config.exchange_api_urls). ccxt loads its markets from the exchangeInfo and
+    instruments-info answers. The order books are synthetic and change on every call.
+    How to use this class:
+
+    server = await FakeExchangeServer(['BTC', 'ETH']).start()
+    config.exchange_api_urls = {name: server.url for name in ('binance', 'bybit', 'okx', 'okex')}
+    """
+
+    def __init__(self, coins=('BTC', 'ETH'), host='127.0.0.1', port=0, levels=1000, latency=0.0, seed=0):
+        """
+        :param coins: base currencies listed against USDT
+        :param levels: levels per side of every order book
+        :param latency: seconds added to every answer (simulates the network)
+        """
+        self.host = host
+        self.port = port
+        self.levels = levels
+        self.latency = latency
+        self.rng = random.Random(seed)
+        self.prices = {coin: 30000.0 / (index + 1) for index, coin in enumerate(coins)}
+        self.calls = {}
+        self.runner = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def book(self, coin, limit):
+        price = self.prices[coin] * (1 + self.rng.uniform(-0.001, 0.001))
+        levels = min(limit, self.levels)
+        bids, asks = [], []
+        bid = ask = price
+        for _ in range(levels):
+            bid *= 1 - self.rng.expovariate(20000)
+            ask *= 1 + self.rng.expovariate(20000)
+            size = self.rng.lognormvariate(-1.0, 1.0) * 30000.0 / self.prices[coin]
+            bids.append([f"{bid:.8g}", f"{size:.6f}"])
+            asks.append([f"{ask:.8g}", f"{size * self.rng.uniform(0.5, 1.5):.6f}"])
+        return bids, asks
+
+    def coin(self, market_id):
+        # BTCUSDT or BTC-USDT
+        return market_id.replace('-', '')[:-len('USDT')]
+
+    async def handle(self, request):
+        path = request.path
+        self.calls[path] = self.calls.get(path, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        query = request.query
+        now = int(time.time() * 1000)
+
+        if path.endswith('/exchangeInfo'):
+            symbols = []
+            if path == '/api/v3/exchangeInfo':
+                symbols = [{'symbol': f"{coin}USDT", 'status': 'TRADING', 'baseAsset': coin, 'quoteAsset': 'USDT',
+                            'baseAssetPrecision': 8, 'quotePrecision': 8, 'quoteAssetPrecision': 8,
+                            'orderTypes': ['LIMIT', 'MARKET'], 'isSpotTradingAllowed': True,
+                            'isMarginTradingAllowed': False, 'permissions': ['SPOT'],
+                            'filters': [{'filterType': 'PRICE_FILTER', 'minPrice': '0.01', 'maxPrice': '1000000',
+                                         'tickSize': '0.01'},
+                                        {'filterType': 'LOT_SIZE', 'minQty': '0.00001', 'maxQty': '9000',
+                                         'stepSize': '0.00001'}]}
+                           for coin in self.prices]
+            return web.json_response({'timezone': 'UTC', 'serverTime': now, 'rateLimits': [], 'symbols': symbols})
+        if path == '/api/v3/depth':
+            bids, asks = self.book(self.coin(query['symbol']), int(query.get('limit', 100)))
+            return web.json_response({'lastUpdateId': now, 'bids': bids, 'asks': asks})
+        if path == '/api/v3/ticker/price':
+            coin = self.coin(query['symbol'])
+            return web.json_response({'symbol': query['symbol'], 'price': f"{self.prices[coin]:.8g}"})
+        if path == '/api/v3/ticker/24hr':
+            # All the symbols, the first coins have the highest volume
+            return web.json_response([{'symbol': f"{coin}USDT", 'lastPrice': f"{price:.8g}",
+                                       'volume': f"{1e9 / (index + 1) / price:.2f}",
+                                       'quoteVolume': f"{1e9 / (index + 1):.2f}",
+                                       'openTime': now - 86400000, 'closeTime': now, 'count': 1000}
+                                      for index, (coin, price) in enumerate(self.prices.items())])
+
+        if path == '/v5/market/instruments-info':
+            instruments = []
+            if query.get('category') == 'spot':
+                instruments = [{'symbol': f"{coin}USDT", 'baseCoin': coin, 'quoteCoin': 'USDT', 'status': 'Trading',
+                                'innovation': '0', 'marginTrading': 'none',
+                                'lotSizeFilter': {'basePrecision': '0.000001', 'quotePrecision': '0.00000001',
+                                                  'minOrderQty': '0.000048', 'maxOrderQty': '71.73956243',
+                                                  'minOrderAmt': '1', 'maxOrderAmt': '2000000'},
+                                'priceFilter': {'tickSize': '0.01'}}
+                               for coin in self.prices]
+            return web.json_response({'retCode': 0, 'retMsg': 'OK', 'time': now,
+                                      'result': {'category': query.get('category'), 'list': instruments,
+                                                 'nextPageCursor': ''}})
+        if path == '/v5/market/orderbook':
+            bids, asks = self.book(self.coin(query['symbol']), int(query.get('limit', 50)))
+            return web.json_response({'retCode': 0, 'retMsg': 'OK', 'time': now,
+                                      'result': {'s': query['symbol'], 'b': bids, 'a': asks, 'ts': now, 'u': now}})
+
+        if path == '/api/v5/public/instruments':
+            instruments = []
+            if query.get('instType') == 'SPOT':
+                instruments = [{'instId': f"{coin}-USDT", 'instType': 'SPOT', 'baseCcy': coin, 'quoteCcy': 'USDT',
+                                'state': 'live', 'lotSz': '0.00000001', 'minSz': '0.00001', 'tickSz': '0.01',
+                                'listTime': '1548133413000', 'category': '1', 'alias': '', 'ctMult': '',
+                                'ctType': '', 'ctVal': '', 'ctValCcy': '', 'expTime': '', 'lever': '10',
+                                'optType': '', 'settleCcy': '', 'stk': '', 'uly': ''}
+                               for coin in self.prices]
+            return web.json_response({'code': '0', 'msg': '', 'data': instruments})
+        if path == '/api/v5/market/books':
+            bids, asks = self.book(self.coin(query['instId']), int(query.get('sz', 400)))
+            return web.json_response({'code': '0', 'msg': '',
+                                      'data': [{'bids': [level + ['0', '1'] for level in bids],
+                                                'asks': [level + ['0', '1'] for level in asks], 'ts': str(now)}]})
+        return web.json_response({'code': -1, 'msg': f'Unknown path {path}'}, status=404)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('*', '/{tail:.*}', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        self.port = self.runner.addresses[0][1]
+        return self
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
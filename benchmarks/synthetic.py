@@ -0,0 +1,61 @@
+"""
+Synthetic order books for the benchmarks (no network access needed).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+EXCHANGES = ('binance', 'okx', 'bybit')
+
+
+def make_order_book(levels=1000, price=30000.0, exchanges=EXCHANGES, seed=0, step=0.00005):
+    """
+    Build a raw aggregated order book like the one returned by the fetchers
+    of AggregatedOrderBook (Price, Size, Side, Exchange, SizeUSD).
+    Around 1% of the levels are walls (50x the usual size).
+    :param levels: levels per side and exchange
+    :param price: mid price
+    :param exchanges: exchange names
+    :param seed: random seed, the same seed always returns the same book
+    :param step: average distance between two levels (fraction of the price)
+    :return: DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for exchange in exchanges:
+        for side, direction in (('buy', -1), ('sell', 1)):
+            steps = np.cumsum(rng.exponential(step, levels))
+            prices = np.round(price * (1 + direction * steps), 2)
+            sizes = rng.lognormal(-1.0, 1.0, levels)
+            walls = rng.random(levels) < 0.01
+            sizes[walls] *= 50
+            frames.append(pd.DataFrame({'Price': prices,
+                                        'Size': sizes,
+                                        'Side': side,
+                                        'Exchange': exchange,
+                                        'SizeUSD': prices * sizes}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def make_aggregated_order_book(levels=1000, price=30000.0, wallsize=100000, symbol="BTC/USDT",
+                               data_path=None, seed=0, step=0.00005):
+    """
+    Build a processed AggregatedOrderBook from a synthetic book, ready to render charts,
+    without creating any exchange client.
+    :param data_path: folder where the chart is saved (defaults to config.data_path)
+    :return: AggregatedOrderBook
+    """
+    import config
+    from AggregatedOrderBook import AggregatedOrderBook
+    order_book = AggregatedOrderBook.__new__(AggregatedOrderBook)
+    order_book.exchanges = {name: None for name in EXCHANGES}
+    order_book.markets = {}
+    order_book.symbol = symbol
+    order_book.backend = 'synthetic'
+    data_path = data_path or config.data_path
+    order_book.order_book_image = os.path.join(data_path, symbol.replace("/", "") + ".png")
+    order_book.order_book_snapshot = os.path.join(data_path, symbol.replace("/", "") + ".snapshot")
+    order_book.current_price = price
+    order_book.process_order_book(make_order_book(levels, price, seed=seed, step=step), wallsize)
+    return order_book
@@ -0,0 +1,93 @@
+"""
+TrendCore post-processing benchmark.
+Parses a synthetic TrendCore page (10x the size of the real table by default) and times
+TrendCore.process_rows() (whole-column regex extraction, NumPy unit scaling and bulk date
+parsing) against the previous row-by-row version kept below as a reference (re.sub per
+cell, separate str.replace/str.extract passes, convert_units with apply and strptime per
+row). Both must produce the same columns; the script fails otherwise.
+The incremental reuse of process_rows is disabled: every run parses all the rows.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.trendcore_parse --rows 3000 --runs 20
+"""
+
+import re
+import time
+import argparse
+import statistics
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import utils
+import trendcore
+from benchmarks.stubs import make_trendcore_rows, make_trendcore_page
+
+
+def process_rows_rowwise(df):
+    """
+    The row-by-row post-processing used before (reference).
+    """
+    df = df.copy()
+    df['Created'] = [re.sub(r'\(.*?\)', '', value).strip() if value is not None else None
+                     for value in df['Created'].astype(object).where(df['Created'].notna(), None)]
+    df['Amount left %'] = df['USD per level'].str.extract(r'\((.*?)\)')[0]
+    df['Amount left %'] = df['Amount left %'].str.replace(r'[^\.|\d]', '', regex=True)
+    df['USD per level'] = df['USD per level'].str.replace(r'\s\(.*?\)', '', regex=True).str.strip()
+    df['Amount'] = df['USD per level'].apply(utils.convert_units).astype(float)
+    created = [datetime.strptime(value, '%Y-%m-%d %H:%M:%S') - timedelta(hours=3)
+               if isinstance(value, str) else datetime.utcnow()
+               for value in df['Created']]
+    df['To level %'] = df['To level %'].str.replace('%', '').str.rstrip().astype(float)
+    df['Distance'] = df['To level %'].abs()
+    df['Wall type'] = np.where(df['To level %'] > 0, 'sell', 'buy')
+    df['Created'] = pd.to_datetime(created)
+    df['Elapsed Minutes'] = round((datetime.utcnow() - df['Created']).dt.total_seconds() / 60)
+    return df
+
+
+def process_rows_vectorized(df):
+    # Forget the previous scrap so every row is parsed
+    trendcore._previous_rows = None
+    return trendcore.TrendCore.__new__(trendcore.TrendCore).process_rows(df.copy())
+
+
+def measure(process, df, runs):
+    timings = []
+    result = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = process(df)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TrendCore post-processing benchmark")
+    parser.add_argument("--rows", type=int, default=3000, help="rows of the table (the real one has ~300)")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    html = make_trendcore_page(make_trendcore_rows(args.rows, args.seed))
+    start = time.perf_counter()
+    df = trendcore.TrendCore.__new__(trendcore.TrendCore).parse_table(html)
+    parse_time = time.perf_counter() - start
+
+    rowwise_time, expected = measure(process_rows_rowwise, df, args.runs)
+    vectorized_time, result = measure(process_rows_vectorized, df, args.runs)
+
+    # The rows without a creation date get the current time: only compare the dated ones
+    dated = df['Created'].notna().values
+    pd.testing.assert_frame_equal(expected[dated].drop(columns=['Elapsed Minutes']),
+                                  result[dated].drop(columns=['Elapsed Minutes']))
+    assert list(expected.columns) == list(result.columns) and expected.dtypes.equals(result.dtypes)
+
+    print(f"{args.rows} rows (HTML parsing: {parse_time * 1000:.1f} ms)")
+    print(f"{'post-processing':<18}{'median ms':>11}{'µs/row':>9}")
+    for name, elapsed in (('row by row', rowwise_time), ('vectorized', vectorized_time)):
+        print(f"{name:<18}{elapsed * 1000:>11.2f}{elapsed / args.rows * 1e6:>9.2f}")
+    print(f"speedup: {rowwise_time / vectorized_time:.1f}x, identical columns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+TrendCore refresh concurrency check.
+Many concurrent /tc (TrendCore.load() calls) hit an expired cache at the same time,
+against a local stand-in of the TrendCore website. Checks that:
+- only one of them downloads and parses the page, the others get the same table
+- a thread reading the snapshot file during the refreshes always gets a complete table
+- the event loop keeps running while the page is scraped (reports the maximum loop lag)
+Exit code is 1 when a check fails.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.trendcore_single_flight --callers 50 --rounds 5
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import config
+from benchmarks.stubs import FakeTrendCoreServer, make_trendcore_page, make_trendcore_rows
+
+
+def read_snapshots(path, rows, stop, results):
+    """
+    Read the snapshot file in a loop, counting the reads that don't return the whole table.
+    """
+    import snapshot
+    reads = incomplete = 0
+    while not stop.is_set():
+        if os.path.isfile(path):
+            try:
+                df = snapshot.read(path)
+                incomplete += len(df.index) != rows
+            except Exception:
+                incomplete += 1
+            reads += 1
+    results.extend([reads, incomplete])
+
+
+async def measure_lag(stop):
+    """
+    :return: the maximum delay of a 10 ms sleep while the loop is busy
+    """
+    lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.01)
+        lag = max(lag, time.perf_counter() - start - 0.01)
+    return lag
+
+
+async def run(args, data_path):
+    server = await FakeTrendCoreServer(rows=args.rows, latency=args.latency).start()
+    config.trendcore_url = server.url
+    config.trendcore_snapshot = os.path.join(data_path, 'trendcore.snapshot')
+    config.shared_cache = None
+    import trendcore
+
+    stop_reader = threading.Event()
+    reader_results = []
+    reader = threading.Thread(target=read_snapshots,
+                              args=(config.trendcore_snapshot, args.rows, stop_reader, reader_results))
+    reader.start()
+    failed = False
+    try:
+        for round_number in range(args.rounds):
+            # New page and expired caches: the next /tc must refresh
+            server.page = make_trendcore_page(make_trendcore_rows(args.rows, seed=round_number))
+            trendcore._published = None
+            if os.path.isfile(config.trendcore_snapshot):
+                past = time.time() - 120
+                os.utime(config.trendcore_snapshot, (past, past))
+
+            requests_before = server.requests
+            stop_lag = asyncio.Event()
+            lag_task = asyncio.create_task(measure_lag(stop_lag))
+            start = time.perf_counter()
+            results = await asyncio.gather(*[trendcore.TrendCore.load() for _ in range(args.callers)])
+            elapsed = time.perf_counter() - start
+            stop_lag.set()
+            lag = await lag_task
+
+            downloads = server.requests - requests_before
+            tables = len(set(id(tc.dataframe) for tc in results))
+            complete = all(len(tc.dataframe.index) == args.rows for tc in results)
+            status = "OK" if downloads == 1 and tables == 1 and complete else "FAIL"
+            failed = failed or status == "FAIL"
+            print(f"round {round_number + 1}: callers {args.callers}  downloads {downloads}  "
+                  f"distinct tables {tables}  slowest {elapsed * 1000:.0f} ms  "
+                  f"max loop lag {lag * 1000:.1f} ms  {status}")
+    finally:
+        stop_reader.set()
+        reader.join()
+        await server.stop()
+
+    reads, incomplete = reader_results
+    status = "OK" if incomplete == 0 else "FAIL"
+    failed = failed or status == "FAIL"
+    print(f"snapshot reads during the refreshes: {reads}  incomplete: {incomplete}  {status}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TrendCore refresh concurrency check")
+    parser.add_argument("--callers", type=int, default=50, help="concurrent /tc")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--rows", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds the stand-in takes to answer")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_path:
+        failed = asyncio.run(run(args, data_path))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Wall detector benchmark.
+Runs the detectors of walls.py and scipy.signal.find_peaks(sizes, prominence=wallsize)
+on the same books and reports the median time and the agreement with find_peaks
+(share of the find_peaks walls found and share of the detected walls that find_peaks
+also reports). Needs scipy installed (the bot doesn't).
+
+The books are the order book snapshots saved by /ob (data/*.snapshot) or synthetic ones.
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.wall_detectors --runs 20 --levels 1000
+    python -m benchmarks.wall_detectors data/BTCUSDT.snapshot
+"""
+
+import time
+import argparse
+import statistics
+import numpy as np
+import walls
+import snapshot
+from benchmarks.synthetic import make_order_book
+
+
+def sides(order_books_df):
+    """
+    :return: the (prices, sizes, exchanges) of both sides sorted like AggregatedOrderBook.process_order_book
+    """
+    mid = (order_books_df.loc[order_books_df['Side'] == 'buy', 'Price'].max() +
+           order_books_df.loc[order_books_df['Side'] == 'sell', 'Price'].min()) / 2
+    result = []
+    for side in ('buy', 'sell'):
+        df = order_books_df[order_books_df['Side'] == side].sort_values('Price', ascending=False)
+        result.append((df['Price'].values, df['SizeUSD'].values, df['Exchange'].values))
+    return mid, result
+
+
+def measure(detect, books, runs):
+    timings = []
+    found = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        found = [detect(mid, *side) for mid, book_sides in books for side in book_sides]
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), found
+
+
+def main():
+    from scipy.signal import find_peaks
+
+    parser = argparse.ArgumentParser(description="Wall detector benchmark")
+    parser.add_argument("snapshots", nargs='*', help="order book snapshots (default: synthetic books)")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--levels", type=int, default=1000, help="levels per side and exchange (synthetic)")
+    parser.add_argument("--books", type=int, default=5, help="number of synthetic books")
+    parser.add_argument("--wallsize", type=float, default=100000)
+    parser.add_argument("--distance", type=float, default=5.0)
+    args = parser.parse_args()
+
+    if args.snapshots:
+        books = [sides(snapshot.read(path)) for path in args.snapshots]
+    else:
+        books = [sides(make_order_book(args.levels, seed=seed)) for seed in range(args.books)]
+    levels = sum(len(side[0]) for _, book_sides in books for side in book_sides)
+    print(f"{len(books)} books, {levels} levels, wallsize {args.wallsize:.0f}, distance {args.distance}%")
+
+    reference_time, reference = measure(
+        lambda mid, prices, sizes, exchanges: find_peaks(sizes, prominence=args.wallsize)[0], books, args.runs)
+    print(f"{'detector':<14}{'median ms':>11}{'walls':>8}{'recall':>9}{'precision':>11}")
+    print(f"{'find_peaks':<14}{reference_time * 1000:>11.2f}{sum(map(len, reference)):>8}")
+    for name in walls.DETECTORS:
+        detector = walls.get_detector(args.wallsize, args.distance, name)
+        elapsed, found = measure(lambda mid, prices, sizes, exchanges: detector.detect(prices, sizes, exchanges, mid),
+                                 books, args.runs)
+        common = sum(len(np.intersect1d(a, b)) for a, b in zip(reference, found))
+        detected = sum(map(len, found))
+        expected = sum(map(len, reference))
+        recall = common / expected if expected else 1.0
+        precision = common / detected if detected else 1.0
+        print(f"{name:<14}{elapsed * 1000:>11.2f}{detected:>8}{recall:>9.1%}{precision:>11.1%}")
+
+
+if __name__ == '__main__':
+    main()
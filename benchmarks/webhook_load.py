@@ -0,0 +1,115 @@
+"""
+Webhook load test.
+Starts a local bot instance in webhook mode (in a separate process, with a stand-in for
+the Telegram Bot API) and posts synthetic /start updates to it from several concurrent
+connections. Reports the sustained updates per second and how many were rejected by
+the backpressure (503), and checks that an update without the secret token is refused (403).
+
+Usage (from the repository root, with config.py in place):
+    python -m benchmarks.webhook_load --duration 10 --connections 50 --workers 16
+"""
+
+import sys
+import time
+import signal
+import asyncio
+import argparse
+import itertools
+import multiprocessing
+import aiohttp
+
+# Secret token of the instance, sent with every update like Telegram does
+SECRET = 'load-test-secret'
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def run_instance(args, queue):
+    from telegram.ext import ApplicationBuilder, CommandHandler
+    import main
+    import webhook
+    from benchmarks.stubs import FakeTelegramServer
+
+    async def serve():
+        telegram_server = await FakeTelegramServer(latency=args.telegram_latency).start()
+        application = ApplicationBuilder().token(FakeTelegramServer.token) \
+            .base_url(telegram_server.base_url).base_file_url(telegram_server.base_file_url) \
+            .updater(None).build()
+        application.add_handler(CommandHandler("start", main.start))
+        server = webhook.WebhookServer(application, listen='127.0.0.1', port=0, url_path='telegram',
+                                       secret_token=SECRET, queue_size=args.queue_size, workers=args.workers,
+                                       webhook_url='')
+        await server.start()
+        queue.put(server.port)
+
+        stop_event = asyncio.Event()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop_event.set)
+        await stop_event.wait()
+        start = time.perf_counter()
+        await server.stop()
+        await telegram_server.stop()
+        queue.put((telegram_server.calls.get('sendMessage', 0), time.perf_counter() - start))
+
+    asyncio.run(serve())
+
+
+async def load(port, duration, connections):
+    from benchmarks.stubs import make_update
+    url = f"http://127.0.0.1:{port}/telegram"
+    update_ids = itertools.count(1)
+    statuses = {}
+    deadline = time.monotonic() + duration
+
+    async def sender(session, user_id):
+        while time.monotonic() < deadline:
+            update = make_update(next(update_ids), user_id, '/start')
+            async with session.post(url, json=update, headers={SECRET_HEADER: SECRET}) as response:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if response.status == 503:
+                    # Backpressure: back off like Telegram does
+                    await asyncio.sleep(0.05)
+
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*[sender(session, 1000 + index) for index in range(connections)])
+        # A forged update (no secret token)
+        async with session.post(url, json=make_update(next(update_ids), 1, '/start')) as response:
+            forged = response.status
+    return statuses, forged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook load test")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--telegram-latency", type=float, default=0.0,
+                        help="seconds added by the Telegram stand-in to every API call")
+    args = parser.parse_args()
+
+    queue = multiprocessing.Queue()
+    instance = multiprocessing.Process(target=run_instance, args=(args, queue))
+    instance.start()
+    port = queue.get(timeout=60)
+
+    start = time.perf_counter()
+    statuses, forged = asyncio.run(load(port, args.duration, args.connections))
+    elapsed = time.perf_counter() - start
+    instance.terminate()  # SIGTERM: graceful drain
+    processed, drain_time = queue.get(timeout=120)
+    instance.join()
+
+    accepted = statuses.get(200, 0)
+    print(f"connections: {args.connections}  workers: {args.workers}  queue size: {args.queue_size}")
+    print(f"accepted:  {accepted} ({accepted / elapsed:.0f} updates/s)")
+    print(f"rejected:  {statuses.get(503, 0)} (503 backpressure)")
+    print(f"other:     {sum(count for status, count in statuses.items() if status not in (200, 503))}")
+    print(f"processed: {processed} ({processed / (elapsed + drain_time):.0f} updates/s sustained, "
+          f"drained in {drain_time:.2f} s)")
+    status = "OK" if forged == 403 else "FAIL"
+    print(f"update without the secret token: HTTP {forged}  {status}")
+    sys.exit(1 if status == "FAIL" else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import threading
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.style
+import matplotlib.ticker as ticker
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+import config
+
+# Output formats supported by the template renderer and their file extension.
+# - png: regular RGBA PNG (same as the classic renderer)
+# - png8: palette-quantised PNG (config.chart_colors colors). Much smaller uploads.
+# - webp: lossy WebP (config.chart_webp_quality)
+FORMATS = {
+    'png': 'png',
+    'png8': 'png',
+    'webp': 'webp',
+}
+
+STYLE = 'dark_background'
+
+
+def file_extension(image_format):
+    """
+    :param image_format: png, png8 or webp
+    :return: the file extension to use for the image
+    """
+    if image_format not in FORMATS:
+        raise ValueError(f"Unsupported chart format {image_format}. Use one of: {', '.join(FORMATS)}")
+    return FORMATS[image_format]
+
+
+def custom_formatter(x, pos):
+    if x >= 1e6:
+        return f'{x / 1e6:.1f}M'
+    else:
+        return f'{x / 1e3:.1f}K'
+
+
+class ChartTemplate():
+    """
+    Styled order book figure built once and reused for every chart.
+    Only the line data, the annotations and the text artists change between charts,
+    so we skip the figure creation, styling, axes, formatter and legend setup.
+    How to use this class:
+
+    template = ChartTemplate()
+    template.render(title, (bid_prices, bid_cumulative), (ask_prices, ask_cumulative),
+                    annotations, texts, "BTCUSDT.png")
+
+    - annotations is a list of (text, (x, y), (offset_x, offset_y), arrow color).
+    - texts is the list of lines displayed in the bottom-left corner.
+    """
+
+    # Y position (axes coordinates) of the text lines in the bottom-left corner
+    text_positions = (0.03, 0.08, 0.13, 0.18)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.annotations = []
+        with matplotlib.style.context(STYLE):
+            self.figure = Figure(figsize=(8, 6))  # Width: 8 inches, Height: 6 inches
+            self.canvas = FigureCanvasAgg(self.figure)
+            self.axes = self.figure.add_subplot()
+            self.title = self.axes.set_title("")
+            self.buy_line, = self.axes.plot([], [], label='Buy', color='g')
+            self.sell_line, = self.axes.plot([], [], label='Sell', color='r')
+            self.axes.set_xlabel('Price')
+            self.axes.set_ylabel('Cumulative Size')
+            self.axes.yaxis.set_major_formatter(ticker.FuncFormatter(custom_formatter))
+            self.axes.legend(loc='lower right')
+            self.texts = [self.axes.text(0.03, y, '', transform=self.axes.transAxes, ha='left')
+                          for y in self.text_positions]
+
+    def update(self, title, bids, asks, annotations, texts):
+        """
+        Replace the data of the chart.
+        :param title: chart title
+        :param bids: (prices, cumulative sizes) of the buy side
+        :param asks: (prices, cumulative sizes) of the sell side
+        :param annotations: list of (text, xy, xytext, arrow color)
+        :param texts: lines of text displayed in the bottom-left corner (bottom first)
+        """
+        self.title.set_text(title)
+        self.buy_line.set_data(*bids)
+        self.sell_line.set_data(*asks)
+
+        for annotation in self.annotations:
+            annotation.remove()
+        # Annotations take the style at creation time
+        with matplotlib.style.context(STYLE):
+            self.annotations = [self.axes.annotate(text, xy=xy, xytext=xytext, textcoords='offset points',
+                                                   arrowprops=dict(arrowstyle="->", color=color))
+                                for text, xy, xytext, color in annotations]
+
+        for artist, text in zip(self.texts, texts):
+            artist.set_text(text)
+
+        self.axes.relim()
+        self.axes.autoscale_view()
+
+    def save(self, path, image_format='png', dpi=100):
+        """
+        Render the figure and write it to disk.
+        :param path: output file
+        :param image_format: png, png8 or webp
+        :param dpi: resolution (100 dpi = 800x600 pixels)
+        """
+        file_extension(image_format)
+        if image_format == 'png':
+            self.figure.savefig(path, dpi=dpi, format='png', facecolor=self.figure.get_facecolor())
+            return
+        # Encode from the raw RGBA buffer instead of going through an intermediate PNG
+        self.figure.set_dpi(dpi)
+        self.canvas.draw()
+        image = Image.frombuffer('RGBA', self.canvas.get_width_height(), self.canvas.buffer_rgba(),
+                                 'raw', 'RGBA', 0, 1).convert('RGB')
+        if image_format == 'png8':
+            image = image.quantize(colors=config.chart_colors)
+            image.save(path, format='PNG', optimize=True)
+        else:
+            image.save(path, format='WEBP', quality=config.chart_webp_quality)
+
+    def render(self, title, bids, asks, annotations, texts, path, image_format='png', dpi=100):
+        # The figure is shared: one chart at a time
+        with self.lock:
+            self.update(title, bids, asks, annotations, texts)
+            self.save(path, image_format, dpi)
+
+
+_template = None
+
+
+def get_template():
+    """
+    :return: the process-wide chart template (created on first use)
+    """
+    global _template
+    if _template is None:
+        _template = ChartTemplate()
+    return _template
+
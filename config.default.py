@@ -10,7 +10,12 @@ if not os.path.exists(data_path):
 
 # TrendCore
 trendcore_url = 'https://trendcore.ru/indexsee.php'
-trendcore_csv = join(data_path, 'trendcore.csv')
+trendcore_snapshot = join(data_path, 'trendcore.snapshot')
+# Timeouts of the TrendCore page download (seconds): connection and read
+trendcore_connect_timeout = 5
+trendcore_read_timeout = 15
+# Seconds the last TrendCore table is served from memory by TrendCore.load() before a refresh
+trendcore_memory_ttl = 60
 
 # Telegram
 telegram_token = ""  # Update your token
@@ -19,4 +24,183 @@ telegram_bot = ""  # Optional
 # User data
 user_data = join(data_path, 'users_data.db')
 
+# Metrics (Prometheus format) served by the bot process at http://metrics_host:metrics_port/metrics
+# Give every instance on the same host its own port: when the port is taken the bot runs without it.
+metrics_enabled = True
+metrics_host = '127.0.0.1'
+metrics_port = 9108
 
+# Tracing (opt-in): span tree per Telegram update. Updates slower than tracing_slow_threshold
+# seconds are written to a rotating JSONL log. With tracing_profile enabled the handlers run
+# under cProfile and the stats of updates slower than tracing_profile_threshold are saved
+# in data/profiles (only the newest tracing_profile_keep files are kept).
+tracing_enabled = False
+tracing_slow_threshold = 2.0
+tracing_slow_log = join(data_path, 'slow_requests.jsonl')
+tracing_log_max_bytes = 10 * 1024 * 1024
+tracing_log_backups = 5
+tracing_profile = False
+tracing_profile_threshold = 5.0
+tracing_profile_keep = 20
+
+# Seconds to wait after the bot starts before importing the heavy modules (ccxt, pandas,
+# matplotlib) in the background. Set to None to load them on the first /tc or /ob instead.
+warmup_delay = 1.0
+
+# Order book backend for /ob: 'ccxt' or 'rest' (direct async REST connectors, faster)
+order_book_backend = 'ccxt'
+# REST connectors: pooled HTTP connections and request timeout (seconds)
+connector_pool_size = 100
+connector_timeout = 10
+# Base URL of the exchange APIs by exchange name, to use a mirror or a local stand-in
+# (both backends). Example: {'binance': 'https://api1.binance.com'}
+exchange_api_urls = {}
+# Hard latency budget of the order book fetch (seconds). The exchanges that didn't answer
+# in time are left out and listed in the /ob caption.
+order_book_budget = 5.0
+# Exchange health: weight of the last request in the latency/error rate moving averages
+exchange_ewma_alpha = 0.2
+# Circuit breaker: skip an exchange for circuit_cooldown seconds after circuit_failure_threshold
+# consecutive failures or when its error rate reaches circuit_error_rate (after circuit_min_requests)
+circuit_failure_threshold = 3
+circuit_error_rate = 0.5
+circuit_min_requests = 10
+circuit_cooldown = 60
+# Hedged requests: when an exchange hasn't answered after its estimated p95 latency (at least
+# hedge_min_delay seconds, once it has hedge_min_requests requests), the order book request is
+# sent again and the first answer wins
+hedge_enabled = True
+hedge_min_delay = 0.2
+hedge_min_requests = 10
+
+# Rate limits of the exchange APIs shared by every request of the process (see ratelimit.py):
+# {exchange: (weight, seconds)} as documented by the exchanges. The requests spend at most
+# rate_limit_headroom of the limit over time and rate_limit_burst of it at once (keep the sum <= 1).
+# The prewarmer, scanner and recorder leave rate_limit_reserve of the burst to the users.
+rate_limit_enabled = True
+rate_limits = {
+    'binance': (6000, 60),
+    'bybit': (600, 5),
+    'okx': (40, 2),
+    'coinbase': (10, 1),
+}
+rate_limit_headroom = 0.8
+rate_limit_burst = 0.2
+rate_limit_reserve = 0.5
+
+# Prewarming of the popular order books (see prewarm.py): every /ob and /depth counts for its
+# symbol with a popularity that halves every prewarm_half_life seconds. The prewarm_top_n symbols
+# with a popularity of at least prewarm_min_score are refreshed prewarm_lead seconds before their
+# cache expires (checked every prewarm_interval seconds), with at most prewarm_budget refreshes per
+# minute, and their charts are rendered for the prewarm_charts_per_symbol most used wall settings.
+prewarm_enabled = True
+prewarm_top_n = 5
+prewarm_min_score = 3
+prewarm_half_life = 900
+prewarm_lead = 10
+prewarm_interval = 5
+prewarm_budget = 20
+prewarm_charts_per_symbol = 2
+
+# Wall detection for /ob (see walls.py): 'prominence' (same walls as scipy's find_peaks),
+# 'topk' (the biggest levels within the user's /distance) or 'zscore' (rolling z-score)
+wall_detector = 'prominence'
+wall_top_k = 5
+wall_top_k_per_exchange = False
+wall_zscore_window = 50
+wall_zscore_threshold = 3.0
+
+# Text mode of /ob (/obmode text or /ob BTC text): number of price bands per side of the depth
+# ladder, spread over the user's /distance (ob_ladder_distance % when it's not set)
+ob_ladder_steps = 8
+ob_ladder_distance = 5.0
+
+# Market scanner (see scanner.py), a local alternative to the TrendCore table for /scan: every
+# scanner_interval seconds, the walls of the scanner_top_n USDT pairs with the highest volume on
+# scanner_exchanges (order books of scanner_depth_limit levels, None = exchange default), fetching
+# scanner_concurrency symbols at the same time and detecting the walls in scanner_processes
+# processes. A scan stops after scanner_budget seconds. Run it with "python scanner.py" or enable
+# it inside the bot process.
+scanner_enabled = False
+scanner_snapshot = join(data_path, 'scanner.snapshot')
+scanner_exchanges = ['binance', 'okx', 'bybit']
+scanner_top_n = 100
+scanner_concurrency = 10
+scanner_processes = 2
+scanner_depth_limit = None
+scanner_budget = 45
+scanner_interval = 60
+scanner_wallsize = 100_000
+scanner_distance = 10.0
+
+# Local cache of the order books and charts of /ob (see artifact_cache.py): an LRU of at most
+# artifact_memory_bytes in memory in front of the files of artifact_cache_path (at most
+# artifact_disk_bytes, the least recently used files are deleted). Each tier drops the entries
+# older than its TTL or not used for that long (seconds): the disk tier keeps its files across
+# restarts. The instances sharing the folder see each other's files (the index is rebuilt from
+# the folder every artifact_scan_interval seconds). An order book is served from the cache up
+# to order_book_max_age seconds old. With a shared cache the order books are kept there for
+# shared_cache_ttl seconds instead.
+artifact_cache_path = join(data_path, 'artifacts')
+artifact_memory_bytes = 64 * 1024 * 1024
+artifact_memory_ttl = 60
+artifact_disk_bytes = 256 * 1024 * 1024
+artifact_disk_ttl = 24 * 60 * 60
+artifact_scan_interval = 60
+order_book_max_age = 60
+
+# /depth: distance bands around the price (%) and market order sizes (USD)
+depth_bands = [0.1, 0.5, 1, 2, 5]
+depth_order_sizes = [100_000, 1_000_000, 10_000_000]
+
+# Chart rendering: 'classic' (new matplotlib figure per chart) or 'template' (styled figure
+# built once, only the data is updated). The template renderer supports these formats:
+# 'png', 'png8' (palette-quantised PNG with chart_colors colors) and 'webp'. The template and
+# the smaller formats are opt-in: the default is the classic PNG chart.
+chart_mode = 'classic'
+chart_format = 'png'
+chart_dpi = 100
+chart_colors = 64
+chart_webp_quality = 80
+# Maximum points plotted per side of the chart (None = every level): the cumulative curves are
+# reduced to the first and last level of equal price bins, keeping the annotated walls exact
+chart_max_points = 1000
+
+# Order book recorder: snapshots the watchlist every recorder_interval seconds into memory-mapped
+# ring buffers (recorder_capacity records per symbol) with recorder_bins bins of recorder_bin_pct %
+# from the mid price. Run it with "python recorder.py" or enable it inside the bot process.
+recorder_enabled = False
+recorder_path = join(data_path, 'recorder')
+recorder_watchlist = ['BTC/USDT', 'ETH/USDT']
+recorder_exchanges = ['binance', 'okx', 'bybit']
+recorder_interval = 60
+recorder_capacity = 7 * 24 * 60  # one week at 1-minute cadence
+recorder_bins = 100
+recorder_bin_pct = 0.1
+
+# Shared cache for several bot instances: None (each instance caches in data_path), 'sqlite'
+# (processes on the same host, shared_cache_path can point to /dev/shm) or 'redis://host:port/db'.
+shared_cache = None
+shared_cache_path = join(data_path, 'shared_cache.db')
+shared_cache_prefix = 'obbot:'
+shared_cache_ttl = 60  # seconds the order books, charts and TrendCore table stay in the shared cache
+shared_cache_timeout = 5  # Redis socket timeout (seconds)
+shared_cache_lock_ttl = 30  # a refresh lock expires after this time if its owner dies
+shared_cache_wait = 20  # maximum time to wait for another instance to refresh a key
+
+# How the bot receives the updates: 'polling' or 'webhook'.
+# In webhook mode an HTTP server listens on webhook_listen:webhook_port/webhook_path and queues
+# the updates (up to webhook_queue_size, then it answers 503) for webhook_workers workers.
+# webhook_url is the public HTTPS URL registered in Telegram (leave it empty to register it yourself).
+ingestion_mode = 'polling'
+webhook_listen = '127.0.0.1'
+webhook_port = 8443
+webhook_path = 'telegram'
+webhook_url = ''
+# Sent by Telegram in the X-Telegram-Bot-Api-Secret-Token header, the updates without it are
+# refused. Required when webhook_url is empty, otherwise a random one is generated at startup.
+webhook_secret = ''
+webhook_queue_size = 1000
+webhook_workers = 16
+webhook_max_connections = 40
+webhook_drain_timeout = 30
@@ -0,0 +1,31 @@
+"""
+Direct async REST depth connectors.
+A faster alternative to ccxt for the order book: every connector shares the same
+pooled HTTP session and decodes the depth payload straight into float64 NumPy arrays.
+"""
+from .base import Connector, ConnectorError, DepthSnapshot, levels_to_array, get_session, close_sessions
+from .binance import Binance
+from .bybit import Bybit
+from .okx import OKX
+from .coinbase import Coinbase
+
+# Connectors by exchange name (ccxt ids, including the old 'okex' one)
+CONNECTORS = {
+    'binance': Binance,
+    'bybit': Bybit,
+    'okx': OKX,
+    'okex': OKX,
+    'coinbase': Coinbase,
+}
+
+
+def get_connector(name, api_url=None):
+    """
+    :param name: exchange name (binance, bybit, okx/okex, coinbase)
+    :param api_url: optional base URL (to use a mirror or a local stand-in)
+    :return: the connector instance or None when the exchange is not supported
+    """
+    connector_class = CONNECTORS.get(name)
+    if connector_class is None:
+        return None
+    return connector_class(api_url)
@@ -0,0 +1,130 @@
+import time
+import asyncio
+import aiohttp
+import numpy as np
+import config
+import ratelimit
+
+# One pooled HTTP session per event loop, shared by every connector.
+# aiohttp sessions can't be used from a different loop than the one that created them.
+_sessions = {}
+
+
+class ConnectorError(Exception):
+    """
+    Raised when an exchange returns an error or an unexpected payload.
+    """
+    pass
+
+
+class DepthSnapshot():
+    """
+    Order book depth returned by the connectors.
+    bids and asks are float64 arrays with shape (n, 2): column 0 is the price
+    and column 1 the size (in base currency). Bids are sorted by price descending
+    and asks ascending, as returned by the exchanges.
+    """
+
+    __slots__ = ('exchange', 'symbol', 'bids', 'asks', 'timestamp')
+
+    def __init__(self, exchange, symbol, bids, asks, timestamp=None):
+        self.exchange = exchange
+        self.symbol = symbol
+        self.bids = bids
+        self.asks = asks
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def __repr__(self):
+        return f"DepthSnapshot({self.exchange}, {self.symbol}, bids={len(self.bids)}, asks={len(self.asks)})"
+
+
+def levels_to_array(levels):
+    """
+    Decode the [price, size, ...] levels of a depth payload into a float64 array.
+    The exchanges send the numbers as strings. NumPy parses them straight into the
+    array buffer, without creating intermediate Python floats or DataFrames.
+    :param levels: list of levels (lists of strings) as decoded from the JSON payload
+    :return: array with shape (n, 2) [price, size]
+    """
+    if not levels:
+        return np.empty((0, 2), dtype=np.float64)
+    array = np.array(levels, dtype=np.float64)
+    if array.shape[1] != 2:
+        # OKX and Coinbase add extra columns (orders count, liquidated orders...)
+        array = np.ascontiguousarray(array[:, :2])
+    return array
+
+
+def get_session():
+    """
+    :return: the pooled aiohttp session of the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=config.connector_pool_size,
+                                         ttl_dns_cache=300,
+                                         keepalive_timeout=60)
+        session = aiohttp.ClientSession(connector=connector,
+                                        timeout=aiohttp.ClientTimeout(total=config.connector_timeout))
+        _sessions[loop] = session
+    return session
+
+
+async def close_sessions():
+    """
+    Close the pooled session of the running event loop. Call it on shutdown.
+    """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None and not session.closed:
+        await session.close()
+
+
+class Connector():
+    """
+    Base class for the direct REST depth connectors.
+    How to use the connectors:
+
+    binance = connectors.get_connector('binance')
+    depth = await binance.fetch_depth('BTC/USDT')
+    depth.bids[:, 0]  # prices
+    depth.bids[:, 1]  # sizes
+    """
+
+    name = ""
+    api_url = ""
+    default_limit = 100
+
+    def __init__(self, api_url=None):
+        if api_url is not None:
+            self.api_url = api_url
+
+    def market_id(self, symbol):
+        """
+        Convert a ccxt-style symbol (BTC/USDT) into the exchange market id.
+        """
+        raise NotImplementedError()
+
+    async def fetch_depth(self, symbol, limit=None):
+        """
+        :param symbol: ccxt-style symbol. Example: BTC/USDT
+        :param limit: number of levels per side (capped by the exchange)
+        :return: DepthSnapshot
+        """
+        raise NotImplementedError()
+
+    async def get_json(self, path, params=None, endpoint='depth', limit=None):
+        """
+        GET a JSON payload once the process-wide rate limit of the exchange allows it.
+        :param endpoint: kind of request for its weight: 'depth' or 'ticker' (see ratelimit.py)
+        :param limit: levels per side of a depth request
+        """
+        await ratelimit.acquire(self.name, endpoint, limit)
+        async with get_session().get(self.api_url + path, params=params) as response:
+            if response.status != 200:
+                raise ConnectorError(f"{self.name} returned HTTP {response.status}: {await response.text()}")
+            return await response.json(content_type=None)
+
+    async def close(self):
+        # The HTTP session is shared by all the connectors, see close_sessions()
+        pass
@@ -0,0 +1,27 @@
+from .base import Connector, ConnectorError, DepthSnapshot, levels_to_array
+
+
+class Binance(Connector):
+    name = "binance"
+    api_url = "https://api.binance.com"
+    default_limit = 1000
+
+    def market_id(self, symbol):
+        return symbol.replace("/", "").upper()  # BTC/USDT -> BTCUSDT
+
+    async def fetch_depth(self, symbol, limit=None):
+        limit = min(limit or self.default_limit, 5000)
+        data = await self.get_json('/api/v3/depth', {'symbol': self.market_id(symbol), 'limit': limit}, limit=limit)
+        if 'bids' not in data:
+            raise ConnectorError(f"binance: {data.get('msg', data)}")
+        return DepthSnapshot(self.name, symbol, levels_to_array(data['bids']), levels_to_array(data['asks']))
+
+    async def fetch_price(self, symbol):
+        """
+        :param symbol: ccxt-style symbol. Example: BTC/USDT
+        :return: last price as float
+        """
+        data = await self.get_json('/api/v3/ticker/price', {'symbol': self.market_id(symbol)}, 'ticker')
+        if 'price' not in data:
+            raise ConnectorError(f"binance: {data.get('msg', data)}")
+        return float(data['price'])
@@ -0,0 +1,22 @@
+from .base import Connector, ConnectorError, DepthSnapshot, levels_to_array
+
+
+class Bybit(Connector):
+    name = "bybit"
+    api_url = "https://api.bybit.com"
+    default_limit = 200
+
+    def market_id(self, symbol):
+        return symbol.replace("/", "").upper()  # BTC/USDT -> BTCUSDT
+
+    async def fetch_depth(self, symbol, limit=None):
+        # Spot order books are limited to 200 levels per side
+        limit = min(limit or self.default_limit, 200)
+        data = await self.get_json('/v5/market/orderbook',
+                                   {'category': 'spot', 'symbol': self.market_id(symbol), 'limit': limit},
+                                   limit=limit)
+        if data.get('retCode') != 0:
+            raise ConnectorError(f"bybit: {data.get('retMsg', data)}")
+        result = data['result']
+        return DepthSnapshot(self.name, symbol, levels_to_array(result['b']), levels_to_array(result['a']),
+                             timestamp=result['ts'] / 1000 if 'ts' in result else None)
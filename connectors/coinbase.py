@@ -0,0 +1,20 @@
+from .base import Connector, ConnectorError, DepthSnapshot, levels_to_array
+
+
+class Coinbase(Connector):
+    name = "coinbase"
+    api_url = "https://api.exchange.coinbase.com"
+    default_limit = 1000
+
+    def market_id(self, symbol):
+        return symbol.replace("/", "-").upper()  # BTC/USDT -> BTC-USDT
+
+    async def fetch_depth(self, symbol, limit=None):
+        # Level 2 returns the full aggregated book, we keep the top levels only
+        limit = limit or self.default_limit
+        data = await self.get_json(f'/products/{self.market_id(symbol)}/book', {'level': 2})
+        if 'bids' not in data:
+            raise ConnectorError(f"coinbase: {data.get('message', data)}")
+        # Levels are [price, size, orders count]
+        return DepthSnapshot(self.name, symbol, levels_to_array(data['bids'][:limit]),
+                             levels_to_array(data['asks'][:limit]))
@@ -0,0 +1,21 @@
+from .base import Connector, ConnectorError, DepthSnapshot, levels_to_array
+
+
+class OKX(Connector):
+    name = "okx"
+    api_url = "https://www.okx.com"
+    default_limit = 400
+
+    def market_id(self, symbol):
+        return symbol.replace("/", "-").upper()  # BTC/USDT -> BTC-USDT
+
+    async def fetch_depth(self, symbol, limit=None):
+        limit = min(limit or self.default_limit, 400)
+        data = await self.get_json('/api/v5/market/books', {'instId': self.market_id(symbol), 'sz': limit},
+                                   limit=limit)
+        if data.get('code') != '0' or not data.get('data'):
+            raise ConnectorError(f"okx: {data.get('msg', data)}")
+        book = data['data'][0]
+        # Levels are [price, size, liquidated orders, orders count]
+        return DepthSnapshot(self.name, symbol, levels_to_array(book['bids']), levels_to_array(book['asks']),
+                             timestamp=int(book['ts']) / 1000 if 'ts' in book else None)
@@ -0,0 +1,141 @@
+"""
+Depth queries over an aggregated order book.
+The levels of each side are kept sorted by distance from the price (bids descending,
+asks ascending) with the prefix sums of their USD and base sizes, so every query is a
+binary search plus a couple of lookups (O(log n)):
+- USD depth within X% of the price
+- average fill price and slippage of a market order of a given USD size
+- bid/ask imbalance per band of distance
+"""
+
+import numpy as np
+from millify import millify
+import utils
+
+
+class DepthBook():
+    """
+    How to use this class:
+
+    book = DepthBook.from_order_book(order_book)  # after AggregatedOrderBook.get_order_book()
+    bid_usd, ask_usd = book.depth_within(1.0)
+    fill = book.market_order('buy', 1_000_000)
+    """
+
+    def __init__(self, price, bid_prices, bid_sizes, ask_prices, ask_sizes):
+        """
+        :param price: reference price (last price of the symbol)
+        :param bid_prices: bid prices sorted descending
+        :param bid_sizes: bid sizes in base currency
+        :param ask_prices: ask prices sorted ascending
+        :param ask_sizes: ask sizes in base currency
+        """
+        self.price = price
+        self.bid_prices = np.asarray(bid_prices, dtype=np.float64)
+        self.ask_prices = np.asarray(ask_prices, dtype=np.float64)
+        # Ascending copy of the bid prices for the binary searches
+        self.negated_bid_prices = -self.bid_prices
+        # Prefix sums with a leading 0: cumulative[i] is the total of the first i levels
+        self.bid_usd = np.concatenate(([0.0], np.cumsum(self.bid_prices * bid_sizes)))
+        self.ask_usd = np.concatenate(([0.0], np.cumsum(self.ask_prices * ask_sizes)))
+        self.bid_base = np.concatenate(([0.0], np.cumsum(bid_sizes)))
+        self.ask_base = np.concatenate(([0.0], np.cumsum(ask_sizes)))
+
+    @classmethod
+    def from_order_book(cls, order_book):
+        """
+        :param order_book: AggregatedOrderBook with the processed bids and asks
+        :return: DepthBook
+        """
+        # Both sides are sorted by price descending in process_order_book
+        bids = order_book.aggregated_bids
+        asks = order_book.aggregated_asks
+        return cls(order_book.current_price,
+                   bids['Price'].values, bids['Size'].values,
+                   asks['Price'].values[::-1], asks['Size'].values[::-1])
+
+    def levels_within(self, pct):
+        """
+        :param pct: distance from the price in %
+        :return: (number of bid levels, number of ask levels) within the distance
+        """
+        bids = np.searchsorted(self.negated_bid_prices, -self.price * (1 - pct / 100), side='right')
+        asks = np.searchsorted(self.ask_prices, self.price * (1 + pct / 100), side='right')
+        return int(bids), int(asks)
+
+    def depth_within(self, pct):
+        """
+        :param pct: distance from the price in %
+        :return: (bid USD, ask USD) within pct % of the price
+        """
+        bids, asks = self.levels_within(pct)
+        return float(self.bid_usd[bids]), float(self.ask_usd[asks])
+
+    def imbalance(self, bands):
+        """
+        :param bands: distances from the price in % (e.g. [0.5, 1, 2])
+        :return: list of (band, bid USD, ask USD, imbalance) where imbalance is
+                 (bids - asks) / (bids + asks), from -1 (only asks) to 1 (only bids)
+        """
+        result = []
+        for band in bands:
+            bids, asks = self.depth_within(band)
+            total = bids + asks
+            result.append((band, bids, asks, (bids - asks) / total if total > 0 else 0.0))
+        return result
+
+    def market_order(self, side, usd):
+        """
+        Walk the book with a market order.
+        :param side: 'buy' (takes the asks) or 'sell' (takes the bids)
+        :param usd: order size in USD
+        :return: dict with the filled USD and base amounts, the average fill price, the worst
+                 price reached and the slippage (%) of the average price from the best price.
+                 filled_usd is lower than usd when the book is not deep enough.
+        """
+        if side == 'buy':
+            prices, cumulative_usd, cumulative_base = self.ask_prices, self.ask_usd, self.ask_base
+        else:
+            prices, cumulative_usd, cumulative_base = self.bid_prices, self.bid_usd, self.bid_base
+        if len(prices) == 0 or usd <= 0:
+            return None
+        filled_usd = min(usd, cumulative_usd[-1])
+        # Number of levels fully taken before the one that completes the order (the last one)
+        last = int(np.searchsorted(cumulative_usd, filled_usd, side='left')) - 1
+        base = cumulative_base[last] + (filled_usd - cumulative_usd[last]) / prices[last]
+        average = filled_usd / base
+        best = prices[0]
+        return {'filled_usd': float(filled_usd),
+                'filled_base': float(base),
+                'average_price': float(average),
+                'worst_price': float(prices[last]),
+                'slippage': float(abs(average - best) / best * 100)}
+
+    def get_formatted_depth(self, symbol, bands, order_sizes):
+        """
+        Depth summary to send to Telegram.
+        :param symbol: Example: BTC/USDT
+        :param bands: distances from the price in %
+        :param order_sizes: market order sizes in USD
+        :return: the message (Markdown)
+        """
+        rows = [['Band', 'Bids', 'Asks', 'Imbalance']]
+        for band, bids, asks, imbalance in self.imbalance(bands):
+            rows.append([f"±{band:g}%", millify(bids, 1), millify(asks, 1), f"{imbalance:+.0%}"])
+        message = f"*{symbol}* depth around {self.price:g}\n" + utils.format_telegram_message(rows)
+
+        rows = [['Order', 'Buy avg', 'Slip.', 'Sell avg', 'Slip.']]
+        for size in order_sizes:
+            row = [millify(size, 1)]
+            for side in ('buy', 'sell'):
+                fill = self.market_order(side, size)
+                if fill is None:
+                    row.extend(['-', '-'])
+                elif fill['filled_usd'] < size:
+                    # Not enough depth in the cached book
+                    row.extend([f"{fill['average_price']:g}", f">{fill['slippage']:.2f}%"])
+                else:
+                    row.extend([f"{fill['average_price']:g}", f"{fill['slippage']:.2f}%"])
+            rows.append(row)
+        message += "\nMarket orders\n" + utils.format_telegram_message(rows)
+        return message
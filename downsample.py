@@ -0,0 +1,43 @@
+"""
+Point downsampling of the cumulative order book curves before plotting.
+A deep book aggregated from several exchanges has thousands of levels per side, far more
+points than the chart has pixel columns, and matplotlib draws (and the PNG encodes) every
+one of them. The side is split in equal price bins and only the first and last level of
+every bin are kept. The cumulative sizes are monotonic, so those are the minimum and the
+maximum of the bin: the envelope of the curve is the same at the resolution of the bins
+(this is the M4 downsampling of time series, reduced to 2 points for monotonic data).
+
+Some levels are always kept exactly, with their neighbours so the jump of the cumulative
+size at a wall is drawn at its real price: the walls annotated on the chart. Both neighbours
+are kept because the jump is on either side of the wall depending on the curve (the bids
+are summed from the current price down, the asks from the highest price down).
+"""
+
+import numpy as np
+
+
+def price_binned(prices, max_points, keep=None):
+    """
+    :param prices: price of every level, sorted (ascending or descending)
+    :param max_points: maximum number of points to keep (approximately when there are
+                       many levels to keep)
+    :param keep: positions of the levels that must be kept
+    :return: positions of the levels to plot, in the original order (int array)
+    """
+    count = len(prices)
+    if max_points is None or count <= max_points:
+        return np.arange(count)
+    keep = np.asarray(keep if keep is not None else [], dtype=np.int64)
+    # The levels around a wall: the cumulative size jumps between it and one of them
+    keep = np.unique(np.concatenate((keep, np.maximum(keep - 1, 0), np.minimum(keep + 1, count - 1))))
+    bins = max(1, (max_points - len(keep)) // 2)
+    prices = np.asarray(prices, dtype=np.float64)
+    low = min(prices[0], prices[-1])
+    span = abs(prices[-1] - prices[0])
+    if span == 0:
+        return np.unique(np.concatenate(([0, count - 1], keep)))
+    index = np.minimum(((prices - low) / span * bins).astype(np.int64), bins - 1)
+    # The prices are sorted, so every bin is a run of consecutive levels
+    starts = np.flatnonzero(np.concatenate(([True], index[1:] != index[:-1])))
+    ends = np.concatenate((starts[1:], [count])) - 1
+    return np.unique(np.concatenate((starts, ends, keep)))
@@ -0,0 +1,211 @@
+"""
+Exchange health for the order book fetches.
+Tracks an exponentially weighted moving average (EWMA) of the latency and of the error rate of every
+exchange, and runs a circuit breaker per exchange: after too many failures the exchange
+is skipped for a cooldown instead of being waited for on every /ob. When the cooldown
+ends a single request goes through (half-open): a success closes the circuit again,
+a failure opens it for another cooldown.
+
+Hedged requests (hedged()): when an exchange hasn't answered after its usual p95 latency,
+the same request is sent again and the first answer wins. The p95 is estimated from the
+moving averages of the latency and of its deviation (latency + 2 * deviation, like a TCP
+retransmission timeout), so only the slowest requests are sent twice.
+
+The state lives in the process (the AggregatedOrderBook instances are short-lived).
+"""
+
+import time
+import asyncio
+import config
+import ratelimit
+import metrics
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+LATENCY = metrics.registry.register(metrics.Gauge(
+    'obbot_exchange_latency_ewma_seconds',
+    'Moving average of the order book request latency by exchange.',
+    ['exchange']))
+
+ERROR_RATE = metrics.registry.register(metrics.Gauge(
+    'obbot_exchange_error_rate',
+    'Moving average of the order book request failures (0-1) by exchange.',
+    ['exchange']))
+
+CIRCUIT_OPEN = metrics.registry.register(metrics.Gauge(
+    'obbot_exchange_circuit_open',
+    '1 while the circuit breaker of the exchange is open or half-open.',
+    ['exchange']))
+
+LATENCY_P95 = metrics.registry.register(metrics.Gauge(
+    'obbot_exchange_latency_p95_seconds',
+    'Estimated p95 of the order book request latency by exchange (the delay of the hedged requests).',
+    ['exchange']))
+
+HEDGES = metrics.registry.register(metrics.Counter(
+    'obbot_exchange_hedges_total',
+    'Hedged order book requests by exchange and request answering first (first/hedge).',
+    ['exchange', 'winner']))
+
+MISSING = metrics.registry.register(metrics.Counter(
+    'obbot_exchange_missing_total',
+    'Order books returned without an exchange by reason (circuit_open, timeout, rate_limited, error).',
+    ['exchange', 'reason']))
+
+
+class ExchangeHealth():
+    """
+    How to use this class:
+
+    health = get_health('binance')
+    if health.allow_request():
+        ...
+        health.record(latency, success)
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latency = None
+        self.deviation = 0.0
+        self.error_rate = 0.0
+        self.requests = 0
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow_request(self):
+        """
+        :return: True if the exchange can be queried now
+        """
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and time.monotonic() - self.opened_at >= config.circuit_cooldown:
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN and not self.probing:
+            # Only one request tests the exchange
+            self.probing = True
+            return True
+        return False
+
+    def record(self, latency, success):
+        """
+        Update the averages and the circuit with the result of a request.
+        :param latency: seconds the request took (or the time we waited before giving up)
+        :param success: False for errors and timeouts
+        """
+        alpha = config.exchange_ewma_alpha
+        if self.latency is not None:
+            self.deviation = alpha * abs(latency - self.latency) + (1 - alpha) * self.deviation
+        self.latency = latency if self.latency is None else alpha * latency + (1 - alpha) * self.latency
+        self.error_rate = alpha * (0.0 if success else 1.0) + (1 - alpha) * self.error_rate
+        self.requests += 1
+        if success:
+            self.consecutive_failures = 0
+            self.state = CLOSED
+        else:
+            self.consecutive_failures += 1
+            if (self.state == HALF_OPEN or
+                    self.consecutive_failures >= config.circuit_failure_threshold or
+                    (self.requests >= config.circuit_min_requests and
+                     self.error_rate >= config.circuit_error_rate)):
+                if self.state != OPEN:
+                    print(f"Circuit open for {self.name}: skipping it for {config.circuit_cooldown} seconds")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+        self.probing = False
+
+        LATENCY.set(self.latency, exchange=self.name)
+        LATENCY_P95.set(self.latency_p95(), exchange=self.name)
+        ERROR_RATE.set(self.error_rate, exchange=self.name)
+        CIRCUIT_OPEN.set(0 if self.state == CLOSED else 1, exchange=self.name)
+
+    def latency_p95(self):
+        """
+        :return: estimated p95 of the latency in seconds (None before the first request)
+        """
+        if self.latency is None:
+            return None
+        return self.latency + 2 * self.deviation
+
+    def hedge_delay(self):
+        """
+        :return: seconds to wait for an answer before sending the request again, or None when
+                 the request isn't hedged (disabled, too few requests to know the latency, or
+                 the circuit isn't closed: a half-open circuit is tested by a single request)
+        """
+        if not config.hedge_enabled or self.state != CLOSED or self.requests < config.hedge_min_requests:
+            return None
+        return max(config.hedge_min_delay, self.latency_p95())
+
+    def skip(self):
+        """
+        The request was given up before reaching the exchange (e.g. while waiting for our own
+        rate limit): nothing is recorded, a half-open circuit lets the next request test it.
+        """
+        self.probing = False
+
+
+_health = {}
+
+
+def get_health(name):
+    """
+    :param name: exchange name
+    :return: the ExchangeHealth of the exchange (created on first use)
+    """
+    if name not in _health:
+        _health[name] = ExchangeHealth(name)
+    return _health[name]
+
+
+async def hedged(fetch, name, waits=None):
+    """
+    Call fetch(name) and, when the exchange hasn't answered after its hedge delay
+    (ExchangeHealth.hedge_delay), call it again: the first successful answer is returned
+    and the other request is cancelled. The delay counts from the time the first request
+    was sent, not from the time it started waiting for our rate limit.
+    :param fetch: coroutine function receiving the exchange name
+    :param name: exchange name
+    :param waits: ratelimit.WaitTracker of the caller, shared by the first request (the
+                  second one has its own)
+    :return: the result of fetch(name)
+    """
+    delay = get_health(name).hedge_delay()
+    if delay is None:
+        return await fetch(name)
+
+    async def hedge():
+        # Its rate limit wait isn't the one of the first request
+        with ratelimit.track_waits():
+            return await fetch(name)
+
+    start_time = time.monotonic()
+    tasks = [asyncio.create_task(fetch(name))]
+    try:
+        timeout = delay
+        while timeout > 0:
+            done, _ = await asyncio.wait(tasks, timeout=timeout)
+            if done:
+                return tasks[0].result()
+            if waits is None:
+                break
+            # Time since the request was sent (waits.waited is updated when a wait ends)
+            timeout = delay if waits.waiting else delay - (time.monotonic() - start_time - waits.waited)
+        tasks.append(asyncio.create_task(hedge()))
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    HEDGES.inc(exchange=name, winner='first' if task is tasks[0] else 'hedge')
+                    return task.result()
+        # Both failed: the error of the first request
+        return tasks[0].result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
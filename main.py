@@ -1,18 +1,32 @@
+import sys
+import time
+import asyncio
 from millify import millify
 from telegram import Update, error
 import telegram.ext.filters
-from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes
 import config
-import trendcore
+import metrics
+import tracing
 import utils
+import prewarm
 from UserDatabase import UserDatabase
-from AggregatedOrderBook import AggregatedOrderBook
+# trendcore, AggregatedOrderBook and charts pull in ccxt, pandas, bs4 and matplotlib.
+# They are imported in the handlers that need them (and warmed up in the background
+# once the bot is running, see warm_up) so /start and /help are answered right away.
 
 
+# Exchanges aggregated by /ob and /depth
+ORDER_BOOK_EXCHANGES = ['binance', 'okx', 'bybit']
+# /ob modes: chart image or text-only depth ladder (no matplotlib)
+OB_MODES = ['chart', 'text']
+
 # Initiate the Database where we're going to persist user's settings
 db = UserDatabase(config.user_data)
 
 
+@metrics.instrument_handler('start')
+@tracing.trace_update('start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Return the welcome message
@@ -32,6 +46,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         print(f"Telegram Error occurred: {e.message}")
 
 
+@metrics.instrument_handler('wallsize')
+@tracing.trace_update('wallsize')
 async def wallsize(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Command to update the minimum wall size for each user
@@ -71,6 +87,8 @@ async def wallsize(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                                         "Example: */wallsize 100k*", parse_mode="Markdown")
 
 
+@metrics.instrument_handler('distance')
+@tracing.trace_update('distance')
 async def distance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Command to update the distance from current price to wall price
@@ -106,6 +124,39 @@ async def distance(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                                         "Example: */distance 5*", parse_mode="Markdown")
 
 
+@metrics.instrument_handler('obmode')
+@tracing.trace_update('obmode')
+async def obmode(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Command to choose how /ob answers: chart (image) or text (depth ladder)
+    :param update:
+    :param context:
+    :return:
+    """
+    try:
+        user = update.message.from_user
+        db_user = db.get_user(user.id)
+        if db_user is None:
+            db.insert_user(user)
+            db_user = db.get_user(user.id)
+        if len(update.message.text.split()) == 1:
+            await update.message.reply_text(f"The current /ob mode is {db_user['ob_mode']}.\nTo update it"
+                                            " please type */obmode [chart|text]*.\nExample: */obmode text*",
+                                            parse_mode="Markdown")
+            return
+        ob_mode = update.message.text.split()[1].lower()
+        if ob_mode not in OB_MODES:
+            await update.message.reply_text("Usage: */obmode [chart|text]*\nExample: */obmode text*",
+                                            parse_mode="Markdown")
+            return
+        db.update_ob_mode(user, ob_mode)
+        await update.message.reply_text(f"/ob mode updated successfully.\nYou will receive the order books as {ob_mode}.")
+    except error.TelegramError as e:
+        print(f"Telegram Error occurred: {e.message}")
+
+
+@metrics.instrument_handler('help')
+@tracing.trace_update('help')
 async def help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
         await update.message.reply_text('Welcome to the TrendCore OrderBook Bot, a handy tool for accessing cryptocurrency '
@@ -126,7 +177,8 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                                         '- An estimated time (in minutes) it may take for the price '
                                         'to erode (go through) the wall.\n\n'
                                         'Feel free to use /tc anytime to get the most recent order wall '
-                                        'information.\n', parse_mode="Markdown")
+                                        'information, or /scan for the same table built from our own scan '
+                                        'of the exchanges.\n', parse_mode="Markdown")
         await update.message.reply_text('*Configuration Commands*:\n\n'
                                         '1. *Minimum Wall Size*:\n'
                                         'Command: /wallsize [amount]\n'
@@ -149,15 +201,26 @@ async def help(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                                         'data from Binance, OKX and Bybit spot markets for any specific symbol.\n'
                                         'Usage Examples:\n'
                                         '- /ob BTC: Retrieves the Bitcoin Order Book.\n'
-                                        '- /ob ETH: Retrieves the Bitcoin Order Book.\n\n'
+                                        '- /ob ETH: Retrieves the Bitcoin Order Book.\n'
+                                        '- /ob ETH text: Text-only depth ladder and walls instead of the chart.\n\n'
+                                        'Command: /obmode [chart|text]\n'
+                                        'Description: Choose the default answer of /ob (chart image or text).\n\n'
+                                        'Command: /depth [symbol] [order size]\n'
+                                        'Description: Text summary of the same order book: depth and bid/ask '
+                                        'imbalance around the price and the slippage of market orders.\n'
+                                        'Usage Example:\n'
+                                        '- /depth ETH 500k: Depth of Ethereum and slippage of a 500K USD order.\n\n'
                                         'The order book information is cached for 1 minute. After that time'
-                                        ' we pull new information from exchanges to avoid overloading.\n\n'
+                                        ' we pull new information from exchanges to avoid overloading '
+                                        '(the most requested symbols are refreshed in the background).\n\n'
                                         'Happy trading!'
                                         , parse_mode="Markdown")
     except error.TelegramError as e:
         print(f"Telegram Error occurred: {e.message}")
 
 
+@metrics.instrument_handler('tc')
+@tracing.trace_update('tc')
 async def data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """
     Retrieves the data from Trendcore website, process it and returns
@@ -181,19 +244,44 @@ async def data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         # await context.bot.send_chat_action(chat_id=update.effective_message.chat_id,
         #                              action=telegram.constants.ChatAction.TYPING)
 
-        tc_webscrapper = trendcore.TrendCore()
+        import trendcore
+        tc_webscrapper = await trendcore.TrendCore.load()
         formatted_data = tc_webscrapper.get_formatted_data(wallsize, distance)
-        await update.message.reply_text(formatted_data, parse_mode="Markdown")
+        with tracing.span('reply'):
+            await update.message.reply_text(formatted_data, parse_mode="Markdown")
     except error.TelegramError as e:
         print(f"Telegram Error occurred: {e.message}")
 
 
+def get_symbol(text):
+    """
+    :param text: the command typed by the user. Example: /ob DOGE
+    :return: the symbol of the order book. Example: DOGE/USDT (BTC/USDT by default)
+    """
+    if len(text.split()) == 1:
+        # I would assume to use BTC without any other param
+        return "BTC/USDT"
+    symbol = text.split()[1].upper()  # Example: BTC or DOGE or ADA
+    symbol = symbol.replace("USDT", "").replace("USD","")  # Strip the Quote just in case
+    return symbol + "/" + "USDT" # Add /USDT to the end
+
+
+def get_ob_mode(text, default):
+    """
+    :param text: the command typed by the user. Example: /ob ETH text
+    :param default: the mode configured by the user
+    :return: (the command without the mode, the mode). Example: ("/ob ETH", "text")
+    """
+    words = text.split()
+    if len(words) > 1 and words[-1].lower() in OB_MODES:
+        return " ".join(words[:-1]), words[-1].lower()
+    return text, default
+
+
+@metrics.instrument_handler('ob')
+@tracing.trace_update('ob')
 async def orderbook(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     try:
-        # Send "typing" action while we retrieve the OB data
-        await context.bot.send_chat_action(chat_id=update.effective_message.chat_id,
-                                           action=telegram.constants.ChatAction.TYPING)
-
         user = update.message.from_user
         db_user = db.get_user(user.id)
         if db_user is None:
@@ -201,19 +289,35 @@ async def orderbook(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
             db_user = db.get_user(user.id)
         # Get the wallsize configured for this user
         wallsize = float(db_user['wallsize'])
-        if len(update.message.text.split()) == 1:
-            # I would assume to use BTC without any other param
-            symbol = "BTC/USDT"
-        else:
-            symbol = update.message.text.split()[1].upper()  # Example: BTC or DOGE or ADA
-            symbol = symbol.replace("USDT", "").replace("USD","")  # Strip the Quote just in case
-            symbol += "/" + "USDT" # Add /USDT to the end
+        text, ob_mode = get_ob_mode(update.message.text, db_user['ob_mode'])
+        symbol = get_symbol(text)
+
+        from AggregatedOrderBook import AggregatedOrderBook
+        if ob_mode == 'text':
+            # Fast path: no chart, no upload
+            prewarm.record(symbol)
+            order_book = AggregatedOrderBook(ORDER_BOOK_EXCHANGES, {}, symbol)
+            try:
+                status = await order_book.get_order_book(wallsize, float(db_user['distance']))
+            finally:
+                await order_book.close()
+            if not status:
+                await update.message.reply_text(f"Couldn't retrieve the order book for {symbol}.")
+                return
+            with tracing.span('reply'):
+                await update.message.reply_text(order_book.get_formatted_ladder() + "\n" + order_book.get_caption(),
+                                                parse_mode="Markdown")
+            return
+
+        # Send "typing" action while we retrieve the OB data
+        await context.bot.send_chat_action(chat_id=update.effective_message.chat_id,
+                                           action=telegram.constants.ChatAction.TYPING)
+        prewarm.record(symbol, wallsize, float(db_user['distance']))
 
         # Retrieve the OB data
-        exchanges = ['binance', 'okex', 'bybit']
-        order_book = AggregatedOrderBook(exchanges, {}, symbol)
+        order_book = AggregatedOrderBook(ORDER_BOOK_EXCHANGES, {}, symbol)
         try:
-            status = await order_book.get_order_book()
+            status = await order_book.get_order_book(wallsize, float(db_user['distance']))
             if not status:
                 await update.message.reply_text(f"Couldn't retrieve the order book for {symbol}.")
             await order_book.generate_chart()
@@ -227,7 +331,8 @@ async def orderbook(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         # Send to the user
         caption = order_book.get_caption()
         if order_book.order_book_image != "":
-            await update.message.reply_photo(order_book.order_book_image, caption)
+            with metrics.stage('telegram_upload'):
+                await update.message.reply_photo(order_book.order_book_image, caption)
 
     except error.TelegramError as e:
         print(f"Telegram Error occurred: {e.message}")
@@ -236,20 +341,200 @@ async def orderbook(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
                                         parse_mode="Markdown")
 
 
-app = ApplicationBuilder().token(config.telegram_token).build()
-# Start commands & help
-app.add_handler(CommandHandler("start", start))
-app.add_handler(CommandHandler("help", help))
-# Data commands
-app.add_handler(CommandHandler("tc", data))
-app.add_handler(CommandHandler("data", data))  # For compatibility in prev. versions
-# Order Book
-app.add_handler(CommandHandler("ob", orderbook))
-# Configuration
-app.add_handler(CommandHandler("wallsize", wallsize))
-app.add_handler(CommandHandler("distance", distance))
-# Start listening
-try:
-    app.run_polling()
-except error.TelegramError as e:
-    print(f"Telegram Error occurred: {e.message}")
+@metrics.instrument_handler('depth')
+@tracing.trace_update('depth')
+async def depth(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Text-only depth summary of the aggregated order book: USD depth and bid/ask imbalance
+    per band and the slippage of market orders. It reuses the cached order book and
+    doesn't render any chart.
+    Usage: /depth [symbol] [order size]. Example: /depth ETH 500k
+    """
+    try:
+        symbol = get_symbol(update.message.text)
+        order_sizes = list(config.depth_order_sizes)
+        if len(update.message.text.split()) > 2:
+            order_sizes = [float(utils.convert_units(update.message.text.split()[2].upper()))]
+        prewarm.record(symbol)
+
+        from AggregatedOrderBook import AggregatedOrderBook
+        import depth as depth_queries
+        order_book = AggregatedOrderBook(ORDER_BOOK_EXCHANGES, {}, symbol)
+        try:
+            # The depth doesn't use the walls
+            status = await order_book.get_order_book(detect_walls=False)
+        finally:
+            await order_book.close()
+        if not status:
+            await update.message.reply_text(f"Couldn't retrieve the order book for {symbol}.")
+            return
+
+        book = depth_queries.DepthBook.from_order_book(order_book)
+        message = book.get_formatted_depth(symbol, config.depth_bands, order_sizes)
+        if len(order_book.missing_exchanges) > 0:
+            message += f"\nMissing: {', '.join(order_book.missing_exchanges)}"
+        with tracing.span('reply'):
+            await update.message.reply_text(message, parse_mode="Markdown")
+
+    except error.TelegramError as e:
+        print(f"Telegram Error occurred: {e.message}")
+    except Exception as e:
+        await update.message.reply_text(f"Error retrieving the depth: {e}.\nPlease try again later.")
+
+
+@metrics.instrument_handler('scan')
+@tracing.trace_update('scan')
+async def scan(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Same table as /tc built from the last market scan (see scanner.py) instead of TrendCore,
+    filtered with the user's wall size and distance.
+    :param update:
+    :param context:
+    :return:
+    """
+    try:
+        user = update.message.from_user
+        db_user = db.get_user(user.id)
+        if db_user is None:
+            db.insert_user(user)
+            db_user = db.get_user(user.id)
+
+        import trendcore
+        import scanner
+        last_scan = scanner.read_walls()
+        if last_scan is None:
+            await update.message.reply_text("The market scanner hasn't run yet. Please try again later.")
+            return
+        updated_at, dataframe = last_scan
+        formatted_data = trendcore.TrendCore(dataframe, updated_at).get_formatted_data(float(db_user['wallsize']),
+                                                                                     float(db_user['distance']))
+        formatted_data += f"\nScanned {int(time.time() - updated_at)} seconds ago"
+        with tracing.span('reply'):
+            await update.message.reply_text(formatted_data, parse_mode="Markdown")
+    except error.TelegramError as e:
+        print(f"Telegram Error occurred: {e.message}")
+
+
+def import_heavy_modules():
+    """
+    Import the modules used by /tc and /ob (ccxt, pandas, bs4, matplotlib for the charts).
+    """
+    start_time = time.perf_counter()
+    import trendcore
+    import AggregatedOrderBook
+    if config.chart_mode == 'template':
+        import charts
+    print(f"Heavy modules loaded in {time.perf_counter() - start_time:.2f} seconds")
+
+
+async def warm_up(application: Application) -> None:
+    """
+    Load the heavy modules in a background thread once the bot is up, so the
+    first /tc or /ob doesn't pay the import time.
+    :param application:
+    :return:
+    """
+    async def background_import():
+        # Give the updater some time to start polling before competing for the GIL
+        await asyncio.sleep(config.warmup_delay)
+        await asyncio.to_thread(import_heavy_modules)
+
+    if config.warmup_delay is not None:
+        # Keep a reference to the task, otherwise it could be garbage collected before it's done
+        application.bot_data['warmup_task'] = asyncio.create_task(background_import())
+
+
+async def shutdown(application: Application) -> None:
+    """
+    Release the pooled HTTP connections of the REST connectors (if they were used).
+    :param application:
+    :return:
+    """
+    for task in ('recorder_task', 'prewarm_task', 'scanner_task'):
+        if task in application.bot_data:
+            application.bot_data[task].cancel()
+    if 'connectors' in sys.modules:
+        await sys.modules['connectors'].close_sessions()
+
+
+async def start_recorder(application: Application) -> None:
+    """
+    Run the order book recorder inside the bot process (see recorder.py).
+    :param application:
+    :return:
+    """
+    import recorder
+    application.bot_data['recorder_task'] = asyncio.create_task(recorder.OrderBookRecorder().run())
+
+
+async def start_prewarmer(application: Application) -> None:
+    """
+    Keep the order books and charts of the most requested symbols fresh (see prewarm.py).
+    :param application:
+    :return:
+    """
+    application.bot_data['prewarm_task'] = asyncio.create_task(prewarm.Prewarmer(ORDER_BOOK_EXCHANGES).run())
+
+
+async def start_scanner(application: Application) -> None:
+    """
+    Run the market scanner inside the bot process (see scanner.py).
+    :param application:
+    :return:
+    """
+    import scanner
+    application.bot_data['scanner_task'] = asyncio.create_task(scanner.MarketScanner().run())
+
+
+async def on_startup(application: Application) -> None:
+    await warm_up(application)
+    if config.recorder_enabled:
+        await start_recorder(application)
+    if config.prewarm_enabled:
+        await start_prewarmer(application)
+    if config.scanner_enabled:
+        await start_scanner(application)
+
+
+def build_application() -> Application:
+    app = ApplicationBuilder().token(config.telegram_token).post_init(on_startup).post_shutdown(shutdown).build()
+    # Start commands & help
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("help", help))
+    # Data commands
+    app.add_handler(CommandHandler("tc", data))
+    app.add_handler(CommandHandler("data", data))  # For compatibility in prev. versions
+    app.add_handler(CommandHandler("scan", scan))
+    # Order Book
+    app.add_handler(CommandHandler("ob", orderbook))
+    app.add_handler(CommandHandler("obmode", obmode))
+    app.add_handler(CommandHandler("depth", depth))
+    # Configuration
+    app.add_handler(CommandHandler("wallsize", wallsize))
+    app.add_handler(CommandHandler("distance", distance))
+    return app
+
+
+def main():
+    # Expose the per-stage metrics in Prometheus format (local only by default)
+    if config.metrics_enabled:
+        try:
+            metrics.start_server(config.metrics_host, config.metrics_port)
+        except OSError as e:
+            # e.g. another instance on the same host already serves its metrics on this port
+            print(f"Metrics server not started on {config.metrics_host}:{config.metrics_port}: {e}")
+
+    app = build_application()
+    # Start listening
+    try:
+        if config.ingestion_mode == 'webhook':
+            import webhook
+            webhook.run(app)
+        else:
+            app.run_polling()
+    except error.TelegramError as e:
+        print(f"Telegram Error occurred: {e.message}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+import time
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import tracing
+
+
+# Latency buckets in seconds. They cover everything from a cached snapshot read
+# to a slow exchange hitting ccxt's timeout.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Counter():
+    """
+    Monotonic counter with optional labels.
+    How to use this class:
+
+    cache_requests = Counter('cache_requests_total', 'Cache lookups', ['cache', 'result'])
+    cache_requests.inc(cache='trendcore_snapshot', result='hit')
+    """
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in values]
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down (queue sizes, budgets in use...).
+    """
+
+    type_name = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram():
+    """
+    Cumulative histogram with optional labels, compatible with the Prometheus
+    text format (_bucket, _sum and _count series).
+    """
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # [per-bucket counts (+Inf last), sum, count]
+                entry = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._values[key] = entry
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def collect(self):
+        with self._lock:
+            values = sorted((key, (list(entry[0]), entry[1], entry[2])) for key, entry in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.label_names, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry():
+    """
+    Keeps every metric of the process and renders them in the
+    Prometheus text exposition format.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def expose(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Time spent in each stage of a request. 'exchange' is empty for the stages
+# that don't talk to a specific venue (find_walls, render_chart...).
+STAGE_SECONDS = registry.register(Histogram(
+    'obbot_stage_duration_seconds',
+    'Time spent in each processing stage.',
+    ['stage', 'exchange']))
+
+# Cache lookups for the files cached in config.data_path
+CACHE_REQUESTS = registry.register(Counter(
+    'obbot_cache_requests_total',
+    'Cache lookups by cache and result (hit/miss).',
+    ['cache', 'result']))
+
+HANDLER_SECONDS = registry.register(Histogram(
+    'obbot_handler_duration_seconds',
+    'Telegram command handler latency.',
+    ['command']))
+
+HANDLER_ERRORS = registry.register(Counter(
+    'obbot_handler_errors_total',
+    'Unhandled exceptions raised by Telegram command handlers.',
+    ['command']))
+
+
+@contextmanager
+def stage(name, exchange=""):
+    """
+    Context manager measuring the time spent in a stage.
+    The stage is also recorded as a span when the update is being traced.
+    Example:
+        with metrics.stage('fetch_order_book', exchange='binance'):
+            await exchange.fetch_order_book(symbol)
+    :param name: stage name (load_markets, fetch_order_book, ticker, find_walls, render_chart...)
+    :param exchange: exchange name when the stage talks to a specific venue
+    """
+    attrs = {'exchange': exchange} if exchange else {}
+    with tracing.span(name, **attrs):
+        with STAGE_SECONDS.time(stage=name, exchange=exchange):
+            yield
+
+
+def cache_lookup(cache, hit):
+    """
+    Count a cache hit or miss.
+    :param cache: cache name (trendcore_memory, trendcore_snapshot, order_book_memory,
+                  order_book_snapshot, chart_memory, chart)
+    :param hit: True when the cached version was used
+    """
+    CACHE_REQUESTS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+def instrument_handler(command):
+    """
+    Decorator measuring the latency of a Telegram command handler.
+    :param command: the command name used as label (tc, ob, wallsize...)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(update, context):
+            start = time.perf_counter()
+            try:
+                return await func(update, context)
+            except Exception:
+                HANDLER_ERRORS.inc(command=command)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - start, command=command)
+        return wrapper
+    return decorator
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would flood the console
+        pass
+
+
+def start_server(host='127.0.0.1', port=9108):
+    """
+    Serve the metrics in a background (daemon) thread.
+    :param host: interface to bind. Keep it local unless you know what you're doing.
+    :param port: TCP port
+    :return: the running HTTP server (call shutdown() to stop it)
+    """
+    server = ThreadingHTTPServer((host, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True)
+    thread.start()
+    print(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
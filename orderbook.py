@@ -10,7 +10,7 @@ from okex_orderbook import OKEx
 from binance_orderbook import Binance
 import matplotlib.pyplot as plt
 import matplotlib.ticker as ticker
-from scipy.signal import find_peaks
+import walls
 
 class OrderBook():
     """
@@ -88,12 +88,13 @@ class OrderBook():
         # Separate buy and sell data
         bids = orderbook[(orderbook['Side'] == 'buy')]
         asks = orderbook[(orderbook['Side'] == 'sell')]
-        # Find peaks (buy walls) based on size value in USD
-        bids_peaks, _ = find_peaks(bids['SizeUSD'].values, prominence=self.wallsize)
+        # Find peaks (buy walls) based on size value in USD (same as scipy's find_peaks with prominence)
+        detector = walls.ProminenceDetector(self.wallsize)
+        bids_peaks = detector.detect(bids['Price'].values, bids['SizeUSD'].values, None, current_price)
         # Sort the buy peaks by size in descending order
         sorted_bids_peaks = bids.iloc[bids_peaks].sort_values('SizeUSD', ascending=False)
         # Find peaks (sell walls) based on size value in USD
-        asks_peaks, _ = find_peaks(asks['SizeUSD'].values, prominence=self.wallsize)
+        asks_peaks = detector.detect(asks['Price'].values, asks['SizeUSD'].values, None, current_price)
         # Sort the sell peaks by size in descending order
         sorted_asks_peaks = asks.iloc[asks_peaks].sort_values('SizeUSD', ascending=False)
 
@@ -0,0 +1,192 @@
+"""
+Background pre-warming of the popular order books.
+Every /ob and /depth adds to the popularity of its symbol, a counter that decays
+exponentially (it halves every prewarm_half_life seconds), so the ranking follows what
+the users are asking for right now. The prewarmer refreshes the order books of the top
+symbols a little before their cache expires (1 minute by default) and renders their charts with the most
+used wall settings, so those requests are served straight from the cache.
+
+The refreshes are limited to prewarm_budget per minute (the exchanges rate-limit us);
+the most popular symbols go first.
+"""
+
+import time
+import asyncio
+from collections import deque
+import config
+import metrics
+import ratelimit
+
+REFRESHES = metrics.registry.register(metrics.Counter(
+    'obbot_prewarm_refreshes_total',
+    'Order book refreshes of the prewarmer by result (ok, failed, budget = skipped for lack of budget).',
+    ['result']))
+
+HOT_SYMBOLS = metrics.registry.register(metrics.Gauge(
+    'obbot_prewarm_hot_symbols',
+    'Number of symbols kept warm by the prewarmer.'))
+
+
+class Popularity():
+    """
+    Request counters with exponential decay.
+    How to use this class:
+
+    popularity = Popularity(half_life=900)
+    popularity.add('BTC/USDT')
+    popularity.top(5, min_score=3)  # ['BTC/USDT', ...]
+    """
+
+    def __init__(self, half_life=None):
+        """
+        :param half_life: seconds after which a request counts half (config.prewarm_half_life)
+        """
+        self.half_life = half_life or config.prewarm_half_life
+        # {key: (score, time of the score)}
+        self.scores = {}
+
+    def decayed(self, key, now):
+        score, updated = self.scores.get(key, (0.0, now))
+        return score * 0.5 ** ((now - updated) / self.half_life)
+
+    def add(self, key, now=None):
+        now = now or time.time()
+        self.scores[key] = (self.decayed(key, now) + 1, now)
+
+    def score(self, key, now=None):
+        return self.decayed(key, now or time.time())
+
+    def top(self, n, min_score=0.0, now=None):
+        """
+        :return: the n keys with the highest score (at least min_score), highest first
+        """
+        now = now or time.time()
+        scores = [(self.decayed(key, now), key) for key in self.scores]
+        return [key for score, key in sorted(scores, reverse=True)[:n] if score >= min_score]
+
+    def prune(self, min_score=0.01, now=None):
+        """
+        Forget the keys nobody asked for in a long time.
+        """
+        now = now or time.time()
+        for key in [key for key in self.scores if self.decayed(key, now) < min_score]:
+            del self.scores[key]
+
+
+symbols = Popularity()
+# {symbol: Popularity of the (wallsize, distance) settings used with it}
+settings = {}
+
+
+def record(symbol, wallsize=None, distance=None):
+    """
+    Count a request of the order book of a symbol.
+    :param symbol: Example: BTC/USDT
+    :param wallsize: wall size of the user (None when the request doesn't render a chart)
+    :param distance: maximum distance of the user
+    """
+    now = time.time()
+    symbols.add(symbol, now)
+    if wallsize is not None:
+        if symbol not in settings:
+            settings[symbol] = Popularity()
+        settings[symbol].add((wallsize, distance), now)
+
+
+def order_book_ttl():
+    """
+    :return: seconds an order book is served from the cache: the shared cache TTL or
+             config.order_book_max_age (see artifact_cache.py)
+    """
+    if config.shared_cache:
+        return config.shared_cache_ttl
+    return config.order_book_max_age
+
+
+class Prewarmer():
+    """
+    Keeps the order books and charts of the most requested symbols fresh.
+    How to use this class:
+
+    task = asyncio.create_task(Prewarmer(['binance', 'okx', 'bybit']).run())
+    """
+
+    def __init__(self, exchanges, top_n=None, budget=None, lead=None, interval=None):
+        """
+        :param exchanges: exchanges aggregated by /ob
+        :param top_n: number of symbols kept warm (config.prewarm_top_n)
+        :param budget: maximum refreshes per minute (config.prewarm_budget)
+        :param lead: seconds before the cache expiry to refresh a symbol (config.prewarm_lead)
+        :param interval: seconds between checks (config.prewarm_interval)
+        """
+        self.exchanges = exchanges
+        self.top_n = top_n or config.prewarm_top_n
+        self.budget = budget or config.prewarm_budget
+        self.max_age = max(0, order_book_ttl() - (lead or config.prewarm_lead))
+        self.interval = interval or config.prewarm_interval
+        # Times of the refreshes of the last minute
+        self.refreshes = deque()
+        # {symbol: time of the order book data after the last refresh}
+        self.refreshed_at = {}
+
+    def has_budget(self):
+        now = time.monotonic()
+        while self.refreshes and now - self.refreshes[0] > 60:
+            self.refreshes.popleft()
+        return len(self.refreshes) < self.budget
+
+    async def refresh(self, symbol):
+        """
+        Refresh the order book of the symbol if it's about to expire, and render the charts
+        of its most used settings.
+        :return: True if the order book could be retrieved
+        """
+        from AggregatedOrderBook import AggregatedOrderBook
+        top_settings = settings[symbol].top(config.prewarm_charts_per_symbol) if symbol in settings else []
+        order_book = AggregatedOrderBook(self.exchanges, {}, symbol)
+        try:
+            # The requests of the users go first (see ratelimit.py)
+            with ratelimit.priority_scope(ratelimit.BACKGROUND):
+                # The order book is refreshed by the first call, the others process the fresh snapshot
+                for wallsize, distance in top_settings or [(100000, None)]:
+                    status = await order_book.get_order_book(wallsize, distance, self.max_age)
+                    if order_book.refreshed:
+                        self.refreshes.append(time.monotonic())
+                    if not status:
+                        return False
+                    if top_settings:
+                        await order_book.generate_chart()
+            self.refreshed_at[symbol] = order_book.data_time() or time.time()
+            return True
+        finally:
+            await order_book.close()
+
+    async def tick(self):
+        hot = symbols.top(self.top_n, config.prewarm_min_score)
+        HOT_SYMBOLS.set(len(hot))
+        for symbol in hot:
+            if time.time() - self.refreshed_at.get(symbol, 0) < self.max_age:
+                continue
+            if not self.has_budget():
+                REFRESHES.inc(result='budget')
+                continue
+            # Failed symbols are retried when the cache would have expired
+            self.refreshed_at[symbol] = time.time()
+            try:
+                status = await self.refresh(symbol)
+            except Exception as e:
+                print(f"Prewarm: error refreshing {symbol}: {e}")
+                status = False
+            REFRESHES.inc(result='ok' if status else 'failed')
+        symbols.prune()
+        for symbol in list(settings):
+            settings[symbol].prune()
+            if len(settings[symbol].scores) == 0:
+                del settings[symbol]
+
+    async def run(self):
+        print(f"Prewarming the top {self.top_n} symbols ({self.budget} refreshes per minute)")
+        while True:
+            start_time = time.monotonic()
+            await self.tick()
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - start_time)))
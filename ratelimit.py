@@ -0,0 +1,340 @@
+"""
+Process-wide rate limiting of the exchange API calls.
+The exchanges limit the requests per IP address, but ccxt's enableRateLimit only spaces the
+calls of one client instance and /ob creates new instances for every request. Every depth,
+markets and ticker call of the process (ccxt clients and REST connectors, from /ob, /depth,
+the prewarmer, the scanner and the recorder) waits here for its weight first.
+
+Every exchange has a weighted token bucket: it refills at rate_limit_headroom of the limit
+of the exchange (config.rate_limits) and holds at most rate_limit_burst of it, so with
+headroom + burst <= 1 no window of the exchange counts more than its limit. The weights
+follow the exchange documentation (a 1000-level Binance depth costs 50, a ticker 2).
+
+The requests waiting for tokens are served by priority, then in arrival order:
+INTERACTIVE (user commands, the default), BACKGROUND (prewarmer) and BULK (scanner,
+recorder). The lower priorities also leave rate_limit_reserve of the bucket untouched, so a
+user request rarely waits for the bucket to refill behind a busy scanner.
+The priority is set for a block of code (and the tasks it creates) with:
+
+    with ratelimit.priority_scope(ratelimit.BULK):
+        await scanner.scan()
+
+The time a task spends waiting here isn't the latency of the exchange: track_waits() tells
+the callers timing the requests (health.py) how long it was and if the task is waiting now.
+"""
+
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+import config
+import metrics
+
+INTERACTIVE = 0
+BACKGROUND = 1
+BULK = 2
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', BACKGROUND: 'background', BULK: 'bulk'}
+
+WEIGHT = metrics.registry.register(metrics.Counter(
+    'obbot_ratelimit_weight_total',
+    'Request weight spent by exchange and priority.',
+    ['exchange', 'priority']))
+
+WAIT = metrics.registry.register(metrics.Histogram(
+    'obbot_ratelimit_wait_seconds',
+    'Time the requests waited for the rate limit by exchange and priority.',
+    ['exchange', 'priority']))
+
+UTILIZATION = metrics.registry.register(metrics.Gauge(
+    'obbot_ratelimit_utilization',
+    'Weight spent in the last window of the exchange over its limit (0-1).',
+    ['exchange']))
+
+WAITING = metrics.registry.register(metrics.Gauge(
+    'obbot_ratelimit_waiting',
+    'Requests waiting for the rate limit by exchange.',
+    ['exchange']))
+
+# The exchanges sharing the same limits
+ALIASES = {'okex': 'okx'}
+
+
+def binance_depth_weight(limit):
+    limit = limit or 100
+    if limit <= 100:
+        return 5
+    if limit <= 500:
+        return 25
+    if limit <= 1000:
+        return 50
+    return 250
+
+
+# Weight of every endpoint by exchange (1 when it's not listed): a number or a function of
+# the depth limit
+WEIGHTS = {
+    'binance': {'depth': binance_depth_weight, 'ticker': 2, 'tickers': 80, 'markets': 20},
+}
+
+# The priority of the requests made by this task (and the tasks it creates)
+_priority = contextvars.ContextVar('ratelimit_priority', default=INTERACTIVE)
+# The WaitTracker of this task
+_tracker = contextvars.ContextVar('ratelimit_tracker', default=None)
+
+
+class WaitTracker():
+    """
+    Time the requests of a task spent waiting for the rate limit. waiting is True while a
+    request waits, and stays True when the wait is cancelled.
+    """
+    __slots__ = ('waited', 'waiting')
+
+    def __init__(self):
+        self.waited = 0.0
+        self.waiting = False
+
+
+def venue(exchange):
+    return ALIASES.get(exchange, exchange)
+
+
+def weight(exchange, endpoint, limit=None):
+    """
+    :param exchange: exchange name (ccxt id)
+    :param endpoint: 'depth', 'ticker', 'tickers' or 'markets'
+    :param limit: levels per side of a depth request (None = exchange default)
+    :return: the weight of the request
+    """
+    value = WEIGHTS.get(venue(exchange), {}).get(endpoint, 1)
+    return value(limit) if callable(value) else value
+
+
+@contextmanager
+def priority_scope(priority):
+    """
+    Run the requests of the block (and of the tasks created in it) with this priority.
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class _Waiter():
+    __slots__ = ('priority', 'sequence', 'loop', 'future')
+
+    def __init__(self, priority, sequence, loop):
+        self.priority = priority
+        self.sequence = sequence
+        self.loop = loop
+        self.future = None
+
+    def __lt__(self, other):
+        return (self.priority, self.sequence) < (other.priority, other.sequence)
+
+
+@contextmanager
+def track_waits():
+    """
+    Track the rate limit waits of the requests of the block (in the same task).
+    Example:
+        with ratelimit.track_waits() as waits:
+            await fetch()
+        latency = elapsed - waits.waited
+    """
+    tracker = WaitTracker()
+    token = _tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _tracker.reset(token)
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class RateLimiter():
+    """
+    Weighted token bucket of an exchange with a priority queue of waiting requests.
+    It can be shared by several event loops and threads.
+    How to use this class:
+
+    limiter = get_limiter('binance')
+    await limiter.acquire(50)  # before a 1000-level depth request
+    limiter.usage()
+    """
+
+    def __init__(self, name, limit, seconds, headroom=None, burst=None, reserve=None):
+        """
+        :param name: exchange name
+        :param limit: weight allowed by the exchange every seconds
+        :param seconds: window of the exchange limit
+        :param headroom: fraction of the limit we use (config.rate_limit_headroom)
+        :param burst: fraction of the limit that can be spent at once (config.rate_limit_burst)
+        :param reserve: fraction of the bucket kept for the INTERACTIVE requests (config.rate_limit_reserve)
+        """
+        self.name = name
+        self.limit = limit
+        self.seconds = seconds
+        self.rate = limit * (headroom or config.rate_limit_headroom) / seconds
+        self.capacity = max(1.0, limit * (burst or config.rate_limit_burst))
+        self.tokens = self.capacity
+        self.reserve = self.capacity * (config.rate_limit_reserve if reserve is None else reserve)
+        self.updated = time.monotonic()
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+        # (time, weight) of the last window, for the utilization
+        self.spent = deque()
+        self.spent_weight = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def spend(self, weight, now):
+        self.tokens -= weight
+        self.spent.append((now, weight))
+        self.spent_weight += weight
+
+    def wake_next(self):
+        # Called with the lock held: the first waiter checks the tokens again
+        if self.waiters and self.waiters[0].future is not None:
+            head = self.waiters[0]
+            head.loop.call_soon_threadsafe(_wake, head.future)
+
+    async def acquire(self, weight=1, priority=None):
+        """
+        Wait until the request can be sent.
+        :param weight: weight of the request (capped to the tokens it can use)
+        :param priority: INTERACTIVE, BACKGROUND or BULK (default: the priority of the task)
+        """
+        priority = _priority.get() if priority is None else priority
+        # Tokens the request can't use
+        reserve = self.reserve if priority > INTERACTIVE else 0.0
+        weight = min(weight, self.capacity - reserve)
+        start = time.monotonic()
+        tracker = _tracker.get()
+        loop = asyncio.get_running_loop()
+        waiter = _Waiter(priority, next(self.sequence), loop)
+        with self.lock:
+            self.refill(start)
+            if not self.waiters and self.tokens - reserve >= weight:
+                self.spend(weight, start)
+                waiter = None
+            else:
+                heapq.heappush(self.waiters, waiter)
+                WAITING.set(len(self.waiters), exchange=self.name)
+
+        if tracker is not None:
+            tracker.waiting = True
+        try:
+            while waiter is not None:
+                with self.lock:
+                    # A new future every time: a wake up can't be lost between the check and the wait
+                    waiter.future = loop.create_future()
+                    delay = None
+                    if self.waiters[0] is waiter:
+                        now = time.monotonic()
+                        self.refill(now)
+                        if self.tokens - reserve >= weight:
+                            self.spend(weight, now)
+                            heapq.heappop(self.waiters)
+                            WAITING.set(len(self.waiters), exchange=self.name)
+                            self.wake_next()
+                            break
+                        delay = (weight + reserve - self.tokens) / self.rate
+                # Only the first waiter has a timeout, the others wait to be woken up
+                await asyncio.wait([waiter.future], timeout=delay)
+        except BaseException:
+            # Cancelled (e.g. over the /ob budget): leave the queue
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                    heapq.heapify(self.waiters)
+                    WAITING.set(len(self.waiters), exchange=self.name)
+                    self.wake_next()
+            raise
+        finally:
+            if tracker is not None:
+                tracker.waited += time.monotonic() - start
+        # Still True when the wait was interrupted (cancelled)
+        if tracker is not None:
+            tracker.waiting = False
+
+        label = PRIORITY_NAMES.get(priority, str(priority))
+        WEIGHT.inc(weight, exchange=self.name, priority=label)
+        WAIT.observe(time.monotonic() - start, exchange=self.name, priority=label)
+        UTILIZATION.set(self.utilization(), exchange=self.name)
+
+    def utilization(self):
+        """
+        :return: weight spent in the last window over the limit of the exchange (0-1)
+        """
+        with self.lock:
+            since = time.monotonic() - self.seconds
+            while self.spent and self.spent[0][0] < since:
+                self.spent_weight -= self.spent.popleft()[1]
+            return self.spent_weight / self.limit
+
+    def usage(self):
+        """
+        :return: dict with the limit, the weight spent in the last window, the utilization,
+                 the tokens available and the number of waiting requests
+        """
+        utilization = self.utilization()
+        with self.lock:
+            self.refill(time.monotonic())
+            return {'limit': self.limit,
+                    'seconds': self.seconds,
+                    'spent': self.spent_weight,
+                    'utilization': utilization,
+                    'available': self.tokens,
+                    'waiting': len(self.waiters)}
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(exchange):
+    """
+    :param exchange: exchange name (ccxt id)
+    :return: the RateLimiter of the exchange (created on first use) or None when there is no
+             limit configured for it
+    """
+    name = venue(exchange)
+    if name not in config.rate_limits:
+        return None
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(name, *config.rate_limits[name])
+        return _limiters[name]
+
+
+async def acquire(exchange, endpoint, limit=None):
+    """
+    Wait for the rate limit of the exchange before a request.
+    :param exchange: exchange name (ccxt id)
+    :param endpoint: 'depth', 'ticker', 'tickers' or 'markets'
+    :param limit: levels per side of a depth request
+    """
+    limiter = get_limiter(exchange) if config.rate_limit_enabled else None
+    if limiter is not None:
+        await limiter.acquire(weight(exchange, endpoint, limit))
+
+
+def usage():
+    """
+    :return: {exchange: RateLimiter.usage()} of the exchanges used so far
+    """
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.name: limiter.usage() for limiter in limiters}
@@ -0,0 +1,254 @@
+"""
+Background order book recorder.
+Snapshots the depth of a watchlist of symbols at a fixed cadence into fixed-size
+memory-mapped ring buffers (one file per symbol). Each record stores the cumulative
+USD depth binned by price offset from the mid price, so "depth within X% over the
+last N hours" is answered by slicing the mapped file, without parsing anything.
+
+Run it as a standalone service:
+    python recorder.py
+or set config.recorder_enabled = True to run it inside the bot process.
+"""
+
+import os
+import time
+import asyncio
+import numpy as np
+import config
+import connectors
+import ratelimit
+
+MAGIC = b'OBRB'
+VERSION = 1
+HEADER_SIZE = 64
+
+HEADER_DTYPE = np.dtype([('magic', 'S4'),
+                         ('version', '<u4'),
+                         ('capacity', '<u8'),
+                         ('bins', '<u8'),
+                         ('bin_pct', '<f8'),
+                         ('written', '<u8')])
+
+
+def record_dtype(bins):
+    """
+    :param bins: number of bins per side
+    :return: the dtype of a record. bids[i]/asks[i] hold the USD depth within (i + 1) * bin_pct %
+    """
+    return np.dtype([('timestamp', '<f8'),
+                     ('mid', '<f8'),
+                     ('bids', '<f8', (bins,)),
+                     ('asks', '<f8', (bins,))])
+
+
+class RingBuffer():
+    """
+    Fixed-size ring buffer of depth records backed by a memory-mapped file.
+    The writer fills the next slot and then bumps the 'written' counter in the header,
+    so readers only see complete records. Readers get views of the mapped file (zero-copy).
+    How to use this class:
+
+    ring = RingBuffer(path, capacity=10080, bins=100, bin_pct=0.1)  # creates or opens the file
+    ring.append(timestamp, mid, bids_cumulative, asks_cumulative)
+
+    ring = RingBuffer(path, readonly=True)
+    timestamps, bids, asks = ring.depth_within(2.0, hours=24)
+    """
+
+    def __init__(self, path, capacity=None, bins=None, bin_pct=None, readonly=False):
+        self.path = path
+        if not os.path.isfile(path):
+            if readonly:
+                raise FileNotFoundError(f"Ring buffer {path} does not exist")
+            self.create(path, capacity, bins, bin_pct)
+
+        mode = 'r' if readonly else 'r+'
+        self.header = np.memmap(path, dtype=HEADER_DTYPE, mode=mode, offset=0, shape=(1,))
+        if self.header['magic'][0] != MAGIC or self.header['version'][0] != VERSION:
+            raise ValueError(f"{path} is not an order book ring buffer")
+        self.capacity = int(self.header['capacity'][0])
+        self.bins = int(self.header['bins'][0])
+        self.bin_pct = float(self.header['bin_pct'][0])
+        self.records = np.memmap(path, dtype=record_dtype(self.bins), mode=mode,
+                                 offset=HEADER_SIZE, shape=(self.capacity,))
+
+    @staticmethod
+    def create(path, capacity, bins, bin_pct):
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['capacity'] = capacity
+        header['bins'] = bins
+        header['bin_pct'] = bin_pct
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file:
+            file.write(header.tobytes().ljust(HEADER_SIZE, b'\0'))
+            file.truncate(HEADER_SIZE + capacity * record_dtype(bins).itemsize)
+        os.replace(tmp_path, path)
+
+    @property
+    def written(self):
+        return int(self.header['written'][0])
+
+    def append(self, timestamp, mid, bids, asks):
+        """
+        Write a new record, overwriting the oldest one when the buffer is full.
+        :param bids: cumulative bid USD per bin (length = bins)
+        :param asks: cumulative ask USD per bin (length = bins)
+        """
+        written = self.written
+        record = self.records[written % self.capacity]
+        record['timestamp'] = timestamp
+        record['mid'] = mid
+        record['bids'] = bids
+        record['asks'] = asks
+        # Publish the record only once it's complete
+        self.header['written'] = written + 1
+
+    def segments(self):
+        """
+        Chronological views of the valid records (zero-copy).
+        The oldest slot is left out once the buffer wraps around: it's the next one
+        to be overwritten and could be half-written while we read it.
+        :return: list with one or two views of the records array
+        """
+        written = self.written
+        if written < self.capacity:
+            return [self.records[:written]]
+        start = written % self.capacity
+        return [self.records[start + 1:], self.records[:start]]
+
+    def bin_index(self, pct):
+        """
+        :param pct: distance from the mid price in %
+        :return: the bin holding the depth within pct %
+        """
+        index = int(np.ceil(pct / self.bin_pct - 1e-9)) - 1
+        if index < 0 or index >= self.bins:
+            raise ValueError(f"Distance must be between {self.bin_pct}% and {self.bin_pct * self.bins}%")
+        return index
+
+    def depth_within(self, pct, hours=None):
+        """
+        USD depth within pct % of the mid price over the last hours.
+        :param pct: distance from the mid price in % (rounded up to the bin size)
+        :param hours: time window. None returns the whole buffer.
+        :return: (timestamps, bid USD, ask USD) arrays in chronological order
+        """
+        index = self.bin_index(pct)
+        since = time.time() - hours * 3600 if hours is not None else -np.inf
+        timestamps, bids, asks = [], [], []
+        for segment in self.segments():
+            # Timestamps are increasing inside each segment
+            segment = segment[np.searchsorted(segment['timestamp'], since):]
+            timestamps.append(segment['timestamp'])
+            bids.append(segment['bids'][:, index])
+            asks.append(segment['asks'][:, index])
+        return np.concatenate(timestamps), np.concatenate(bids), np.concatenate(asks)
+
+    def flush(self):
+        self.records.flush()
+        self.header.flush()
+
+
+def bin_depth(depths, bins, bin_pct):
+    """
+    Aggregate the depth of several exchanges into cumulative USD per bin of
+    price offset from the mid price.
+    :param depths: list of connectors.DepthSnapshot
+    :return: (mid, bids cumulative USD, asks cumulative USD) or None when the book is empty
+    """
+    bids = np.concatenate([depth.bids for depth in depths])
+    asks = np.concatenate([depth.asks for depth in depths])
+    if len(bids) == 0 or len(asks) == 0:
+        return None
+    mid = (bids[:, 0].max() + asks[:, 0].min()) / 2
+
+    def cumulative(levels, offsets):
+        # Bin i holds the levels with offset in (i * bin_pct, (i + 1) * bin_pct]
+        index = np.maximum(np.ceil(offsets / bin_pct - 1e-9).astype(np.int64) - 1, 0)
+        valid = (offsets >= 0) & (index < bins)
+        usd = levels[valid, 0] * levels[valid, 1]
+        return np.cumsum(np.bincount(index[valid], weights=usd, minlength=bins))
+
+    return (mid,
+            cumulative(bids, (mid - bids[:, 0]) / mid * 100),
+            cumulative(asks, (asks[:, 0] - mid) / mid * 100))
+
+
+def ring_path(symbol):
+    return os.path.join(config.recorder_path, symbol.replace("/", "") + ".ring")
+
+
+def open_ring(symbol):
+    """
+    Open the recorded history of a symbol read-only.
+    :param symbol: Example: BTC/USDT
+    :return: RingBuffer
+    """
+    return RingBuffer(ring_path(symbol), readonly=True)
+
+
+def depth_history(symbol, pct, hours):
+    """
+    :return: (timestamps, bid USD, ask USD) within pct % of the mid over the last hours
+    """
+    return open_ring(symbol).depth_within(pct, hours)
+
+
+class OrderBookRecorder():
+    """
+    Snapshots the watchlist every interval seconds into one ring buffer per symbol.
+    """
+
+    def __init__(self, watchlist=None, exchanges=None, interval=None):
+        self.watchlist = watchlist or config.recorder_watchlist
+        self.exchanges = exchanges or config.recorder_exchanges
+        self.interval = interval or config.recorder_interval
+        self.connectors = [connectors.get_connector(name, config.exchange_api_urls.get(name))
+                           for name in self.exchanges]
+        self.connectors = [connector for connector in self.connectors if connector is not None]
+        os.makedirs(config.recorder_path, exist_ok=True)
+        self.rings = {symbol: RingBuffer(ring_path(symbol), config.recorder_capacity,
+                                         config.recorder_bins, config.recorder_bin_pct)
+                      for symbol in self.watchlist}
+
+    async def snapshot(self, symbol):
+        results = await asyncio.gather(*[connector.fetch_depth(symbol) for connector in self.connectors],
+                                       return_exceptions=True)
+        depths = []
+        for connector, depth in zip(self.connectors, results):
+            if isinstance(depth, Exception):
+                print(f'Recorder: error fetching {symbol} from {connector.name}: {depth}')
+            else:
+                depths.append(depth)
+        if len(depths) == 0:
+            return
+        ring = self.rings[symbol]
+        binned = bin_depth(depths, ring.bins, ring.bin_pct)
+        if binned is not None:
+            ring.append(time.time(), *binned)
+
+    async def run(self):
+        print(f"Recording {', '.join(self.watchlist)} every {self.interval} seconds")
+        while True:
+            start_time = time.monotonic()
+            # Behind the requests of the users (see ratelimit.py)
+            try:
+                with ratelimit.priority_scope(ratelimit.BULK):
+                    await asyncio.gather(*[self.snapshot(symbol) for symbol in self.watchlist])
+            except Exception as e:
+                print(f"Recorder: error recording the watchlist: {e}")
+            # Keep a fixed cadence regardless of how long the snapshot took
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - start_time)))
+
+
+async def main():
+    try:
+        await OrderBookRecorder().run()
+    finally:
+        await connectors.close_sessions()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
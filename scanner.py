@@ -0,0 +1,315 @@
+"""
+Market-wide wall scanner: a local alternative to the TrendCore table.
+Every scanner_interval seconds it takes the scanner_top_n USDT pairs with the highest 24h
+volume, fetches their order books from the configured exchanges (at most
+scanner_concurrency symbols at the same time) and finds the walls of every symbol in a
+process pool with the /ob wall detector (walls.py). The symbols that didn't finish within
+scanner_budget seconds are left out of the scan.
+
+The result has the same shape as the TrendCore table (index Coin, Price, Amount, USD per
+level, To level %, Distance, Wall type, Created, Elapsed Minutes...) and is saved to
+config.scanner_snapshot, so /scan formats it with TrendCore.get_formatted_data().
+The requests wait for the process-wide rate limit with the BULK priority, behind the
+requests of the users and of the prewarmer (see ratelimit.py).
+
+Run it as a standalone service:
+    python scanner.py
+or set config.scanner_enabled = True to run it inside the bot process.
+"""
+
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import ccxt.async_support as ccxt
+from millify import millify
+import config
+import metrics
+import snapshot
+import ratelimit
+import walls
+from AggregatedOrderBook import override_api_urls
+
+SYMBOLS = metrics.registry.register(metrics.Counter(
+    'obbot_scanner_symbols_total',
+    'Symbols scanned by result (ok, failed, timeout = over the scan budget).',
+    ['result']))
+
+WALLS = metrics.registry.register(metrics.Gauge(
+    'obbot_scanner_walls',
+    'Walls found by the last scan.'))
+
+SCAN_DURATION = metrics.registry.register(metrics.Gauge(
+    'obbot_scanner_duration_seconds',
+    'Duration of the last scan.'))
+
+COLUMNS = ['Price', 'Amount', 'USD per level', 'To level %', 'Distance', 'Wall type', 'Exchange',
+           'Created', 'Elapsed Minutes', 'Estimate time to corrode (mins)']
+
+
+def find_walls(coin, prices, sizes, exchanges, current_price, wallsize, distance, detector):
+    """
+    Walls of one symbol (runs in the process pool).
+    :param coin: Example: BTCUSDT
+    :param prices: price of every level of every exchange (both sides)
+    :param sizes: size of every level in base currency
+    :param exchanges: exchange of every level
+    :param current_price: mid price of the symbol
+    :param wallsize: minimum size of a wall in USD
+    :param distance: maximum distance from the current price in %
+    :param detector: wall detector name (see walls.py)
+    :return: list of (coin, price, USD size, exchange)
+    """
+    detector = walls.get_detector(wallsize, distance, detector)
+    rows = []
+    # Same split and order as AggregatedOrderBook.process_order_book: sorted by price descending
+    for side in (prices < current_price, prices > current_price):
+        order = np.argsort(-prices[side], kind='stable')
+        side_prices = prices[side][order]
+        side_usd = side_prices * sizes[side][order]
+        side_exchanges = exchanges[side][order]
+        for index in detector.detect(side_prices, side_usd, side_exchanges, current_price):
+            rows.append((coin, float(side_prices[index]), float(side_usd[index]), str(side_exchanges[index])))
+    return rows
+
+
+def rank_symbols(tickers, top_n):
+    """
+    :param tickers: ccxt tickers {symbol: ticker}
+    :return: the top_n USDT pairs by 24h quote volume, highest first
+    """
+    volumes = [(ticker.get('quoteVolume') or 0.0, symbol) for symbol, ticker in tickers.items()
+               if symbol.endswith('/USDT')]
+    return [symbol for volume, symbol in sorted(volumes, reverse=True)[:top_n]]
+
+
+def read_walls():
+    """
+    :return: (time of the last scan, dataframe) or None when there is no scan yet
+    """
+    try:
+        return os.path.getmtime(config.scanner_snapshot), snapshot.read(config.scanner_snapshot)
+    except (OSError, snapshot.SnapshotError) as e:
+        print(f"Error reading the scanner snapshot: {e}")
+        return None
+
+
+class MarketScanner():
+    """
+    How to use this class:
+
+    scanner = MarketScanner(['binance', 'okx', 'bybit'])
+    df = await scanner.scan()  # TrendCore-shaped dataframe, also saved to config.scanner_snapshot
+    await scanner.close()
+
+    task = asyncio.create_task(MarketScanner().run())  # scan every config.scanner_interval seconds
+    """
+
+    def __init__(self, exchanges=None, top_n=None, concurrency=None, budget=None, processes=None):
+        """
+        :param exchanges: ccxt exchanges to aggregate (config.scanner_exchanges)
+        :param top_n: number of USDT pairs scanned (config.scanner_top_n)
+        :param concurrency: symbols fetched at the same time (config.scanner_concurrency)
+        :param budget: maximum duration of a scan in seconds (config.scanner_budget)
+        :param processes: size of the wall detection process pool (config.scanner_processes)
+        """
+        self.top_n = top_n or config.scanner_top_n
+        self.concurrency = concurrency or config.scanner_concurrency
+        self.budget = budget or config.scanner_budget
+        self.processes = processes or config.scanner_processes
+        self.exchanges = {}
+        for name in exchanges or config.scanner_exchanges:
+            # Renamed exchanges (okex is okx in ccxt now)
+            exchange = name if name in ccxt.exchanges else ratelimit.venue(name)
+            if exchange not in ccxt.exchanges:
+                print(f'Exchange {name} is not supported.')
+                continue
+            # Throttled by the process-wide rate limit (see ratelimit.py)
+            self.exchanges[exchange] = getattr(ccxt, exchange)({
+                'enableRateLimit': False,
+                "options": {'defaultType': 'spot'}
+            })
+            api_url = config.exchange_api_urls.get(exchange, config.exchange_api_urls.get(name))
+            if api_url is not None:
+                self.exchanges[exchange].urls['api'] = override_api_urls(self.exchanges[exchange].urls['api'],
+                                                                         api_url)
+        self.markets = {}
+        self.pool = None
+        # {(coin, exchange, price): time the wall was first seen}
+        self.first_seen = {}
+        self.dataframe = pd.DataFrame(columns=COLUMNS)
+
+    async def load_markets(self):
+        for name, exchange in self.exchanges.items():
+            if name not in self.markets:
+                try:
+                    await ratelimit.acquire(name, 'markets')
+                    self.markets[name] = await exchange.load_markets()
+                except Exception as e:
+                    print(f'Scanner: error loading markets from {name}: {e}')
+
+    async def universe(self):
+        """
+        :return: the symbols to scan (USDT pairs with the highest volume on the first exchange
+                 that returns its tickers)
+        """
+        await self.load_markets()
+        for name, exchange in self.exchanges.items():
+            if name not in self.markets or not exchange.has.get('fetchTickers'):
+                continue
+            try:
+                await ratelimit.acquire(name, 'tickers')
+                return rank_symbols(await exchange.fetch_tickers(), self.top_n)
+            except Exception as e:
+                print(f'Scanner: error fetching the tickers from {name}: {e}')
+        return []
+
+    async def fetch_levels(self, symbol):
+        """
+        :return: (prices, sizes, exchanges, mid price) of the levels of every exchange listing
+                 the symbol or None when there's no order book
+        """
+        async def fetch(name):
+            await ratelimit.acquire(name, 'depth', config.scanner_depth_limit)
+            return await self.exchanges[name].fetch_order_book(symbol, config.scanner_depth_limit)
+
+        names = [name for name in self.exchanges if symbol in self.markets.get(name, {})]
+        results = await asyncio.gather(*[fetch(name) for name in names], return_exceptions=True)
+        prices, sizes, venues, best_bids, best_asks = [], [], [], [], []
+        for name, order_book in zip(names, results):
+            if isinstance(order_book, Exception):
+                print(f'Scanner: error fetching {symbol} from {name}: {order_book}')
+                continue
+            for side in ('bids', 'asks'):
+                if order_book[side]:
+                    levels = np.array([level[:2] for level in order_book[side]], dtype=np.float64)
+                    prices.append(levels[:, 0])
+                    sizes.append(levels[:, 1])
+                    venues.append(np.full(len(levels), name, dtype=object))
+            if order_book['bids'] and order_book['asks']:
+                best_bids.append(order_book['bids'][0][0])
+                best_asks.append(order_book['asks'][0][0])
+        if len(best_bids) == 0:
+            return None
+        # The mid price saves a ticker request per symbol
+        mid = (max(best_bids) + min(best_asks)) / 2
+        return np.concatenate(prices), np.concatenate(sizes), np.concatenate(venues), mid
+
+    async def scan_symbol(self, symbol, semaphore, wallsize, distance):
+        """
+        :return: list of (coin, price, USD size, exchange, current price)
+        """
+        async with semaphore:
+            levels = await self.fetch_levels(symbol)
+        if levels is None:
+            return []
+        prices, sizes, venues, mid = levels
+        rows = await asyncio.get_running_loop().run_in_executor(
+            self.pool, find_walls, symbol.replace("/", ""), prices, sizes, venues, mid,
+            wallsize, distance, config.wall_detector)
+        return [row + (mid,) for row in rows]
+
+    async def scan(self, wallsize=None, distance=None):
+        """
+        Scan the top symbols within the time budget and save the walls.
+        :param wallsize: minimum wall size in USD (config.scanner_wallsize)
+        :param distance: maximum distance from the price in % (config.scanner_distance)
+        :return: TrendCore-shaped dataframe
+        """
+        start_time = time.monotonic()
+        wallsize = wallsize or config.scanner_wallsize
+        distance = distance or config.scanner_distance
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.processes)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        # The tasks inherit the priority
+        with ratelimit.priority_scope(ratelimit.BULK):
+            symbols = await self.universe()
+            tasks = [asyncio.create_task(self.scan_symbol(symbol, semaphore, wallsize, distance))
+                     for symbol in symbols]
+        rows = []
+        if len(tasks) > 0:
+            remaining = max(0.0, self.budget - (time.monotonic() - start_time))
+            done, pending = await asyncio.wait(tasks, timeout=remaining)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for symbol, task in zip(symbols, tasks):
+                if task.cancelled():
+                    SYMBOLS.inc(result='timeout')
+                elif task.exception() is not None:
+                    print(f'Scanner: error scanning {symbol}: {task.exception()}')
+                    SYMBOLS.inc(result='failed')
+                else:
+                    SYMBOLS.inc(result='ok')
+                    rows.extend(task.result())
+
+        self.dataframe = self.to_dataframe(rows)
+        snapshot.write(self.dataframe, config.scanner_snapshot)
+        WALLS.set(len(self.dataframe.index))
+        SCAN_DURATION.set(time.monotonic() - start_time)
+        return self.dataframe
+
+    def to_dataframe(self, rows):
+        """
+        :param rows: list of (coin, price, USD size, exchange, current price)
+        :return: the walls with the columns of the TrendCore table (index: Coin)
+        """
+        now = time.time()
+        first_seen = {}
+        for coin, price, amount, exchange, current_price in rows:
+            key = (coin, exchange, price)
+            first_seen[key] = self.first_seen.get(key, now)
+        # Forget the walls that are gone
+        self.first_seen = first_seen
+        if len(rows) == 0:
+            return pd.DataFrame(columns=COLUMNS, index=pd.Index([], dtype=object, name='Coin'))
+
+        coins, prices, amounts, exchanges, current_prices = (np.array(column) for column in zip(*rows))
+        to_level = (prices - current_prices) / current_prices * 100
+        created = np.array([first_seen[key] for key in zip(coins, exchanges, prices)])
+        df = pd.DataFrame({'Price': prices,
+                           'Amount': amounts,
+                           'USD per level': [millify(amount, 1).upper() for amount in amounts],
+                           'To level %': to_level,
+                           'Distance': np.abs(to_level),
+                           'Wall type': np.where(to_level > 0, 'sell', 'buy'),
+                           'Exchange': exchanges.astype(object),
+                           'Created': pd.to_datetime(created, unit='s'),
+                           'Elapsed Minutes': np.round((now - created) / 60),
+                           # There is no trade flow to estimate it (printed as '-')
+                           'Estimate time to corrode (mins)': None},
+                          index=pd.Index(coins.astype(object), name='Coin'))
+        return df
+
+    async def close(self):
+        await asyncio.gather(*[exchange.close() for exchange in self.exchanges.values()
+                               if getattr(exchange, 'session', True) is not None])
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    async def run(self):
+        print(f"Scanning the top {self.top_n} USDT pairs on {', '.join(self.exchanges)} "
+              f"every {config.scanner_interval} seconds")
+        try:
+            while True:
+                start_time = time.monotonic()
+                try:
+                    await self.scan()
+                except Exception as e:
+                    print(f"Scanner: error scanning the market: {e}")
+                await asyncio.sleep(max(0.0, config.scanner_interval - (time.monotonic() - start_time)))
+        finally:
+            await self.close()
+
+
+async def main():
+    await MarketScanner().run()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
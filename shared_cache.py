@@ -0,0 +1,316 @@
+"""
+Shared cache for several bot instances (or worker processes) running on the same data.
+It holds the TrendCore snapshots, the aggregated order books and the rendered charts,
+and makes sure only one instance refreshes each key at a time (cross-process lock).
+
+Two backends:
+- SQLiteCache: a SQLite database in WAL mode. Processes on the same host share it through
+  the file system (put config.shared_cache_path on /dev/shm to keep it in shared memory).
+- RedisCache: any server speaking the Redis protocol (RESP). Use it for several hosts.
+
+Select the backend with config.shared_cache: None (disabled), 'sqlite' or 'redis://host:port/db'.
+
+The backends are synchronous (a locked SQLite file or a slow Redis server blocks the caller):
+the coroutines use the *_async methods, which run them in a worker thread.
+"""
+
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import threading
+from urllib.parse import urlparse
+import config
+
+# Compare-and-delete: release the lock only if we still own it
+UNLOCK_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+class SharedCache():
+    """
+    Base class of the shared cache backends. Values are bytes.
+    How to use the cache:
+
+    cache = shared_cache.get_cache()
+    value = cache.get_or_refresh('trendcore', ttl=60, refresh=lambda: scrap_and_serialize())
+    # From a coroutine
+    value = await cache.get_or_refresh_async('order_book:BTCUSDT', ttl=60, refresh=fetch_and_serialize)
+    """
+
+    # How often the instances waiting for a refresh check if the value is ready (seconds)
+    poll_interval = 0.05
+
+    def get(self, key):
+        raise NotImplementedError()
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def acquire_lock(self, key, ttl):
+        """
+        Try to take the lock without waiting.
+        :param key: the cache key to protect
+        :param ttl: seconds after which the lock expires (in case the owner dies)
+        :return: the lock token or None if another instance holds it
+        """
+        raise NotImplementedError()
+
+    def release_lock(self, key, token):
+        raise NotImplementedError()
+
+    async def get_async(self, key):
+        return await asyncio.to_thread(self.get, key)
+
+    async def set_async(self, key, value, ttl):
+        await asyncio.to_thread(self.set, key, value, ttl)
+
+    async def delete_async(self, key):
+        await asyncio.to_thread(self.delete, key)
+
+    async def acquire_lock_async(self, key, ttl):
+        return await asyncio.to_thread(self.acquire_lock, key, ttl)
+
+    async def release_lock_async(self, key, token):
+        await asyncio.to_thread(self.release_lock, key, token)
+
+    def get_or_refresh(self, key, ttl, refresh, wait_timeout=None):
+        """
+        Return the cached value or refresh it. Only one instance refreshes the key,
+        the others wait for the new value.
+        :param key: cache key
+        :param ttl: seconds the value stays in the cache
+        :param refresh: callable returning the new value (bytes)
+        :param wait_timeout: maximum seconds to wait for another instance. After that we refresh ourselves.
+        :return: the value (bytes)
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        deadline = time.monotonic() + (wait_timeout or config.shared_cache_wait)
+        while True:
+            token = self.acquire_lock(key, config.shared_cache_lock_ttl)
+            if token is not None or time.monotonic() > deadline:
+                return self._refresh(key, ttl, refresh, token)
+            time.sleep(self.poll_interval)
+            value = self.get(key)
+            if value is not None:
+                return value
+
+    async def get_or_refresh_async(self, key, ttl, refresh, wait_timeout=None):
+        """
+        Same as get_or_refresh() for coroutines: refresh is an async callable and the
+        backend calls run in a worker thread.
+        """
+        value = await self.get_async(key)
+        if value is not None:
+            return value
+        deadline = time.monotonic() + (wait_timeout or config.shared_cache_wait)
+        while True:
+            token = await self.acquire_lock_async(key, config.shared_cache_lock_ttl)
+            if token is not None or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(self.poll_interval)
+            value = await self.get_async(key)
+            if value is not None:
+                return value
+        try:
+            # Another instance may have finished just before we took the lock
+            value = await self.get_async(key)
+            if value is None:
+                value = await refresh()
+                if value is not None:
+                    await self.set_async(key, value, ttl)
+            return value
+        finally:
+            if token is not None:
+                await self.release_lock_async(key, token)
+
+    def _refresh(self, key, ttl, refresh, token):
+        try:
+            value = self.get(key)
+            if value is None:
+                value = refresh()
+                if value is not None:
+                    self.set(key, value, ttl)
+            return value
+        finally:
+            if token is not None:
+                self.release_lock(key, token)
+
+
+class SQLiteCache(SharedCache):
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        connection = self.connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+        connection.execute('CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, token TEXT, expires REAL)')
+        connection.commit()
+
+    def connection(self):
+        # sqlite3 connections can't be shared between threads
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        row = self.connection().execute('SELECT value FROM cache WHERE key = ? AND expires > ?',
+                                        (key, time.time())).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def set(self, key, value, ttl):
+        self.connection().execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                                  (key, sqlite3.Binary(value), time.time() + ttl))
+
+    def delete(self, key):
+        self.connection().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def acquire_lock(self, key, ttl):
+        token = uuid.uuid4().hex
+        now = time.time()
+        connection = self.connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM locks WHERE key = ? AND expires <= ?', (key, now))
+            cursor = connection.execute('INSERT OR IGNORE INTO locks VALUES (?, ?, ?)', (key, token, now + ttl))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return token if cursor.rowcount == 1 else None
+
+    def release_lock(self, key, token):
+        self.connection().execute('DELETE FROM locks WHERE key = ? AND token = ?', (key, token))
+
+    def purge(self):
+        """
+        Remove the expired values (the lookups ignore them anyway).
+        """
+        self.connection().execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisCache(SharedCache):
+    """
+    Minimal Redis protocol (RESP2) client: GET, SET (PX/NX), DEL and EVAL.
+    Keys are prefixed with config.shared_cache_prefix.
+    """
+
+    def __init__(self, url):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.password = parsed.password
+        self.prefix = config.shared_cache_prefix
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            sock = socket.create_connection((self.host, self.port), timeout=config.shared_cache_timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = (sock, sock.makefile('rb'))
+            self.local.connection = connection
+            if self.password:
+                self._command(connection, 'AUTH', self.password)
+            if self.db:
+                self._command(connection, 'SELECT', self.db)
+        return connection
+
+    @staticmethod
+    def _encode(*args):
+        parts = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    @classmethod
+    def _read_reply(cls, reader):
+        line = reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            raise RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            length = int(payload)
+            if length == -1:
+                return None
+            data = reader.read(length + 2)
+            return data[:-2]
+        if kind == b'*':
+            length = int(payload)
+            if length == -1:
+                return None
+            return [cls._read_reply(reader) for _ in range(length)]
+        raise RedisError(f"Unexpected reply: {line!r}")
+
+    def _command(self, connection, *args):
+        sock, reader = connection
+        sock.sendall(self._encode(*args))
+        return self._read_reply(reader)
+
+    def command(self, *args):
+        try:
+            return self._command(self.connection(), *args)
+        except (OSError, ConnectionError):
+            # Drop the broken connection, the next command reconnects
+            connection = getattr(self.local, 'connection', None)
+            self.local.connection = None
+            if connection is not None:
+                connection[0].close()
+            raise
+
+    def get(self, key):
+        return self.command('GET', self.prefix + key)
+
+    def set(self, key, value, ttl):
+        self.command('SET', self.prefix + key, value, 'PX', int(ttl * 1000))
+
+    def delete(self, key):
+        self.command('DEL', self.prefix + key)
+
+    def acquire_lock(self, key, ttl):
+        token = uuid.uuid4().hex
+        reply = self.command('SET', self.prefix + 'lock:' + key, token, 'NX', 'PX', int(ttl * 1000))
+        return token if reply == 'OK' else None
+
+    def release_lock(self, key, token):
+        self.command('EVAL', UNLOCK_SCRIPT, 1, self.prefix + 'lock:' + key, token)
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    :return: the shared cache configured in config.shared_cache or None when it's disabled
+    """
+    global _cache
+    if _cache is None and config.shared_cache:
+        if config.shared_cache == 'sqlite':
+            _cache = SQLiteCache(config.shared_cache_path)
+        elif config.shared_cache.startswith('redis://'):
+            _cache = RedisCache(config.shared_cache)
+        else:
+            raise ValueError(f"Unsupported shared cache: {config.shared_cache}")
+    return _cache
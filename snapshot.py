@@ -0,0 +1,201 @@
+"""
+Binary DataFrame snapshots for the local caches (TrendCore table, aggregated order books).
+Replaces the CSV files: no text encoding/decoding, no dtype inference and no stray index
+column on reload.
+
+File layout:
+    magic (4 bytes) | version (u4) | header length (u8) | JSON header | column buffers
+
+Every column buffer starts at a 64-byte aligned offset. Numeric, bool and datetime
+columns are stored raw and read back as read-only views of a memory map, so loading a
+snapshot doesn't copy them. Text columns are dictionary encoded (int32 codes + the
+distinct values in the header).
+
+The writer fills a temporary file and renames it over the snapshot (os.replace is atomic),
+so a reader gets either the previous or the new snapshot, never a half-written one.
+
+dumps()/loads() use the same layout in memory for the values of the shared cache, with
+JSON metadata (the time of the data) in the header: unlike pickle, a value written by
+anyone with access to the shared cache can't run code when it's loaded.
+"""
+
+import os
+import json
+import mmap
+import struct
+import threading
+import numpy as np
+import pandas as pd
+
+MAGIC = b'OBSN'
+VERSION = 1
+PREAMBLE = struct.Struct('<4sIQ')
+ALIGNMENT = 64
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _encode_column(name, series):
+    """
+    :return: (column description for the header, bytes of the buffer)
+    """
+    dtype = series.dtype
+    if dtype.kind in 'biufM' and isinstance(dtype, np.dtype):
+        values = np.ascontiguousarray(series.to_numpy())
+        return {'name': name, 'kind': 'raw', 'dtype': values.dtype.str}, values.tobytes()
+    if dtype == object or pd.api.types.is_string_dtype(dtype):
+        values = series.to_numpy(dtype=object)
+        missing = pd.isna(values)
+        if not all(isinstance(value, str) for value in values[~missing]):
+            raise SnapshotError(f"Column {name} has values that are neither numbers nor text")
+        categories, codes = np.unique(values[~missing].astype(str), return_inverse=True)
+        all_codes = np.full(len(values), -1, dtype='<i4')
+        all_codes[~missing] = codes
+        return {'name': name, 'kind': 'text', 'dtype': str(dtype),
+                'categories': categories.tolist()}, all_codes.tobytes()
+    raise SnapshotError(f"Unsupported dtype {dtype} in column {name}")
+
+
+def _encode(df, metadata=None):
+    """
+    :return: (header bytes, column buffers with their offsets, total size)
+    """
+    columns = [(str(name), df[name]) for name in df.columns]
+    index_name = None
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        # Keep a named index (e.g. TrendCore's Coin) as one more column
+        index_name = df.index.name if df.index.name is not None else '__index__'
+        columns.append((index_name, df.index.to_series()))
+
+    descriptions, buffers = [], []
+    for name, series in columns:
+        description, buffer = _encode_column(name, series)
+        descriptions.append(description)
+        buffers.append(buffer)
+
+    header = {'rows': len(df.index), 'index': index_name, 'columns': descriptions, 'metadata': metadata}
+    # The buffer offsets depend on the header length: measure it with the widest possible offsets
+    for description in descriptions:
+        description['offset'] = description['nbytes'] = 10 ** 15
+    offset = _align(PREAMBLE.size + len(json.dumps(header).encode('utf-8')))
+    for description, buffer in zip(descriptions, buffers):
+        description['offset'] = offset
+        description['nbytes'] = len(buffer)
+        offset = _align(offset + len(buffer))
+    header_bytes = json.dumps(header).encode('utf-8')
+    chunks = [(description['offset'], buffer) for description, buffer in zip(descriptions, buffers)]
+    return PREAMBLE.pack(MAGIC, VERSION, len(header_bytes)) + header_bytes, chunks, offset
+
+
+def write(df, path, metadata=None):
+    """
+    Save the dataframe atomically.
+    :param df: DataFrame with numeric, bool, datetime64 (naive) or text columns
+    :param path: snapshot file
+    :param metadata: JSON-serializable value saved in the header
+    """
+    head, chunks, size = _encode(df, metadata)
+    # One temporary file per writer (process and thread)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'wb') as file:
+            file.write(head)
+            for offset, buffer in chunks:
+                file.seek(offset)
+                file.write(buffer)
+            file.truncate(size)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def dumps(df, metadata=None):
+    """
+    Serialize the dataframe (same layout as the files). Unlike pickle, loading it can't
+    run code: use it for the values of the shared cache.
+    :param metadata: JSON-serializable value saved in the header (e.g. the time of the data)
+    :return: bytes
+    """
+    head, chunks, size = _encode(df, metadata)
+    data = bytearray(size)
+    data[:len(head)] = head
+    for offset, buffer in chunks:
+        data[offset:offset + len(buffer)] = buffer
+    return bytes(data)
+
+
+def _decode(buffer, size, source):
+    """
+    :param buffer: the snapshot (bytes or memory map)
+    :param source: name of the snapshot for the errors
+    :return: (DataFrame, metadata)
+    """
+    if size < PREAMBLE.size:
+        raise SnapshotError(f"{source} is not a snapshot")
+    magic, version, header_length = PREAMBLE.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise SnapshotError(f"{source} is not a snapshot")
+    try:
+        header = json.loads(buffer[PREAMBLE.size:PREAMBLE.size + header_length])
+        rows = header['rows']
+
+        data = {}
+        for description in header['columns']:
+            if description['offset'] + description['nbytes'] > size:
+                raise SnapshotError(f"{source} is truncated")
+            if description['kind'] == 'raw':
+                dtype = np.dtype(description['dtype'])
+                if dtype.kind not in 'biufM':
+                    raise SnapshotError(f"Unsupported dtype {dtype} in {source}")
+                data[description['name']] = np.frombuffer(buffer, dtype=dtype, count=rows,
+                                                          offset=description['offset'])
+            else:
+                codes = np.frombuffer(buffer, dtype='<i4', count=rows, offset=description['offset'])
+                categories = np.array(description['categories'] + [None], dtype=object)
+                # Code -1 (missing value) picks the trailing None
+                data[description['name']] = pd.Series(categories[codes], dtype=description['dtype'])
+
+        df = pd.DataFrame({name: values for name, values in data.items()}, copy=False)
+        if header['index'] is not None:
+            df.set_index(header['index'], inplace=True)
+            if header['index'] == '__index__':
+                df.index.name = None
+    except SnapshotError:
+        raise
+    except (ValueError, TypeError, KeyError, IndexError) as e:
+        raise SnapshotError(f"{source} is corrupted: {e}") from e
+    return df, header.get('metadata')
+
+
+def read(path):
+    """
+    Load a snapshot. The numeric columns are views of the memory-mapped file.
+    :param path: snapshot file
+    :return: the DataFrame
+    """
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size < PREAMBLE.size:
+            raise SnapshotError(f"{path} is not a snapshot")
+        # The mapping stays valid after closing the file and even if the snapshot is replaced
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return _decode(buffer, size, path)[0]
+
+
+def loads(data):
+    """
+    Load a snapshot serialized by dumps(). The numeric columns are read-only views of data.
+    :param data: bytes
+    :return: (DataFrame, metadata)
+    """
+    return _decode(data, len(data), 'value')
@@ -0,0 +1,193 @@
+import os
+import time
+import glob
+import json
+import pstats
+import cProfile
+import datetime
+import functools
+import contextvars
+import logging
+from logging.handlers import RotatingFileHandler
+from contextlib import contextmanager
+import config
+
+# Opt-in tracing of individual Telegram updates.
+# Each update handled by a decorated command records a span tree (handler, db.get_user,
+# TrendCore scrape/cache read, every ccxt call, chart render, reply...). Updates slower than
+# config.tracing_slow_threshold are appended to a rotating JSONL log under config.data_path.
+# When config.tracing_profile is enabled, the handler also runs under cProfile and the stats
+# are dumped to disk for the updates slower than config.tracing_profile_threshold.
+
+# The span currently open in this task/thread (None when the update is not being traced)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+# cProfile can't profile two updates at the same time, only one profiler is active per process
+_profiling = False
+
+_slow_logger = None
+
+
+class Span():
+    """
+    A timed operation inside an update. Spans opened while another span is active
+    become its children, so the root span holds the full tree for the update.
+    """
+
+    __slots__ = ('name', 'attrs', 'start', 'end', 'error', 'children')
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.start = time.perf_counter()
+        self.end = None
+        self.error = None
+        self.children = []
+
+    @property
+    def duration(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def to_dict(self, origin=None):
+        """
+        :param origin: start of the root span. Offsets are relative to it.
+        :return: the span tree as a JSON serializable dict (times in milliseconds)
+        """
+        if origin is None:
+            origin = self.start
+        span = {'name': self.name,
+                'offset_ms': round((self.start - origin) * 1000, 3),
+                'duration_ms': round(self.duration * 1000, 3)}
+        if self.attrs:
+            span['attrs'] = self.attrs
+        if self.error is not None:
+            span['error'] = self.error
+        if self.children:
+            span['children'] = [child.to_dict(origin) for child in self.children]
+        return span
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Record a child span of the current one. It's a no-op when the update is not traced.
+    Example:
+        with tracing.span('db.get_user'):
+            db_user = db.get_user(user.id)
+    :param name: name of the operation
+    :param attrs: extra attributes stored with the span (exchange, symbol...)
+    """
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(name, attrs)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = repr(e)
+        raise
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def get_slow_logger():
+    """
+    :return: the logger writing the slow updates to the rotating JSONL file
+    """
+    global _slow_logger
+    if _slow_logger is None:
+        logger = logging.getLogger('obbot.slow_requests')
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        handler = RotatingFileHandler(config.tracing_slow_log,
+                                      maxBytes=config.tracing_log_max_bytes,
+                                      backupCount=config.tracing_log_backups,
+                                      encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        _slow_logger = logger
+    return _slow_logger
+
+
+def dump_profile(profiler, command, update_id):
+    """
+    Save the profile stats and keep only the newest config.tracing_profile_keep files.
+    :return: the path to the .prof file (open it with pstats or snakeviz)
+    """
+    profile_path = os.path.join(config.data_path, 'profiles')
+    os.makedirs(profile_path, exist_ok=True)
+    timestamp = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    filename = os.path.join(profile_path, f"{timestamp}_{command}_{update_id}.prof")
+    pstats.Stats(profiler).dump_stats(filename)
+
+    profiles = sorted(glob.glob(os.path.join(profile_path, '*.prof')), key=os.path.getmtime)
+    for old_profile in profiles[:-config.tracing_profile_keep]:
+        try:
+            os.remove(old_profile)
+        except OSError:
+            pass
+    return filename
+
+
+def write_slow_update(root, command, update, profile_file=None):
+    record = {'timestamp': datetime.datetime.utcnow().isoformat(timespec='milliseconds') + 'Z',
+              'command': command,
+              'update_id': getattr(update, 'update_id', None),
+              'user_id': getattr(getattr(update, 'effective_user', None), 'id', None),
+              'text': getattr(getattr(update, 'effective_message', None), 'text', None),
+              'duration_ms': round(root.duration * 1000, 3),
+              'trace': root.to_dict()}
+    if profile_file is not None:
+        record['profile'] = profile_file
+    get_slow_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def trace_update(command):
+    """
+    Decorator recording the span tree of a Telegram command handler.
+    It only does something when config.tracing_enabled is True.
+    Note: cProfile captures everything running in the event loop while the handler
+    is active, including other updates that are being processed concurrently.
+    :param command: the command name (tc, ob, wallsize...)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(update, context):
+            global _profiling
+            if not config.tracing_enabled:
+                return await func(update, context)
+
+            root = Span('handler', {'command': command})
+            token = _current_span.set(root)
+            profiler = None
+            if config.tracing_profile and not _profiling:
+                _profiling = True
+                profiler = cProfile.Profile()
+                profiler.enable()
+            try:
+                return await func(update, context)
+            except BaseException as e:
+                root.error = repr(e)
+                raise
+            finally:
+                root.end = time.perf_counter()
+                _current_span.reset(token)
+                profile_file = None
+                if profiler is not None:
+                    profiler.disable()
+                    _profiling = False
+                    if root.duration >= config.tracing_profile_threshold:
+                        profile_file = dump_profile(profiler, command, getattr(update, 'update_id', None))
+                if root.duration >= config.tracing_slow_threshold:
+                    write_slow_update(root, command, update, profile_file)
+        return wrapper
+    return decorator
@@ -1,33 +1,235 @@
 import config
+import metrics
+import shared_cache
+import snapshot
 import time
 import os
+import asyncio
+import hashlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
 from bs4 import BeautifulSoup
 import numpy as np
 import pandas as pd
 import utils
 import re
-from datetime import datetime, timedelta
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+# A change between two consecutive scraps. price/amount are None for removed walls and
+# previous_price/previous_amount are None for new ones.
+WallEvent = namedtuple('WallEvent', ['type', 'coin', 'wall_type', 'price', 'amount',
+                                     'previous_price', 'previous_amount'])
+
+ROWS = metrics.registry.register(metrics.Counter(
+    'obbot_trendcore_rows_total',
+    'Scraped TrendCore rows by result (parsed, reused from the previous snapshot).',
+    ['result']))
+
+PAGES = metrics.registry.register(metrics.Counter(
+    'obbot_trendcore_pages_total',
+    'TrendCore page downloads by result (parsed, not_modified = 304, unchanged = same body as the previous one).',
+    ['result']))
+
+EVENTS = metrics.registry.register(metrics.Counter(
+    'obbot_trendcore_events_total',
+    'TrendCore wall changes by type (appeared, shrank, removed, moved).',
+    ['type']))
+
+# 'USD per level' cells: amount, unit (K = thousands, M = millions) and the % left in parentheses.
+# Example: 123K (45% left). The cells with any other format are parsed one by one.
+USD_PER_LEVEL = re.compile(r'^\s*(?P<usd>(?P<amount>\d+(?:\.\d+)?)(?P<unit>[KM]?))'
+                           r'(?:\s\((?P<left>\d+(?:\.\d+)?)%[^()]*\))?\s*$')
+UNITS = {'K': 1000, 'M': 1e6}
+# The website shows the creation time of the walls in Moscow time (UTC+3)
+TRENDCORE_TIMEZONE = timezone(timedelta(hours=3))
+
+# Parsed rows of the previous scrap by (Coin, Price), to reprocess only the changed walls
+_previous_rows = None
+# {(Coin, Price): (wall type, amount)} of the previous scrap, to build the events
+_previous_walls = None
+# (callback, event loop or None) receiving the list of WallEvent after every scrap
+_listeners = []
+# Persistent HTTP session of the scraper (keep-alive between refreshes)
+_session = None
+# Validators of the last parsed page: ETag, Last-Modified and the hash of the body
+_validators = {}
+# Dataframe of the last parsed page, reused when the page didn't change
+_last_dataframe = None
+# Last loaded table as (time of the data, dataframe). A refresh replaces the whole tuple,
+# so the readers always get a complete table.
+_published = None
+# Refresh in flight (asyncio future), shared by all the concurrent callers of TrendCore.load()
+_refresh = None
+
+
+def get_session():
+    """
+    :return: the HTTP session used to download the TrendCore page (created on first use)
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        _session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        _session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        # gzip and deflate, plus br when brotli (or brotlicffi) is installed
+        _session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+    return _session
+
+
+def _refresh_done(future):
+    global _refresh
+    _refresh = None
+
+
+def elapsed_minutes(created):
+    """
+    :param created: Series with the creation time of the walls (UTC)
+    :return: the minutes since the walls were created
+    """
+    return round((datetime.utcnow() - created).dt.total_seconds() / 60)
+
+
+def subscribe(callback, loop=None):
+    """
+    Receive the wall changes after every scrap of this process.
+    The scrap runs in a worker thread (see TrendCore.load), so the callback is scheduled on
+    the event loop of the subscriber with loop.call_soon_threadsafe: it can use the bot and
+    the loop. Subscribed without an event loop (no loop given or running), the callback is
+    called in the thread of the scrap and must be thread-safe.
+    :param callback: called with the list of WallEvent (it can be empty). The first scrap has
+                     nothing to compare with and is not notified.
+    :param loop: event loop running the callback (default: the running loop, if any)
+    """
+    if loop is None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+    _listeners.append((callback, loop))
+
+
+def _notify(callback, events):
+    try:
+        callback(events)
+    except Exception as e:
+        print(f"Error in TrendCore event subscriber: {e}")
 
 
 class TrendCore():
+    """
+    How to use this class (from a coroutine):
+
+    tc = await TrendCore.load()
+    message = tc.get_formatted_data(wallsize, distance)
+
+    TrendCore() loads the table synchronously instead (it blocks until the scrap is done).
+    """
     #cached data for 1 minute
     filename = ""
     # dataframe
     dataframe = pd.DataFrame()
+    # Time of the data (scrap time)
+    updated_at = None
+    # WallEvent list of the last scrap (empty when the data came from the cache)
+    events = []
 
-    def __init__(self):
+    def __init__(self, dataframe=None, updated_at=None):
         """
         Initialize the class and call the scrapper if the cached file contains outdated information
+        :param dataframe: use this table instead of loading it (see TrendCore.load)
+        :param updated_at: time of the table
         """
         # get the proper filename
-        self.filename = config.trendcore_csv
+        self.filename = config.trendcore_snapshot
+        if dataframe is not None:
+            self.dataframe = dataframe
+            self.updated_at = updated_at
+            return
+        cache = shared_cache.get_cache()
+        if cache is not None:
+            # Several bot instances: only one of them scraps the website when the snapshot expires
+            self.updated_at, self.dataframe = self.load_from_shared_cache(cache)
         # load the dataframe from server when more than 1 minute has elapsed since the last retrieved file
-        if self.elapsed_more_than_minute():
-            self.dataframe = self.scrap()
         else:
-            self.dataframe = pd.read_csv(self.filename)
-            self.dataframe.set_index("Coin", inplace=True)
+            dataframe = None
+            if not self.elapsed_more_than_minute():
+                with metrics.stage('read_cache'):
+                    self.updated_at = os.path.getmtime(self.filename)
+                    dataframe = self.read_snapshot()
+            metrics.cache_lookup('trendcore_snapshot', hit=dataframe is not None)
+            if dataframe is None:
+                with metrics.stage('trendcore_scrape'):
+                    self.updated_at = time.time()
+                    dataframe = self.scrap()
+            self.dataframe = dataframe
+
+    @classmethod
+    async def load(cls):
+        """
+        Get the TrendCore table without blocking the event loop. The last table is kept in
+        memory for config.trendcore_memory_ttl seconds. After that a single refresh (snapshot
+        read or scrap) runs in a thread and all the concurrent callers wait for it.
+        :return: TrendCore
+        """
+        global _refresh
+        published = _published
+        if published is not None and time.time() - published[0] <= config.trendcore_memory_ttl:
+            metrics.cache_lookup('trendcore_memory', hit=True)
+            return cls(published[1], published[0])
+        metrics.cache_lookup('trendcore_memory', hit=False)
+        if _refresh is None:
+            _refresh = asyncio.ensure_future(asyncio.to_thread(cls.publish))
+            _refresh.add_done_callback(_refresh_done)
+        # A cancelled caller doesn't cancel the refresh of the others
+        updated_at, dataframe = await asyncio.shield(_refresh)
+        return cls(dataframe, updated_at)
+
+    @classmethod
+    def publish(cls):
+        """
+        Load the table and make it the one returned by TrendCore.load().
+        :return: (time of the data, dataframe)
+        """
+        global _published
+        tc = cls()
+        _published = (tc.updated_at, tc.dataframe)
+        return _published
+
+    def read_snapshot(self):
+        """
+        :return: the dataframe saved by the last scrap or None if the file can't be read
+        """
+        try:
+            return snapshot.read(self.filename)
+        except (OSError, snapshot.SnapshotError) as e:
+            print(f"Error reading the TrendCore snapshot: {e}")
+            return None
+
+    def load_from_shared_cache(self, cache):
+        """
+        Retrieve the TrendCore snapshot from the shared cache (see shared_cache.py).
+        :param cache: shared_cache.SharedCache
+        :return: (time of the data, dataframe)
+        """
+        scraped = False
+
+        def refresh():
+            nonlocal scraped
+            scraped = True
+            with metrics.stage('trendcore_scrape'):
+                return snapshot.dumps(self.scrap(), {'updated_at': time.time()})
+
+        try:
+            dataframe, metadata = snapshot.loads(cache.get_or_refresh('trendcore', config.shared_cache_ttl, refresh))
+        except snapshot.SnapshotError as e:
+            # Written by an older version (pickle) or corrupted: replace it
+            print(f"Invalid TrendCore table in the shared cache: {e}")
+            cache.delete('trendcore')
+            dataframe, metadata = snapshot.loads(cache.get_or_refresh('trendcore', config.shared_cache_ttl, refresh))
+        metrics.cache_lookup('shared_trendcore', hit=not scraped)
+        return metadata['updated_at'], dataframe
 
     def get_data(self, min_wall_size=100_000, max_distance_to_level=5.0):
         """
@@ -76,13 +278,24 @@ class TrendCore():
                        f"{row['USD per level']}",
                        f"{row['To level %']:.2f}%",
                        f"{row['Wall type icon']}",
-                       f"{row['Estimate time to corrode (mins)']}'"
+                       self.format_estimate(row['Estimate time to corrode (mins)'])
                        ]
             rows.append(columns)
         if len(rows) == 0:
             return f"There are no coins with the current filters:\nWallsize: {min_wall_size:.0f}, Distance: {max_distance_to_level:.2f}%"
         return utils.format_telegram_message(rows)
 
+    @staticmethod
+    def format_estimate(minutes):
+        """
+        :param minutes: estimated time to corrode the wall, missing for the market scanner
+                        (there is no trade flow to estimate it)
+        :return: Example: 15' or - when there is no estimate
+        """
+        if minutes is None or pd.isna(minutes):
+            return '-'
+        return f"{minutes}'"
+
     def icon_from_elapsed_time(self, minutes):
         """
         From trendcore documentation:
@@ -122,16 +335,75 @@ class TrendCore():
         return current_time - modification_time > 60  # more than 60 seconds
 
     def scrap(self):
+        global _last_dataframe
         # target URL to scrap
         url = config.trendcore_url
         start_time = time.time()
         print(f"Retrieving new information from server...")
 
-        # send a GET request
-        response = requests.get(url)
+        # send a GET request, conditional when we have the previous page
+        headers = {}
+        if _last_dataframe is not None:
+            if 'ETag' in _validators:
+                headers['If-None-Match'] = _validators['ETag']
+            if 'Last-Modified' in _validators:
+                headers['If-Modified-Since'] = _validators['Last-Modified']
+        response = get_session().get(url, headers=headers,
+                                     timeout=(config.trendcore_connect_timeout, config.trendcore_read_timeout))
+
+        if response.status_code == 304:
+            PAGES.inc(result='not_modified')
+            df = self.reuse_last_dataframe()
+        else:
+            response.raise_for_status()
+            body_hash = hashlib.sha256(response.content).hexdigest()
+            unchanged = _last_dataframe is not None and body_hash == _validators.get('hash')
+            _validators.clear()
+            _validators.update({name: response.headers[name] for name in ('ETag', 'Last-Modified')
+                                if name in response.headers})
+            _validators['hash'] = body_hash
+            if unchanged:
+                # Same page without validators (or the server ignored them): nothing to parse
+                PAGES.inc(result='unchanged')
+                df = self.reuse_last_dataframe()
+            else:
+                PAGES.inc(result='parsed')
+                df = self.parse_table(response.text)
+                df = self.process_rows(df)
+                # order the data frame distance to level
+                df.sort_values('Distance', ascending=True, inplace=True)
+                _last_dataframe = df
+        # compare with the previous snapshot and notify the subscribers
+        self.events = self.diff(df)
+        # cached the dataframe
+        snapshot.write(df, self.filename)
+        # measure the time it took to complete the web scrapping
+        end_time = time.time()
+        elapsed_time = end_time - start_time
+        if elapsed_time >= 60:
+            elapsed_time_minutes = elapsed_time / 60
+            print("Scrapping time:", elapsed_time_minutes, "minutes")
+        else:
+            print("Scrapping time:", elapsed_time, "seconds")
+
+        return df
+
+    def reuse_last_dataframe(self):
+        """
+        :return: the dataframe of the last parsed page with the elapsed minutes updated
+        """
+        df = _last_dataframe.copy()
+        df['Elapsed Minutes'] = elapsed_minutes(df['Created'])
+        return df
 
+    def parse_table(self, html):
+        """
+        Read the wall table of the TrendCore page.
+        :param html: the web page
+        :return: dataframe with the raw text columns (index: Coin)
+        """
         # parse the HTML from the web page
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = BeautifulSoup(html, 'html.parser')
 
         # find the main table
         table = soup.find('table')
@@ -159,13 +431,8 @@ class TrendCore():
                 if len(table_data) > 0 and th == 'Монета':
                     # The following information came from the first parsed column only.
                     # 1. Parse the time when the wall was created (inside the title's attribute in second img tag)
-                    s_datetime = td.findAll('img')[1].get('title')  # 2023-06-14 04:06:37 (111.1 ч. назад)
-                    # This time is GMT+3 (Moscow Zone). We have to remove 3 hours
-                    if s_datetime is not None:
-                        s_datetime = re.sub(r'\(.*?\)', '', s_datetime).strip()  # 2023-06-14 04:06:37
-                        t_row['Created'] = datetime.strptime(s_datetime, '%Y-%m-%d %H:%M:%S') - timedelta(hours=3)
-                    else:
-                        t_row['Created'] = datetime.utcnow()  # Instead of none
+                    # (parsed later for all the rows at once, see process_rows)
+                    t_row['Created'] = td.findAll('img')[1].get('title')  # 2023-06-14 04:06:37 (111.1 ч. назад)
                     # Parse the link to the coin
                     t_row['Link'] = td.find('a').get('href').replace('/ru','/en')  # I will rename /ru to /en
             table_data.append(t_row)
@@ -179,14 +446,55 @@ class TrendCore():
 
         # set the index to the Coin
         df.set_index("Coin", inplace=True)
-        # extract the info in parentheses into a new column 'Amount left'
-        df['Amount left %'] = df['USD per level'].str.extract('\((.*?)\)')
-        # remove the '% left' and cast it to float.
-        df['Amount left %'] = df['Amount left %'].str.replace('[^\.|\d]', '', regex=True)
-        # remove the parenthesis from the 'USD per level' column
-        df['USD per level'] = df['USD per level'].str.replace('\s\(.*?\)', '', regex=True).str.strip()
-        # create new column to convert to numeric value. Replace K to 1000 and M to 1000000
-        df['Amount'] = df['USD per level'].apply(utils.convert_units).astype(float)
+        return df
+
+    def process_rows(self, df):
+        """
+        Parse the raw columns of the scraped table. Most walls don't change from one minute
+        to the next, so the rows whose (Coin, Price) was already in the previous snapshot with
+        the same 'USD per level' and 'Created' reuse the parsed values. Only the new or changed
+        rows go through the parsing, which works on whole columns: one regex extraction for the
+        amount, unit and % left, the units scaled with NumPy and the dates parsed in bulk.
+        :param df: dataframe with the raw text columns (index: Coin)
+        :return: the processed dataframe
+        """
+        global _previous_rows
+        # Remove the relative time. Example: 2023-06-14 04:06:37 (111.1 ч. назад) -> 2023-06-14 04:06:37
+        df['Created'] = df['Created'].str.replace(r'\(.*?\)', '', regex=True).str.strip()
+        keys = pd.MultiIndex.from_arrays([df.index, df['Price']])
+        raw = df[['USD per level', 'Created']].set_axis(keys)
+        parsed_columns = ['Amount left %', 'USD per level', 'Amount', 'Created']
+
+        reuse = np.zeros(len(df), dtype=bool)
+        if _previous_rows is not None:
+            previous = _previous_rows.reindex(keys)
+            reuse = ((previous['Raw USD per level'].values == raw['USD per level'].values) &
+                     (previous['Raw Created'].values == raw['Created'].values) &
+                     raw['Created'].notna().values)
+
+        changed = df[~reuse]
+        parsed = self.parse_usd_per_level(changed['USD per level'])
+        # This time is GMT+3 (Moscow Zone): convert it to UTC (naive)
+        created = pd.to_datetime(changed['Created'], format='%Y-%m-%d %H:%M:%S')
+        created = created.dt.tz_localize(TRENDCORE_TIMEZONE).dt.tz_convert('UTC').dt.tz_localize(None)
+        parsed['Created'] = created.fillna(pd.Timestamp(datetime.utcnow())).values  # Instead of none
+        parsed.index = np.flatnonzero(~reuse)
+        if reuse.any():
+            reused = previous[parsed_columns][reuse]
+            reused.index = np.flatnonzero(reuse)
+            parsed = pd.concat([reused, parsed]).sort_index()
+        ROWS.inc(len(df) - len(changed), result='reused')
+        ROWS.inc(len(changed), result='parsed')
+
+        rows = parsed.set_axis(keys)
+        rows['Raw USD per level'] = raw['USD per level']
+        rows['Raw Created'] = raw['Created']
+        # Duplicated (Coin, Price) can't be looked up: they are parsed every time
+        _previous_rows = rows[~rows.index.duplicated(keep=False)]
+
+        df['Amount left %'] = parsed['Amount left %'].values
+        df['USD per level'] = parsed['USD per level'].values
+        df['Amount'] = parsed['Amount'].values
         # format 'To level %' column as float. This is the distance from the current price to the level
         df['To level %'] = df['To level %'].str.replace('%','').str.rstrip().astype(float)
         # create a column to measure the distance to level in absolute values
@@ -194,25 +502,94 @@ class TrendCore():
         # create a new column for Order type depending on the distance to the wall (above or below)
         df['Wall type'] = np.where(df['To level %'] > 0, 'sell','buy')
         # convert the created column to pandas datetime
-        df['Created'] = pd.to_datetime(df['Created'])
+        df['Created'] = pd.to_datetime(parsed['Created'].values)
         # calculate the time (in minutes) the wall was created. We are going to calculate from the Created column
         # we are going to use this column to create the icon for the alert (moon emoji icon)
-        df['Elapsed Minutes'] = round((datetime.utcnow() - df['Created']).dt.total_seconds() / 60)
-        # order the data frame distance to level
-        df.sort_values('Distance', ascending=True, inplace=True)
-        # cached the dataframe
-        df.to_csv(self.filename)
-        # measure the time it took to complete the web scrapping
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        if elapsed_time >= 60:
-            elapsed_time_minutes = elapsed_time / 60
-            print("Scrapping time:", elapsed_time_minutes, "minutes")
-        else:
-            print("Scrapping time:", elapsed_time, "seconds")
-
+        df['Elapsed Minutes'] = elapsed_minutes(df['Created'])
         return df
 
+    @staticmethod
+    def parse_usd_per_level(values):
+        """
+        Split the 'USD per level' cells. Example: 123K (45% left) -> 123K, 123000.0, 45
+        :param values: Series with the raw cells
+        :return: DataFrame with the 'Amount left %', 'USD per level' (without the parentheses)
+                 and 'Amount' (in USD) columns
+        """
+        parts = values.str.extract(USD_PER_LEVEL)
+        # Replace K to 1000 and M to 1000000
+        scale = np.select([parts['unit'] == unit for unit in UNITS], list(UNITS.values()), 1.0)
+        parsed = pd.DataFrame({'Amount left %': parts['left'],
+                               'USD per level': parts['usd'],
+                               'Amount': parts['amount'].astype(float).values * scale},
+                              index=values.index)
+
+        irregular = parts['usd'].isna().values
+        if irregular.any():
+            values = values[irregular]
+            # extract the info in parentheses into a new column 'Amount left' and remove the '% left'
+            left = values.str.extract(r'\((.*?)\)')[0].str.replace(r'[^\.|\d]', '', regex=True)
+            # remove the parenthesis from the 'USD per level' column
+            usd = values.str.replace(r'\s\(.*?\)', '', regex=True).str.strip()
+            parsed.loc[irregular, 'Amount left %'] = left.values
+            parsed.loc[irregular, 'USD per level'] = usd.values
+            parsed.loc[irregular, 'Amount'] = usd.apply(utils.convert_units).astype(float).values
+        return parsed
+
+    def diff(self, df):
+        """
+        Compare the new snapshot with the previous one (by Coin and Price) and notify the subscribers.
+        - appeared: new wall
+        - removed: the wall is gone
+        - shrank: same wall with a smaller amount
+        - moved: a wall of the same coin and type was removed and another one appeared at a
+          different price (paired by the nearest price)
+        The first scrap of the process has nothing to compare with and returns no events.
+        :param df: the processed dataframe
+        :return: list of WallEvent
+        """
+        global _previous_walls
+        walls = {}
+        # Keyed by the parsed price: the events carry numbers
+        for coin, price, amount, wall_type in zip(df.index, df['Price'].astype(float), df['Amount'],
+                                                  df['Wall type']):
+            walls[(coin, price)] = (wall_type, amount)
+        previous_walls, _previous_walls = _previous_walls, walls
+        if previous_walls is None:
+            return []
 
+        events = []
+        removed = {}
+        appeared = {}
+        for key, (wall_type, amount) in previous_walls.items():
+            if key not in walls:
+                removed.setdefault((key[0], wall_type), []).append((key[1], amount))
+            elif walls[key][1] < amount:
+                events.append(WallEvent('shrank', key[0], wall_type, key[1], walls[key][1], key[1], amount))
+        for key, (wall_type, amount) in walls.items():
+            if key not in previous_walls:
+                appeared.setdefault((key[0], wall_type), []).append((key[1], amount))
 
+        for (coin, wall_type), new_walls in appeared.items():
+            old_walls = removed.pop((coin, wall_type), [])
+            for price, amount in new_walls:
+                if old_walls:
+                    nearest = min(old_walls, key=lambda wall: abs(wall[0] - price))
+                    old_walls.remove(nearest)
+                    events.append(WallEvent('moved', coin, wall_type, price, amount, *nearest))
+                else:
+                    events.append(WallEvent('appeared', coin, wall_type, price, amount, None, None))
+            for price, amount in old_walls:
+                events.append(WallEvent('removed', coin, wall_type, None, None, price, amount))
+        for (coin, wall_type), old_walls in removed.items():
+            for price, amount in old_walls:
+                events.append(WallEvent('removed', coin, wall_type, None, None, price, amount))
 
+        for event in events:
+            EVENTS.inc(type=event.type)
+        for callback, loop in _listeners:
+            if loop is None:
+                _notify(callback, events)
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(_notify, callback, events)
+        return events
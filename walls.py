@@ -0,0 +1,216 @@
+"""
+Wall detectors for the aggregated order book.
+A detector receives one side of the book (sorted by price) and returns the positions of
+the walls. Select it with config.wall_detector:
+- 'prominence': levels standing out from their neighbours by at least the wall size.
+  Same result as scipy.signal.find_peaks(sizes, prominence=wallsize), in NumPy.
+- 'topk': the k biggest levels within the user's distance from the current price
+  (optionally k per exchange).
+- 'zscore': levels whose size is far above the rolling mean of the surrounding levels.
+
+All of them ignore the levels smaller than the wall size.
+"""
+
+import numpy as np
+import config
+
+
+class WallDetector():
+    """
+    Base class of the wall detectors.
+    How to use a detector:
+
+    detector = get_detector(wallsize=100_000, max_distance=5.0)
+    walls = detector.detect(prices, sizes_usd, exchanges, current_price)
+    """
+
+    name = ""
+
+    def __init__(self, wallsize=100_000, max_distance=None):
+        """
+        :param wallsize: minimum size of a wall in USD
+        :param max_distance: maximum distance from the current price in % (None = no limit)
+        """
+        self.wallsize = wallsize
+        self.max_distance = max_distance
+
+    def detect(self, prices, sizes, exchanges, current_price):
+        """
+        :param prices: price of every level (sorted)
+        :param sizes: size of every level in USD
+        :param exchanges: exchange of every level
+        :param current_price: last price of the symbol
+        :return: the positions of the walls in ascending order (int array)
+        """
+        raise NotImplementedError()
+
+    def within_distance(self, prices, current_price):
+        """
+        :return: boolean mask of the levels inside the distance window
+        """
+        if self.max_distance is None:
+            return np.ones(len(prices), dtype=bool)
+        return np.abs(prices - current_price) / current_price * 100 <= self.max_distance
+
+
+def _sparse_table(values, reduce):
+    """
+    table[k][i] = reduce(values[i:i + 2 ** k]). Answers range min/max queries in O(1).
+    """
+    table = [values]
+    step = 1
+    while step * 2 <= len(values):
+        previous = table[-1]
+        table.append(reduce(previous[:-step], previous[step:]))
+        step *= 2
+    return table
+
+
+def local_maxima(values):
+    """
+    Local maxima like scipy.signal.find_peaks: the middle of a flat top counts once,
+    and the first and last samples are never maxima.
+    :return: positions of the maxima
+    """
+    if len(values) < 3:
+        return np.empty(0, dtype=np.int64)
+    # Compress the runs of equal values
+    starts = np.flatnonzero(np.concatenate(([True], values[1:] != values[:-1])))
+    ends = np.concatenate((starts[1:], [len(values)])) - 1
+    run_values = values[starts]
+    is_peak = np.zeros(len(starts), dtype=bool)
+    is_peak[1:-1] = (run_values[1:-1] > run_values[:-2]) & (run_values[1:-1] > run_values[2:])
+    return (starts[is_peak] + ends[is_peak]) // 2
+
+
+def peak_prominences(values, peaks):
+    """
+    Prominence of each peak (scipy.signal.peak_prominences without wlen): the height of the
+    peak over the highest of the two lowest points found on each side before reaching a
+    higher sample. The searches are done for all the peaks at once with binary lifting over
+    sparse tables, O(n log n) overall.
+    :return: prominence of every peak
+    """
+    if len(peaks) == 0:
+        return np.empty(0, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)
+    maximum = _sparse_table(values, np.maximum)
+    minimum = _sparse_table(values, np.minimum)
+    count = len(peaks)
+    heights = np.concatenate((values[peaks], values[peaks]))
+
+    # Both searches at once: the first half extends [start, peak) to the left and the
+    # second half (peak, end] to the right while every value stays <= the peak.
+    # bounds holds start and end + 1
+    bounds = np.concatenate((peaks, peaks + 1))
+    direction = np.concatenate((np.full(count, -1), np.ones(count, dtype=np.int64)))
+    for k in range(len(maximum) - 1, -1, -1):
+        size = 1 << k
+        # First position of the block of 2 ** k values next to the current bound
+        block = np.where(direction < 0, bounds - size, bounds)
+        valid = (block >= 0) & (block + size <= len(values))
+        move = valid & (maximum[k].take(block, mode='clip') <= heights)
+        bounds += move * direction * size
+
+    # Minimum of [low, high] from the two overlapping blocks of 2 ** k values
+    flat = np.concatenate(minimum)
+    offsets = np.concatenate(([0], np.cumsum([len(row) for row in minimum])))
+
+    def range_min(low, high):
+        k = np.log2(high - low + 1).astype(np.int64)
+        return np.minimum(flat[offsets[k] + low], flat[offsets[k] + high - (1 << k) + 1])
+
+    return heights[:count] - np.maximum(range_min(bounds[:count], peaks), range_min(peaks, bounds[count:] - 1))
+
+
+class ProminenceDetector(WallDetector):
+    name = 'prominence'
+
+    def detect(self, prices, sizes, exchanges, current_price):
+        sizes = np.asarray(sizes, dtype=np.float64)
+        peaks = local_maxima(sizes)
+        if len(peaks) == 0:
+            return peaks
+        # The prominence can't be bigger than the height over the lowest level
+        peaks = peaks[sizes[peaks] - sizes.min() >= self.wallsize]
+        return peaks[peak_prominences(sizes, peaks) >= self.wallsize]
+
+
+class TopKDetector(WallDetector):
+    name = 'topk'
+
+    def __init__(self, wallsize=100_000, max_distance=None, k=None, per_exchange=None):
+        """
+        :param k: number of walls (config.wall_top_k)
+        :param per_exchange: k walls per exchange instead of k overall (config.wall_top_k_per_exchange)
+        """
+        super().__init__(wallsize, max_distance)
+        self.k = k or config.wall_top_k
+        self.per_exchange = per_exchange if per_exchange is not None else config.wall_top_k_per_exchange
+
+    def top(self, sizes, candidates):
+        if len(candidates) <= self.k:
+            return candidates
+        # argpartition: no need to sort the whole side
+        return candidates[np.argpartition(sizes[candidates], -self.k)[-self.k:]]
+
+    def detect(self, prices, sizes, exchanges, current_price):
+        sizes = np.asarray(sizes, dtype=np.float64)
+        candidates = np.flatnonzero(self.within_distance(np.asarray(prices), current_price) &
+                                    (sizes >= self.wallsize))
+        if not self.per_exchange:
+            return np.sort(self.top(sizes, candidates))
+        exchanges = np.asarray(exchanges)[candidates]
+        walls = [self.top(sizes, candidates[exchanges == exchange]) for exchange in np.unique(exchanges)]
+        return np.sort(np.concatenate(walls)) if walls else candidates
+
+
+class ZScoreDetector(WallDetector):
+    name = 'zscore'
+
+    def __init__(self, wallsize=100_000, max_distance=None, window=None, threshold=None):
+        """
+        :param window: number of levels of the rolling window (config.wall_zscore_window)
+        :param threshold: minimum z-score of a wall (config.wall_zscore_threshold)
+        """
+        super().__init__(wallsize, max_distance)
+        self.window = window or config.wall_zscore_window
+        self.threshold = threshold or config.wall_zscore_threshold
+
+    def detect(self, prices, sizes, exchanges, current_price):
+        sizes = np.asarray(sizes, dtype=np.float64)
+        n = len(sizes)
+        if n == 0:
+            return np.empty(0, dtype=np.int64)
+        # Centered rolling mean and standard deviation from cumulative sums
+        half = self.window // 2
+        cumulative = np.concatenate(([0.0], np.cumsum(sizes)))
+        cumulative_squares = np.concatenate(([0.0], np.cumsum(sizes * sizes)))
+        low = np.maximum(np.arange(n) - half, 0)
+        high = np.minimum(np.arange(n) + half + 1, n)
+        count = high - low
+        mean = (cumulative[high] - cumulative[low]) / count
+        variance = np.maximum((cumulative_squares[high] - cumulative_squares[low]) / count - mean * mean, 0)
+        std = np.sqrt(variance)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            zscore = np.where(std > 0, (sizes - mean) / std, 0.0)
+        return np.flatnonzero((zscore >= self.threshold) & (sizes >= self.wallsize) &
+                              self.within_distance(np.asarray(prices), current_price))
+
+
+DETECTORS = {
+    ProminenceDetector.name: ProminenceDetector,
+    TopKDetector.name: TopKDetector,
+    ZScoreDetector.name: ZScoreDetector,
+}
+
+
+def get_detector(wallsize=100_000, max_distance=None, name=None):
+    """
+    :param name: detector name (default: config.wall_detector)
+    :return: a WallDetector
+    """
+    name = name or config.wall_detector
+    if name not in DETECTORS:
+        raise ValueError(f"Unsupported wall detector {name}. Use one of: {', '.join(DETECTORS)}")
+    return DETECTORS[name](wallsize, max_distance)
@@ -0,0 +1,164 @@
+"""
+Webhook ingestion mode.
+Telegram posts the updates to an aiohttp server. The updates go into a bounded
+queue consumed by a pool of workers that run the handlers. When the queue is full
+the server answers 503 so Telegram retries later (backpressure), and on shutdown
+it stops accepting updates and drains the queue before stopping the bot.
+
+Enable it with config.ingestion_mode = 'webhook' (see the webhook_* settings).
+The updates must carry the secret token (config.webhook_secret): without it anyone reaching
+the endpoint could post forged updates. When the bot registers the webhook itself
+(webhook_url) and no secret is configured, a random one is generated at every start.
+"""
+
+import signal
+import secrets
+import asyncio
+from aiohttp import web
+from telegram import Update
+import config
+import metrics
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+QUEUE_SIZE = metrics.registry.register(metrics.Gauge(
+    'obbot_webhook_queue_size',
+    'Updates waiting in the webhook work queue.'))
+
+UPDATES = metrics.registry.register(metrics.Counter(
+    'obbot_webhook_updates_total',
+    'Updates received through the webhook by result (queued, rejected, invalid).',
+    ['result']))
+
+
+class WebhookServer():
+    """
+    How to use this class:
+
+    server = WebhookServer(application)
+    await server.start()
+    ...
+    await server.stop()
+
+    Or just call webhook.run(application) to serve until SIGINT/SIGTERM.
+    """
+
+    def __init__(self, application, listen=None, port=None, url_path=None, secret_token=None,
+                 queue_size=None, workers=None, webhook_url=None):
+        self.application = application
+        self.listen = listen or config.webhook_listen
+        self.port = port if port is not None else config.webhook_port
+        self.url_path = '/' + (url_path if url_path is not None else config.webhook_path).lstrip('/')
+        self.secret_token = secret_token if secret_token is not None else config.webhook_secret
+        self.webhook_url = webhook_url if webhook_url is not None else config.webhook_url
+        if not self.secret_token:
+            if not self.webhook_url:
+                raise ValueError("webhook_secret is required when the webhook is registered outside "
+                                 "the bot (webhook_url is empty)")
+            # Registered below with set_webhook(): only Telegram knows it
+            self.secret_token = secrets.token_urlsafe(32)
+        self.workers = workers or config.webhook_workers
+        self.queue = asyncio.Queue(maxsize=queue_size or config.webhook_queue_size)
+        self.accepting = False
+        self.runner = None
+        self.worker_tasks = []
+
+    async def handle_update(self, request):
+        if not secrets.compare_digest(request.headers.get(SECRET_HEADER, '').encode(), self.secret_token.encode()):
+            return web.Response(status=403)
+        if not self.accepting:
+            # Shutting down: Telegram will deliver it again after the restart
+            return web.Response(status=503)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            print(f"Invalid update received: {e}")
+            UPDATES.inc(result='invalid')
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            UPDATES.inc(result='rejected')
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        UPDATES.inc(result='queued')
+        QUEUE_SIZE.set(self.queue.qsize())
+        return web.Response()
+
+    async def worker(self):
+        while True:
+            update = await self.queue.get()
+            QUEUE_SIZE.set(self.queue.qsize())
+            try:
+                await self.application.process_update(update)
+            except Exception as e:
+                print(f"Error processing update {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self):
+        await self.application.initialize()
+        if self.application.post_init:
+            await self.application.post_init(self.application)
+        await self.application.start()
+
+        self.worker_tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        app = web.Application()
+        app.router.add_post(self.url_path, self.handle_update)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.listen, self.port)
+        await site.start()
+        if self.port == 0:
+            # Random port (tests and load tests)
+            self.port = self.runner.addresses[0][1]
+        self.accepting = True
+        print(f"Webhook listening on {self.listen}:{self.port}{self.url_path} with {self.workers} workers")
+
+        if self.webhook_url:
+            await self.application.bot.set_webhook(self.webhook_url, secret_token=self.secret_token,
+                                                   max_connections=config.webhook_max_connections)
+
+    async def stop(self, drain_timeout=None):
+        """
+        Stop accepting updates, process the queued ones and stop the bot.
+        :param drain_timeout: maximum seconds to wait for the queue to drain
+        """
+        self.accepting = False
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout or config.webhook_drain_timeout)
+        except asyncio.TimeoutError:
+            print(f"Drain timeout: {self.queue.qsize()} updates were not processed")
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+        await self.application.stop()
+        if self.application.post_stop:
+            await self.application.post_stop(self.application)
+        await self.application.shutdown()
+        if self.application.post_shutdown:
+            await self.application.post_shutdown(self.application)
+
+
+async def serve(application):
+    server = WebhookServer(application)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop_event.set)
+    await server.start()
+    try:
+        await stop_event.wait()
+    finally:
+        print("Shutting down, draining the webhook queue...")
+        await server.stop()
+
+
+def run(application):
+    """
+    Serve the webhook until SIGINT/SIGTERM.
+    :param application: telegram.ext.Application with the handlers
+    """
+    asyncio.run(serve(application))